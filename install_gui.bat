@@ -5,6 +5,7 @@ call python -m pip install --upgrade pip
 call conda install -y pyqt=4 
 call conda install -y numpy
 call conda install -y pytables
+call conda install -y h5py
 call conda install -y lxml
 call pip install dist\gui_vm-0.75-py2-none-any.whl
 echo.
@@ -35,6 +35,7 @@ setup(
         #'setuptools'#,
         #'numpy',
         #'tables',
+        #'h5py',
         #'lxml'
     ],
 
@@ -47,6 +48,7 @@ setup(
     entry_points={
         'console_scripts': [
             'gui_vm=gui_vm.main:startmain',
+            'gui_vm_batch=gui_vm.batch_run:startmain',
             'get_param_from_config=gui_vm.get_param_from_config:main'
         ],
     },
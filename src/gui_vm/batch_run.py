@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        batch_run.py
+## Purpose:     validate and run scenarios of a project without the GUI
+##              (no Qt needed, e.g. for scheduled runs on compute nodes)
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+from argparse import ArgumentParser
+import multiprocessing
+import sys
+import os
+import threading
+
+from gui_vm.config.config import Config
+from gui_vm.model.project_tree import XMLParser, TreeNode, Scenario
+from gui_vm.model.process import Process
+from gui_vm.model.backend import h5_lock
+from gui_vm.model.scheduler import RunScheduler
+from gui_vm.model.outcome import SUCCEEDED, FAILED, HUNG
+
+config = Config()
+
+# seconds between two checks of the heartbeat of a run
+HEARTBEAT_INTERVAL = 10
+
+
+def load_project(project_file):
+    '''
+    read the project from the given xml-file, changes of the project are
+    written back to this file (like the autosave of the GUI)
+
+    Return
+    ------
+    project: Project
+    '''
+    root = TreeNode('root')
+    XMLParser.read_xml(root, project_file)
+    project = root.child_at_row(0)
+    project.project_folder = os.path.split(os.path.abspath(project_file))[0]
+    if not config.save_disabled:
+        # runs of multiple scenarios may change the project at the same time
+        lock = threading.Lock()
+        def write():
+            with lock:
+                XMLParser.write_xml(project, project.filename)
+        project.on_change(write)
+    return project
+
+
+def print_status(text, progress=None):
+    '''
+    print the messages of a run to stdout
+    '''
+    text = str(text).strip()
+    if not text:
+        return
+    if progress is not None:
+        text = '[{:5.1f}%] {}'.format(progress, text)
+    sys.stdout.write(text + '\n')
+    sys.stdout.flush()
+
+
+def validate_scenario(scenario, callback=print_status):
+    '''
+    update and validate the inputs of the scenario
+
+    Parameters
+    ----------
+    callback: function, optional
+              is called with warnings (e.g. failed updates in the worker
+              processes)
+
+    Return
+    ------
+    errors: list of Strings, messages of the invalid inputs
+            (empty if valid)
+    '''
+    scenario.update(callback=callback)
+    scenario.validate()
+    cache = scenario.project.validation_cache
+    if cache is not None and callback:
+        for warning in cache.pop_warnings():
+            callback(warning)
+    errors = []
+    for input_node in scenario.get_input_files():
+        if input_node.is_checked and not input_node.is_valid:
+            resource = input_node.resource
+            message = resource.status[resource.name][1]
+            errors.append('{}: {}'.format(input_node.name, message))
+    return errors
+
+
+def run_scenario(project, scenario_name, run_name=Scenario.PRIMARY_RUN,
+                 options=None, callback=print_status):
+    '''
+    validate the scenario and execute the run with the given name,
+    waits until the run is finished
+
+    Parameters
+    ----------
+    project:       Project, the project containing the scenario
+    scenario_name: String, the name of the scenario to run
+    run_name:      String, optional
+                   the name of the run (defaults to the primary run)
+    options:       dict, optional
+                   the options of the run, the stored options are taken for
+                   existing specific runs if not given
+    callback:      function, optional
+                   is called with the messages and the progress of the run
+
+    Return
+    ------
+    tuple (status, message), status is the outcome of the run (SUCCEEDED,
+    FAILED or HUNG)
+    '''
+    scenario = project.get_child(scenario_name)
+    if not isinstance(scenario, Scenario):
+        return FAILED, 'Szenario "{}" nicht gefunden!'.format(scenario_name)
+    if scenario.locked:
+        return FAILED, 'Szenario "{}" ist gesperrt!'.format(scenario_name)
+
+    # runs of other scenarios may be executed at the same time (see
+    # scheduler), the validation reads the files under the lock, the run
+    # handles its files under the lock itself (see Scenario.run)
+    with h5_lock:
+        errors = validate_scenario(scenario, callback=callback)
+        if errors or not scenario.is_valid:
+            return FAILED, ('Das Szenario ist fehlerhaft. Der Lauf kann nicht '
+                            'gestartet werden.\n' + '\n'.join(errors))
+
+        primary = scenario.primary_run
+        # specific runs become invalid if primary run is executed again, they
+        # are removed after the primary run succeeded (see Scenario.run)
+        if run_name != Scenario.PRIMARY_RUN:
+            if primary is None:
+                return FAILED, 'Der Gesamtlauf fehlt!'
+            primary.update()
+            primary.validate()
+            if not primary.is_valid:
+                return FAILED, ('Der Gesamtlauf ist fehlerhaft! Bitte führen '
+                                'Sie ihn erneut aus, bevor Sie spezifische '
+                                'Läufe starten!')
+            if options is None:
+                specific_run = scenario.get_output(run_name)
+                if not specific_run:
+                    return FAILED, ('Lauf "{}" in Szenario "{}" nicht '
+                                    'gefunden!'.format(run_name, scenario_name))
+                options = specific_run.options
+
+    # interrupted runs are resumed from their last checkpoint
+    resume = bool(config.settings.get('run_resume', True))
+    process = Process()
+    outcome = scenario.run(process, run_name, options=options,
+                           callback=callback, resume=resume)
+    # runs without any output for too long are killed
+    while process.wait(HEARTBEAT_INTERVAL) is None:
+        if outcome.check_heartbeat():
+            callback(outcome.message)
+            process.kill()
+    process.wait()
+    project.emit()
+
+    if outcome.status == HUNG:
+        return HUNG, 'Lauf "{}" in Szenario "{}" hängt: {}'.format(
+            run_name, scenario_name, outcome.message)
+    if outcome.status != SUCCEEDED:
+        return FAILED, 'Lauf "{}" in Szenario "{}" fehlgeschlagen! {}'.format(
+            run_name, scenario_name, outcome.message)
+    return SUCCEEDED, 'Lauf "{}" in Szenario "{}" erfolgreich beendet.'.format(
+        run_name, scenario_name)
+
+
+def startmain():
+    # validation spawns worker processes (needed for frozen executables)
+    multiprocessing.freeze_support()
+    parser = ArgumentParser(description="GUI Verkehrsmodelle - Szenarien "
+                                        "ohne Oberfläche rechnen")
+
+    parser.add_argument("-f", '--xml', action="store",
+                        help="XML-Projektdatei",
+                        dest="project_file", required=True)
+
+    parser.add_argument("-s", '--scenario', action="store", nargs='+',
+                        help="angegebene Szenarien ausführen",
+                        dest="scenario_names", default=[])
+
+    parser.add_argument("-a", '--all', action="store_true",
+                        help="alle Szenarien des Projekts ausführen",
+                        dest="all_scenarios", default=False)
+
+    parser.add_argument("-r", '--run', action="store",
+                        help="angegebenen Lauf ausführen (Standard: Gesamtlauf)",
+                        dest="run_name", default=Scenario.PRIMARY_RUN)
+
+    parser.add_argument("-c", '--calibrate', action="store_true",
+                        help="Kalibrierung (nur Gesamtlauf)",
+                        dest="calibrate", default=False)
+
+    parser.add_argument('--nobalancing', action="store_false",
+                        help="kein Balancing (nur Gesamtlauf)",
+                        dest="balancing", default=True)
+
+    parser.add_argument('--validate', action="store_true",
+                        help="Szenario nur prüfen",
+                        dest="validate_only", default=False)
+
+    parser.add_argument("-j", '--slots', action="store", type=int,
+                        help="Anzahl gleichzeitiger Läufe",
+                        dest="slots", default=None)
+
+    parser.add_argument('--resume', action="store_true",
+                        help="unterbrochene Läufe der letzten Ausführung "
+                        "fortsetzen",
+                        dest="resume", default=False)
+
+    parser.add_argument('--nosave', action="store_true",
+                        help="Änderungen am Projekt nicht speichern",
+                        dest="save_disabled", default=False)
+
+    arguments = parser.parse_args()
+    if not arguments.scenario_names and not arguments.all_scenarios:
+        # the queue of the last execution may be resumed without adding
+        # any scenarios
+        if arguments.validate_only or not arguments.resume:
+            parser.error('Szenarien angeben (-s) oder alle Szenarien '
+                         'ausführen (-a)')
+    config.batch_mode = True
+    config.save_disabled = arguments.save_disabled
+
+    project = load_project(arguments.project_file)
+    scenario_names = arguments.scenario_names
+    if arguments.all_scenarios:
+        scenario_names = [s.name for s in project.find_all_by_class(Scenario)]
+
+    if arguments.validate_only:
+        valid = True
+        for scenario_name in scenario_names:
+            scenario = project.get_child(scenario_name)
+            if not isinstance(scenario, Scenario):
+                print 'Szenario "{}" nicht gefunden!'.format(scenario_name)
+                valid = False
+                continue
+            errors = validate_scenario(scenario)
+            for error in errors:
+                print '{}: {}'.format(scenario_name, error)
+            valid = valid and scenario.is_valid
+        sys.exit(0 if valid else 1)
+
+    scheduler = RunScheduler(project, run_scenario, slots=arguments.slots,
+                             callback=print_status)
+    if arguments.resume:
+        n_queued = scheduler.resume()
+        print '{} unterbrochene Läufe werden fortgesetzt'.format(n_queued)
+    options = None
+    if arguments.run_name == Scenario.PRIMARY_RUN:
+        options = {'calibrate': [str(arguments.calibrate)],
+                   'balance': [str(arguments.balancing)]}
+    for scenario_name in scenario_names:
+        scheduler.add(scenario_name, run_name=arguments.run_name,
+                      options=options)
+    if not scheduler.jobs:
+        print 'Keine Läufe auszuführen'
+        sys.exit(1)
+    success = scheduler.run()
+    for job in scheduler.jobs:
+        print '{} / {}: {}'.format(job.scenario_name, job.run_name,
+                                    job.message)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    startmain()
@@ -13,18 +13,69 @@ setting_struct = {
         'hdf5_viewer': ''
         },
     'auto_check': False,
+    # store the states of checked resources, unchanged files are not read again
+    'validation_cache': True,
+    # compare the content hash of resource files as well (slow for large files)
+    'validation_cache_hash': False,
+    # number of reported rows with values violating minima or maxima
+    # (0: the values are not searched)
+    'validation_report_rows': 10,
+    # number of processes validating resources in parallel (0: all cores)
+    'validation_processes': 0,
+    # number of traffic model runs executed at the same time by the scheduler
+    'run_slots': 2,
+    # free memory (in MB) needed to start another run
+    'run_min_free_memory': 4096,
+    # number of the most recent lines of the output of a run shown in the
+    # log view (the complete output is written into the log file of the run)
+    'run_log_lines': 5000,
+    # seconds between two samples of the resource usage of a run
+    # (0: not sampled)
+    'telemetry_interval': 5,
+    # seconds without any output of a run, after which the run is regarded
+    # as hung and is killed (0: no timeout)
+    'run_heartbeat_timeout': 3600,
+    # resume interrupted runs from their last checkpoint without asking
+    # (if the model supports checkpoints)
+    'run_resume': True,
+    # clone the inputs of cloned scenarios copy on write instead of copying
+    # them (only on filesystems supporting it, copied else)
+    'clone_link': True,
+    # hard link the inputs of cloned scenarios, if they can't be cloned copy
+    # on write (the scenarios share the files then, changes of the files
+    # outside of the GUI change the inputs of both scenarios)
+    'clone_hardlink': False,
+    # export the evaluated results of runs into csv files
+    'evaluation_csv': True,
+    # aggregates of the results stored in the summary files next to them
+    # (comma separated, see model/summary.py)
+    'summary_aggregates': 'totals,productions,attractions,travel_time_histogram',
+    # lower bounds of the classes of travel times in minutes (comma separated)
+    'summary_time_bins': '0,5,10,15,20,30,45,60,90,120',
+    # number of files copied at the same time
+    'copy_threads': 4,
+    # maximum bandwidth of copying files in MB/s (0: unlimited)
+    'copy_bandwidth': 0,
     'trafficmodels': {
         'Maxem': {
             'default_folder': '', # folder with default resources
             'executable': 'python.exe', # path to file that executes the model (respectively the interpreter, virtual machine etc.)
             'arguments': '-m tdmks.main_xml', # command line arguments for the executable
-            'class_module': 'gui_vm.model.maxem.maxem' # the module with gui_vm related trafficmodel definitions (represents the gui_vm src folder structure)
+            'class_module': 'gui_vm.model.maxem.maxem', # the module with gui_vm related trafficmodel definitions (represents the gui_vm src folder structure)
+            'checkpoint_arguments': '', # arguments passing the folder for checkpoints, e.g. -checkpoints "{folder}" (empty: no checkpoints)
+            'resume_arguments': '', # arguments resuming a run from a checkpoint, e.g. -resume "{checkpoint}"
+            'error_pattern': '', # regular expression matching the lines of the output reporting a fatal error, the run fails then (empty: python tracebacks)
+            'done_pattern': '' # regular expression matching the final message of a successful run (empty: default of the model, ' ... completed')
             },
         'Wiver': {
             'default_folder': '',
             'executable': '',
             'arguments': '',
-            'class_module': 'gui_vm.model.wiver.wiver'
+            'class_module': 'gui_vm.model.wiver.wiver',
+            'checkpoint_arguments': '',
+            'resume_arguments': '',
+            'error_pattern': '',
+            'done_pattern': '' # (empty: the model has no final message, the exit code is checked)
             },
     },
     'history': [],
@@ -49,7 +100,11 @@ class Config():
 
     def __init__(self):
         main_p = gui_vm.__path__[0]
-        folder = os.path.join(os.environ['APPDATA'], 'gui_vm')
+        # no APPDATA on machines without windows (e.g. headless compute nodes)
+        app_data = os.environ.get('APPDATA', os.path.expanduser('~'))
+        folder = os.path.join(app_data, 'gui_vm')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
         self.filename = os.path.join(folder, CONFIG_FILE)
         self.mainWindow = None
         self.batch_mode = False
@@ -14,7 +14,8 @@ from gui_vm.view.resource_ui import Ui_DetailsResource
 from gui_vm.view.scenario_ui import Ui_DetailsScenario
 from gui_vm.view.project_ui import Ui_DetailsProject
 from gui_vm.model.resources import Status
-from gui_vm.model.project_tree import TreeNode
+from gui_vm.model.project_tree import TreeNode, OutputNode
+from gui_vm.model.comparison import compare_outputs, comparison_summary
 from gui_vm.control.dialogs import (CopyFilesDialog, RunOptionsDialog,
                                     InputDialog, ExecDialog, set_directory)
 from PyQt4 import QtGui, QtCore
@@ -97,10 +98,9 @@ class ScenarioDetails(QtGui.QGroupBox, Ui_DetailsScenario):
 
     def update_status(self):
         '''
-        validate the resource files
+        validate the resource files (in the background)
         '''
-        self.scenario.update()
-        self.scenario.validate()
+        self.project_control.validate_in_background(self.scenario)
 
     def special_run(self):
         run_node = self.project_control.add_special_run(self.scenario)
@@ -327,11 +327,10 @@ class InputDetails(QtGui.QGroupBox, Ui_DetailsResource):
 
     def update_status(self):
         '''
-        validate the resource files
+        validate the resource files (in the background, the attributes are
+        shown again when the view is updated afterwards)
         '''
-        self.resource_node.update()
-        self.resource_node.validate()
-        self.show_attributes()
+        self.project_control.validate_in_background(self.resource_node)
 
 
 class OutputDetails(QtGui.QGroupBox):
@@ -403,6 +402,67 @@ class OutputDetails(QtGui.QGroupBox):
                 edit.setReadOnly(True)
                 self.formLayout.addRow(label, edit)
 
+        # comparison with other runs of the same model
+        self.compare_runs = self.comparable_runs()
+        if self.compare_runs:
+            self.formLayout.addRow(QtGui.QLabel(""))
+            compare_button = QtGui.QPushButton()
+            compare_button.setMinimumSize(QtCore.QSize(140, 0))
+            compare_button.setMaximumSize(QtCore.QSize(140, 100))
+            compare_button.setText('Vergleichen mit')
+            self.compare_combo = QtGui.QComboBox()
+            for node in self.compare_runs:
+                self.compare_combo.addItem(_fromUtf8('{} / {}'.format(
+                    node.scenario.name, node.name)))
+            self.formLayout.addRow(compare_button, self.compare_combo)
+            compare_button.clicked.connect(self.compare)
+            # the results of the comparison are shown in a layout of their
+            # own, they are replaced when compared again
+            self.comparison_layout = QtGui.QFormLayout()
+            self.formLayout.addRow(self.comparison_layout)
+
+    def comparable_runs(self):
+        '''
+        the other runs of the project with results of the same model,
+        runs with the same name (e.g. the primary runs of other scenarios)
+        come first
+        '''
+        project = self.output.scenario.project
+        if project is None or self.output.file_absolute is None:
+            return []
+        runs = []
+        for node in project.find_all_by_class(OutputNode):
+            if node is self.output or node.model.name != self.output.model.name:
+                continue
+            filename = node.file_absolute
+            if filename is None or not os.path.exists(filename):
+                continue
+            runs.append(node)
+        runs.sort(key=lambda node: node.name != self.output.name)
+        return runs
+
+    def compare(self):
+        '''
+        compare the results with the results of the selected run
+        '''
+        clear_layout(self.comparison_layout)
+        base = self.compare_runs[self.compare_combo.currentIndex()]
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            summary = comparison_summary(compare_outputs(base, self.output))
+        except ValueError, e:
+            summary = {'Fehler': str(e)}
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        if not summary:
+            summary = {'Fehler': 'Keine vergleichbaren Ergebnisse gefunden.'}
+        for res in summary:
+            label = QtGui.QLabel(_fromUtf8(res))
+            edit = QtGui.QLineEdit(_fromUtf8(summary[res]))
+            edit.setReadOnly(True)
+            edit.setCursorPosition(0)
+            self.comparison_layout.addRow(label, edit)
+
     def change_options(self):
         stored_options = self.output.options
         scenario = self.output.scenario
@@ -3,14 +3,17 @@ from gui_vm.view.progress_ui import Ui_ProgressDialog
 from gui_vm.view.new_project_ui import Ui_NewProject
 from gui_vm.view.new_scenario_ui import Ui_NewScenario
 from gui_vm.view.settings_ui import Ui_Settings
-from gui_vm.model.backend import hard_copy, get_free_space
+from gui_vm.model.backend import copy_files, get_free_space, h5_pool
+from gui_vm.model.parallel import iter_states
 from gui_vm.model.project_tree import Project
 from gui_vm.model.traffic_model import TrafficModel
+from gui_vm.model.run_log import RunLog
 from PyQt4 import QtGui, QtCore
 import sys, os, collections
+import threading
 import re
+from htmlentitydefs import name2codepoint
 from gui_vm.config.config import Config
-from shutil import rmtree
 import datetime
 
 config = Config()
@@ -33,6 +36,13 @@ XML_FILTER = 'XML-Dateien (*.xml)'
 ALL_FILES_FILTER = 'Alle Dateien (*.*)'
 HDF5_FILES_FILTER = 'HDF5-Dateien (*.h5)'
 CALLABLE_FILES_FILTER = 'Ausführbare Dateien (*.exe)'
+# interval in ms the output of a run is shown in the log view
+LOG_FLUSH_INTERVAL = 200
+# markup of status messages written for the former html log view
+LINE_BREAK = re.compile(r'<br\s*/?>', re.IGNORECASE)
+FORMAT_TAGS = re.compile(r'</?(?:b|i|u|p|font|span)(?:\s[^>]*)?>',
+                         re.IGNORECASE)
+ENTITY = re.compile(r'&(#?\w+);')
 PROJECT_FILE_FILTER = 'Projektdatei ({})'.format(Project.FILENAME_DEFAULT)
 TRAFFICMODEL_FILE_FILTER = 'Verkehrsmodell ({})'.format(Project.FILENAME_DEFAULT)
 
@@ -70,6 +80,32 @@ def remove_special_chars(text):
     '''
     return re.sub('[^A-Za-z0-9 ]+', '', text).strip()
 
+def plain_text(text):
+    '''
+    convert the markup of a status message into plain text, line breaks are
+    kept, the formatting is dropped; other text in angle brackets (e.g.
+    '<module>' in tracebacks of the models) is kept as it is
+    '''
+    text, n_breaks = LINE_BREAK.subn('\n', text)
+    text, n_tags = FORMAT_TAGS.subn('', text)
+    if not n_breaks and not n_tags:
+        return text
+
+    def unescape(match):
+        name = match.group(1)
+        if name.startswith('#'):
+            try:
+                code = int(name[2:], 16) if name[1:2] in 'xX' else int(name[1:])
+            except ValueError:
+                return match.group(0)
+        else:
+            code = name2codepoint.get(name)
+            if code is None:
+                return match.group(0)
+        return unichr(code).encode('utf-8')
+
+    return ENTITY.sub(unescape, text)
+
 def browse_file(parent, directory=None, filters=None, selected_filter_idx=None):
     if not filters:
         filters=[ALL_FILES_FILTER]
@@ -121,9 +157,12 @@ class CopyFilesDialog(QtGui.QDialog, Ui_ProgressDialog):
            filenames of the files to be copied
     destinations: list of Strings,
                   folders where the files shall be copied
+    link: bool or list of bools, optional
+          link the files instead of copying them (all or per file),
+          files are copied if linking fails
     '''
 
-    def __init__(self, filenames, destinations, parent=None):
+    def __init__(self, filenames, destinations, parent=None, link=False):
         super(CopyFilesDialog, self).__init__(parent=None)
         self.parent = parent
         self.setupUi(self)
@@ -133,10 +172,10 @@ class CopyFilesDialog(QtGui.QDialog, Ui_ProgressDialog):
         self.cancelButton.setText('OK')
         self.cancelButton.setDisabled(True)
         self.show()
-        self.copy(filenames, destinations)
+        self.copy(filenames, destinations, link=link)
         self.cancelButton.setDisabled(False)
 
-    def copy(self, filenames, destinations):
+    def copy(self, filenames, destinations, link=False):
 
         #todo: store changed filenames in this dict
         self.changed_filenames = {}
@@ -145,13 +184,16 @@ class CopyFilesDialog(QtGui.QDialog, Ui_ProgressDialog):
             filenames = [filenames]
         if not hasattr(destinations, '__iter__'):
             destinations = [destinations]
+        if not hasattr(link, '__iter__'):
+            link = [link] * len(filenames)
         yes_to_all = False
 
         #check if sum of filesizes exceed free disk space
         #(assuming all files are copied to the same drive)
+        #linked files need no space
         size = 0
-        for filename in filenames:
-            if os.path.exists(filename):
+        for filename, do_link in zip(filenames, link):
+            if os.path.exists(filename) and not do_link:
                 statinfo = os.stat(filename)
                 size += statinfo.st_size
         drive = os.path.splitdrive(destinations[0])[0]
@@ -170,6 +212,9 @@ class CopyFilesDialog(QtGui.QDialog, Ui_ProgressDialog):
             self.close()
 
         else:
+            sources = []
+            dest_filenames = []
+            links = []
             for i in xrange(len(filenames)):
                 if not os.path.exists(filenames[i]):
                     status_txt = '<i><b>{}</b> existiert nicht ... &uuml;berspringe </i><br>'.format(filename)
@@ -202,25 +247,173 @@ class CopyFilesDialog(QtGui.QDialog, Ui_ProgressDialog):
                     if cancel:
                         return
                 if do_copy or yes_to_all:
-                    status_txt = 'Kopiere <b>{}</b> nach <b>{}</b> ...<br>'.format(
-                        filename, destinations[i])
-                    self.log_edit.insertHtml(status_txt)
-                    success, msg = hard_copy(filenames[i], dest_filename,
-                                             callback=self.progress_bar.setValue)
-                    if success:
-                        status_txt = '{} erfolgreich kopiert<br>'.format(filename)
-                    else:
-                        status_txt = ('<b>Fehler</b> beim Kopieren von {}<br>'
-                                      .format(filename) +
-                                      ': ' + msg)
-                    self.log_edit.insertHtml(status_txt)
+                    sources.append(filenames[i])
+                    dest_filenames.append(dest_filename)
+                    links.append(link[i])
                 else:
                     status_txt = '<b>{}</b> nicht kopiert<br>'.format(
                         filename, destinations[i])
                     self.log_edit.insertHtml(status_txt)
                 self.log_edit.moveCursor(QtGui.QTextCursor.End)
+
+            status_txt = 'Kopiere {} Dateien ...<br>'.format(len(sources))
+            self.log_edit.insertHtml(status_txt)
+            # open files can't be replaced on windows, the pooled handles
+            # of the replaced files are closed before copying
+            for dest_filename in dest_filenames:
+                h5_pool.close(dest_filename)
+            # copy in a separate thread, the local event loop keeps the
+            # dialog responsive while the caller waits for the copies
+            thread = CopyThread(sources, dest_filenames, links, parent=self)
+            thread.progress.connect(self.show_progress)
+            thread.file_done.connect(self.file_done)
+            loop = QtCore.QEventLoop()
+            thread.finished.connect(loop.quit)
+            thread.start()
+            loop.exec_()
             self.progress_bar.setValue(100)
 
+    def show_progress(self, copied, total, throughput):
+        if total > 0:
+            self.progress_bar.setValue(int(100 * copied / total))
+        self.elapsed_time_label.setText('{:.1f} MB/s'.format(
+            throughput / (1024. * 1024)))
+
+    def file_done(self, filename, success, msg):
+        filename = os.path.split(filename)[1]
+        if success:
+            status_txt = '{} erfolgreich kopiert<br>'.format(filename)
+        else:
+            status_txt = ('<b>Fehler</b> beim Kopieren von {}<br>'
+                          .format(filename) +
+                          ': ' + msg)
+        self.log_edit.insertHtml(status_txt)
+        self.log_edit.moveCursor(QtGui.QTextCursor.End)
+
+
+class CopyThread(QtCore.QThread):
+    '''
+    copies the files in a pool of threads (number of threads and bandwidth
+    as defined in the settings), emits the aggregated progress
+
+    Parameter
+    ---------
+    filenames: list of Strings,
+               filenames of the files to be copied
+    dest_filenames: list of Strings,
+                    names of the destination files
+    links: list of bools,
+           link the files instead of copying them
+    '''
+    # bytes copied, bytes overall, throughput in bytes/s
+    progress = QtCore.pyqtSignal(float, float, float)
+    # filename, success, message
+    file_done = QtCore.pyqtSignal(object, bool, object)
+
+    def __init__(self, filenames, dest_filenames, links, parent=None):
+        super(CopyThread, self).__init__(parent)
+        self.filenames = filenames
+        self.dest_filenames = dest_filenames
+        self.links = links
+
+    def run(self):
+        threads = int(config.settings.get('copy_threads', 4))
+        bandwidth = int(config.settings.get('copy_bandwidth', 0))
+        hardlinks = bool(config.settings.get('clone_hardlink', False))
+        copy_files(self.filenames, self.dest_filenames, links=self.links,
+                   hardlinks=hardlinks,
+                   threads=threads, bandwidth=bandwidth * 1024 * 1024,
+                   callback=lambda c, t, b: self.progress.emit(c, t, b),
+                   on_done=lambda i, success, msg: self.file_done.emit(
+                       self.filenames[i], success, msg))
+
+
+class ValidationThread(QtCore.QThread):
+    '''
+    looks up the cached states of resources (the fingerprints of large files
+    may take long) and updates the resources that are not cached in a pool of
+    processes (see parallel.iter_states), the resulting states are emitted as
+    soon as they are available; the thread works on plain data only, the
+    nodes and resources are not touched here, the states have to be applied
+    by the receiver
+
+    the fingerprints and cached states are emitted at once, the thread waits
+    until the receiver applied them and passes the tasks of the resources to
+    update (see resume), these may depend on monitored attributes provided
+    by the cached ones
+
+    Parameter
+    ---------
+    cache:   ValidationCache, the cache to look up the states in (may be None)
+    entries: list of tuples (cache key, filename, lookup), lookup is False
+             if the file shall be read regardless of the cache (the
+             fingerprint is taken anyway)
+    '''
+    # list of tuples (fingerprint, cached state or None) in order of entries
+    cached_ready = QtCore.pyqtSignal(object)
+    # index of the task, state (None if update failed), error message
+    state_ready = QtCore.pyqtSignal(object, object, object)
+
+    def __init__(self, cache, entries, parent=None):
+        super(ValidationThread, self).__init__(parent)
+        self.cache = cache
+        self.entries = entries
+        self.cancelled = False
+        self._tasks = None
+        self._monitors = None
+        self._applied = threading.Event()
+
+    def cancel(self):
+        '''
+        stop emitting states, the pool is terminated as soon as the
+        currently awaited state is there
+        '''
+        self.cancelled = True
+        self._applied.set()
+
+    def resume(self, tasks=None, monitors=None):
+        '''
+        continue with the resources that are not cached, after the cached
+        states were applied
+
+        Parameters
+        ----------
+        tasks, monitors: the tasks of the resources to update and the values
+                         of the monitored attributes (see
+                         parallel.collect_tasks)
+        '''
+        self._tasks = tasks
+        self._monitors = monitors
+        self._applied.set()
+
+    def run(self):
+        looked_up = []
+        for key, filename, lookup in self.entries:
+            if self.cancelled:
+                return
+            fingerprint = None
+            state = None
+            if self.cache is not None and filename is not None:
+                # fingerprint is taken before reading, a file changed while
+                # reading won't match the cache afterwards
+                fingerprint = self.cache.fingerprint(filename)
+                if lookup:
+                    state = self.cache.lookup(key, fingerprint)
+            looked_up.append((fingerprint, state))
+        self.cached_ready.emit(looked_up)
+        self._applied.wait()
+        if self.cancelled or not self._tasks:
+            return
+        states = iter_states(self._tasks, self._monitors)
+        try:
+            for index, state, error in states:
+                if self.cancelled:
+                    break
+                self.state_ready.emit(index, state, error)
+        finally:
+            # terminates the pool
+            states.close()
+
 
 class ExecDialog(QtGui.QDialog, Ui_ProgressDialog):
 
@@ -242,11 +435,24 @@ class ExecDialog(QtGui.QDialog, Ui_ProgressDialog):
         # Just to prevent accidentally running multiple times
         # Disable the button when process starts, and enable it when it finishes
         self.process.started.connect(self.running)
-        self.process.finished.connect(self.finished)
+        # the outcome of the run is set when the process finished
+        self.outcome = None
 
         self.timer = QtCore.QTimer(self)
         self.timer.timeout.connect(self.update_timer)
 
+        # the output is collected and shown in batches, the view keeps only
+        # the most recent lines, the complete output is written into the
+        # compressed log file of the run
+        max_lines = int(config.settings.get('run_log_lines', 5000))
+        self.log_edit.document().setMaximumBlockCount(max_lines)
+        self.pending_lines = collections.deque(maxlen=max_lines)
+        self.pending_progress = None
+        self.run_log = None
+        self.log_failed = False
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+
         self.show()
         #start process when window is opened
         self.startButton.clicked.emit(True)
@@ -254,32 +460,59 @@ class ExecDialog(QtGui.QDialog, Ui_ProgressDialog):
     def run(self):
         cancel = False
         primary = self.scenario.primary_run
-        # specific runs become invalid if primary run is executed again, delete them
-        if primary and primary.is_valid and self.run_name == primary.name:
+        resume = False
+        # interrupted runs may be resumed from their last checkpoint
+        output = self.scenario.get_output(self.run_name)
+        checkpoint = None
+        if output is not None and self.scenario.model.supports_checkpoints:
+            checkpoint = output.last_checkpoint
+        if checkpoint is not None:
+            if config.batch_mode:
+                resume = config.settings.get('run_resume', True)
+            else:
+                dialog = QtGui.QMessageBox()
+                msg = 'Der Lauf {} wurde unterbrochen. \n\n'.format(
+                    self.run_name) + \
+                    'Wollen Sie ihn ab dem letzten Zwischenstand ' + \
+                    '({}) fortsetzen?'.format(os.path.basename(checkpoint))
+                reply = dialog.question(
+                    self, _fromUtf8("Lauf fortsetzen"), _fromUtf8(msg),
+                    QtGui.QMessageBox.Yes | QtGui.QMessageBox.No |
+                    QtGui.QMessageBox.Cancel)
+                cancel = reply == QtGui.QMessageBox.Cancel
+                resume = reply == QtGui.QMessageBox.Yes
+        # specific runs become invalid if primary run is executed again, they
+        # are deleted after the primary run succeeded
+        if (not cancel and not resume and primary and primary.is_valid and
+            self.run_name == primary.name):
             if not config.batch_mode:
                 dialog = QtGui.QMessageBox()
                 msg = 'Das Szenario {} '.format(self.scenario.name) + \
                     'wurde bereits berechnet. \n\n' + \
                     'Wollen Sie trotzdem einen erneuten Gesamtlauf starten?\n\n' + \
-                    'Achtung! Die Ergebnisse der spezifischen Läufe des Szenarios werden ebenfalls gelöscht!'
+                    'Achtung! Die Ergebnisse der spezifischen Läufe des Szenarios werden nach erfolgreichem Gesamtlauf ebenfalls gelöscht!'
                 reply = dialog.question(
                     self, _fromUtf8("erneuter Gesamtlauf"), _fromUtf8(msg),
                     QtGui.QMessageBox.Ok, QtGui.QMessageBox.Cancel)
                 cancel = reply == QtGui.QMessageBox.Cancel
-            if cancel:
-                self.close()
-                return
-            for output in self.scenario.get_output_files():
-                try:
-                    rmtree(os.path.split(output.file_absolute)[0])
-                except:
-                    pass
-                pass
+        if cancel:
+            self.close()
+            return
 
         self.start_time = datetime.datetime.now()
         self.timer.start(1000)
-        self.scenario.run(self.process, self.run_name, options=self.options,
-                          callback=self.show_status)
+        self.log_failed = False
+        self.log_timer.start(LOG_FLUSH_INTERVAL)
+        try:
+            self.process.finished.disconnect(self.finished)
+        except TypeError:
+            # not connected yet
+            pass
+        self.outcome = self.scenario.run(
+            self.process, self.run_name, options=self.options,
+            callback=self.show_status, resume=resume)
+        # connected after the run, the outcome is decided by then
+        self.process.finished.connect(self.finished)
 
     def running(self):
         self.progress_bar.setStyleSheet(DEFAULT_STYLE)
@@ -291,6 +524,9 @@ class ExecDialog(QtGui.QDialog, Ui_ProgressDialog):
 
     def stopped(self):
         self.timer.stop()
+        self.log_timer.stop()
+        self.flush_log()
+        self.close_log()
         self.startButton.setEnabled(True)
         self.cancelButton.setText(_fromUtf8('Schließen'))
         self.cancelButton.clicked.disconnect(self.kill)
@@ -299,26 +535,86 @@ class ExecDialog(QtGui.QDialog, Ui_ProgressDialog):
             self.close()
 
     def finished(self):
-        # strange: process returns 1 even if successful
-        #if not self.process.Crashed:
-        self.progress_bar.setValue(100)
+        if self.outcome is not None and self.outcome.succeeded:
+            self.pending_progress = 100
+        else:
+            self.progress_bar.setStyleSheet(ABORTED_STYLE)
         self.scenario.project.emit()
         self.stopped()
 
     def kill(self):
         self.timer.stop()
+        self.log_timer.stop()
+        self.flush_log()
         self.progress_bar.setStyleSheet(ABORTED_STYLE)
         self.process.kill()
         demand_file = self.scenario.get_output(self.run_name).file_absolute
         # tdmks writes during calculations, when aborted file is useless
+        # (the checkpoints are kept to resume the run)
         if os.path.exists(demand_file):
+            h5_pool.close(demand_file)
             os.remove(demand_file)
 
     def show_status(self, text, progress=None):
-        self.log_edit.insertHtml(str(text) + '<br>')
-        self.log_edit.moveCursor(QtGui.QTextCursor.End)
+        '''
+        collect the output of the run, it is shown with the next flush
+        (see flush_log)
+        '''
+        # messages may still contain markup, the view shows plain text
+        text = plain_text(str(text))
+        if self.run_log is None and not self.log_failed:
+            self.open_log()
+        if self.run_log is not None:
+            self.run_log.write(text)
+        self.pending_lines.extend(text.rstrip('\n').split('\n'))
         if progress:
-            self.progress_bar.setValue(progress)
+            self.pending_progress = progress
+
+    def flush_log(self):
+        '''
+        show the collected output in the log view
+        '''
+        if self.pending_lines:
+            text = '\n'.join(self.pending_lines)
+            self.pending_lines.clear()
+            cursor = QtGui.QTextCursor(self.log_edit.document())
+            cursor.movePosition(QtGui.QTextCursor.End)
+            if not self.log_edit.document().isEmpty():
+                text = '\n' + text
+            cursor.insertText(_fromUtf8(text))
+            self.log_edit.moveCursor(QtGui.QTextCursor.End)
+        if self.pending_progress is not None:
+            self.progress_bar.setValue(self.pending_progress)
+            self.pending_progress = None
+
+    def open_log(self):
+        '''
+        open the compressed log file in the folder of the run
+        '''
+        output = self.scenario.get_output(self.run_name)
+        folder = None
+        if output is not None and output.file_absolute is not None:
+            folder = os.path.dirname(output.file_absolute)
+        elif self.scenario.path is not None:
+            folder = self.scenario.path
+        if folder is None:
+            self.log_failed = True
+            return
+        try:
+            self.run_log = RunLog(folder)
+        except (IOError, OSError), e:
+            self.log_failed = True
+            self.pending_lines.append(
+                'Die Logdatei konnte nicht angelegt werden ({})'.format(e))
+
+    def close_log(self):
+        if self.run_log is not None:
+            self.run_log.close()
+            self.run_log = None
+
+    def closeEvent(self, event):
+        self.close_log()
+        super(ExecDialog, self).closeEvent(event)
 
     def update_timer(self):
         delta = datetime.datetime.now() - self.start_time
@@ -326,6 +622,10 @@ class ExecDialog(QtGui.QDialog, Ui_ProgressDialog):
         m, s = divmod(remainder, 60)
         timer_text = '{:02d}:{:02d}:{:02d}'.format(h, m, s)
         self.elapsed_time_label.setText(timer_text)
+        # runs without any output for too long are killed
+        if self.outcome is not None and self.outcome.check_heartbeat():
+            self.show_status(self.outcome.message)
+            self.kill()
 
 
 class NewProjectDialog(QtGui.QDialog, Ui_NewProject):
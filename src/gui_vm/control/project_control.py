@@ -18,9 +18,14 @@ from gui_vm.model.project_tree import (Project, TreeNode, Scenario,
                                        InputNode, XMLParser, OutputNode)
 from gui_vm.control.dialogs import (CopyFilesDialog, ExecDialog,
                                     NewScenarioDialog, RunOptionsDialog,
-                                    InputDialog, CopySpecialRunDialog)
+                                    InputDialog, CopySpecialRunDialog,
+                                    ValidationThread)
 from gui_vm.config.config import Config
+from gui_vm.model.backend import unshare_file, h5_pool
+from gui_vm.model.parallel import (split_providers, collect_tasks,
+                                   failure_message)
 import os, subprocess
+from collections import OrderedDict
 from shutil import rmtree
 import subprocess
 from dialogs import browse_file, ALL_FILES_FILTER, HDF5_FILES_FILTER
@@ -429,6 +434,14 @@ class VMProjectControl(ProjectTreeControl):
         self.status_button = self.button_group.findChild(
             QtGui.QAbstractButton, 'status_button')
 
+        # background validation (see validate_in_background)
+        self._validation_thread = None
+        self._validation_scenarios = []
+        self._validation_changed = None
+        self._validation_nodes = []
+        self._validation_warnings = []
+        self._validation_progress = [0, 0]
+
         # connect the context buttons with the defined actions
         self.plus_button.clicked.connect(lambda: self.context_function('add'))
         self.minus_button.clicked.connect(lambda: self.context_function('remove'))
@@ -813,6 +826,7 @@ class VMProjectControl(ProjectTreeControl):
             QtGui.QMessageBox.Yes, QtGui.QMessageBox.No)
         if reply == QtGui.QMessageBox.No:
             return
+        h5_pool.close_folder(scenario_node.path)
         try:
             rmtree(scenario_node.path)
         except Exception, e:
@@ -862,6 +876,7 @@ class VMProjectControl(ProjectTreeControl):
                     QtGui.QMessageBox.Yes, QtGui.QMessageBox.No)
                 do_delete = reply == QtGui.QMessageBox.Yes
             if do_delete:
+                h5_pool.close(resource_node.file_absolute)
                 os.remove(resource_node.file_absolute)
         resource_node.file_relative = None
         if remove_node:
@@ -877,10 +892,180 @@ class VMProjectControl(ProjectTreeControl):
         if not output_node:
             output_node = self.selected_item
 
-        output_node.update()
-        output_node.validate()
+        self.validate_in_background(output_node)
+
+    def validate_in_background(self, node):
+        '''
+        update and validate the given node without blocking the GUI, the
+        inputs are read and checked in a pool of processes, their states are
+        applied one by one as soon as they are there (the tree is repainted
+        after each one), a running validation is cancelled
+
+        Parameter
+        ---------
+        node: the node to validate (project, scenario or resource node)
+        '''
+        self.cancel_validation()
+        if isinstance(node, OutputNode):
+            node.update()
+            node.validate()
+            self.view_changed.emit()
+            return
+        changed = None
+        if isinstance(node, Project):
+            scenarios = node.find_all_by_class(Scenario)
+            input_nodes = []
+            for scenario in scenarios:
+                input_nodes.extend(scenario.get_input_files())
+        elif isinstance(node, Scenario):
+            scenarios = [node]
+            input_nodes = node.get_input_files()
+        elif isinstance(node, InputNode):
+            scenarios = [node.scenario]
+            changed = [node]
+            # the inputs whose rules depend on the changed one are checked
+            # again as well (the violating values may differ now)
+            affected = node.model.dependent_resources([node.resource_name])
+            input_nodes = [input_node for input_node
+                           in node.scenario.get_input_files()
+                           if input_node.resource_name in affected]
+        else:
+            return
+
+        # the cached states are looked up in the background as well (the
+        # files may be hashed), providers of monitored attributes first
+        pending = []
+        providers, dependents = split_providers(input_nodes)
+        for input_node in providers + dependents:
+            if input_node.resource is not None:
+                pending.append(input_node)
+
+        self._validation_scenarios = scenarios
+        self._validation_changed = changed
+        self._validation_nodes = pending
+        self._validation_warnings = []
+        self._validation_progress = [len(input_nodes) - len(pending),
+                                     len(input_nodes)]
+        if not pending:
+            self._finish_validation()
+            return
+        self._show_validation_progress()
+        # the thread gets plain data only (the tree may change meanwhile),
+        # the states of the dependent inputs are not taken from the cache
+        entries = []
+        for input_node in pending:
+            filename = input_node.file_absolute
+            key = input_node.cache_key if filename is not None else None
+            entries.append((key, filename,
+                            changed is None or input_node in changed))
+        thread = ValidationThread(pending[0].validation_cache, entries,
+                                  parent=self)
+        thread.cached_ready.connect(
+            lambda looked_up: self._apply_cached_states(thread, looked_up))
+        thread.state_ready.connect(
+            lambda i, state, error: self._apply_state(thread, i, state, error))
+        thread.finished.connect(lambda: self._validation_thread_finished(thread))
+        thread.finished.connect(thread.deleteLater)
+        self._validation_thread = thread
+        thread.start()
+
+    def cancel_validation(self):
+        '''
+        cancel a running background validation, the states already applied
+        are kept
+        '''
+        if self._validation_thread is None:
+            return
+        self._validation_thread.cancel()
+        self._validation_thread = None
+        self._show_status_message('Prüfung abgebrochen')
+
+    def _apply_cached_states(self, thread, looked_up):
+        '''
+        remember the fingerprints of the files and apply the cached states
+        looked up in the background, the thread continues with the tasks
+        of the other resources afterwards (called in the GUI thread)
+        '''
+        tasks = None
+        monitors = None
+        try:
+            if thread is not self._validation_thread:
+                return
+            pending = []
+            for input_node, (fingerprint, state) in zip(
+                self._validation_nodes, looked_up):
+                input_node.remember_fingerprint(fingerprint)
+                if state is not None:
+                    input_node.resource.restore(state)
+                    self._validation_progress[0] += 1
+                else:
+                    pending.append(input_node)
+            # the monitored attributes are taken after the cached states
+            # were applied
+            self._validation_nodes = pending
+            tasks, monitors = collect_tasks(pending)
+            self._show_validation_progress()
+            self.tree_view.viewport().update()
+        finally:
+            thread.resume(tasks, monitors)
+
+    def _apply_state(self, thread, index, state, error):
+        '''
+        apply a state of a resource updated and checked in the background,
+        the rules are only checked again (the values violating them were
+        already reported in the background) (called in the GUI thread)
+        '''
+        if thread is not self._validation_thread:
+            return
+        input_node = self._validation_nodes[index]
+        if state is not None:
+            input_node.resource.restore(state)
+        else:
+            self._validation_warnings.append(
+                failure_message(input_node, error))
+            input_node.resource.update(input_node.path)
+        input_node.validate(write_cache=False)
+        self._validation_progress[0] += 1
+        self._show_validation_progress()
+        self.tree_view.viewport().update()
+
+    def _validation_thread_finished(self, thread):
+        if thread is not self._validation_thread:
+            return
+        self._validation_thread = None
+        self._finish_validation()
+
+    def _finish_validation(self):
+        '''
+        validate the scenarios after all of their inputs were updated
+        (the rules may reference resources applied later), the values
+        violating the rules were reported in the background already, so
+        the files of the inputs are not read here
+        '''
+        for scenario in self._validation_scenarios:
+            if self._validation_changed is None:
+                for output_node in scenario.get_output_files():
+                    output_node.update()
+            scenario.validate(changed=self._validation_changed)
+        messages = ['Prüfung abgeschlossen'] + self._validation_warnings
+        cache = self.project.validation_cache if self.project else None
+        if cache is not None:
+            messages += cache.pop_warnings()
+        self._validation_scenarios = []
+        self._validation_nodes = []
+        self._validation_warnings = []
+        self._show_status_message(' - '.join(messages))
         self.view_changed.emit()
 
+    def _show_validation_progress(self):
+        n_done, n_total = self._validation_progress
+        self._show_status_message(
+            'Prüfe Eingaben... ({}/{})'.format(n_done, n_total))
+
+    def _show_status_message(self, message):
+        if config.mainWindow is not None:
+            config.mainWindow.statusBar().showMessage(_fromUtf8(message), 5000)
+
     def _remove_output(self, output_node=None):
         '''
         remove an output-node from the project-tree and
@@ -937,8 +1122,12 @@ class VMProjectControl(ProjectTreeControl):
 
         dialog = QtGui.QMessageBox()
 
+        # the run needs the complete state of the scenario
+        if self._validation_thread is not None:
+            self.cancel_validation()
+            scenario_node.is_checked = False
         if not scenario_node.is_checked:
-            scenario_node.update()
+            scenario_node.update(callback=self._show_status_message)
             scenario_node.validate()
             self.view_changed.emit()
 
@@ -1039,6 +1228,8 @@ class VMProjectControl(ProjectTreeControl):
                 old_path = scenario_node.path
                 old_name = scenario_node.name
                 scenario_node.name = str(name)
+                # folders with open files can't be renamed on windows
+                h5_pool.close_folder(old_path)
                 try:
                     os.rename(old_path, scenario_node.path)
                 except Exception, e:
@@ -1137,6 +1328,11 @@ class VMProjectControl(ProjectTreeControl):
                 return
         filenames = []
         destinations = []
+        # unchanged inputs may be linked instead of copied (files are
+        # unshared before they are changed), outputs are always copied,
+        # because the model writes into them
+        link_inputs = config.settings.get('clone_link', False)
+        links = []
         for i, nodes in enumerate([scenario_node.get_input_files(),
                                    scenario_node.get_output_files()]):
             is_input = i == 0
@@ -1148,11 +1344,12 @@ class VMProjectControl(ProjectTreeControl):
                 if new_res_node and os.path.exists(res_node.file_absolute):
                     filenames.append(res_node.file_absolute)
                     destinations.append(os.path.split(new_res_node.file_absolute)[0])
+                    links.append(is_input and link_inputs)
 
         #bad workaround (as it has to know the parents qtreeview)
         #but the view crashes otherwise, maybe make update signal
         self.tree_view.setUpdatesEnabled(False)
-        dialog = CopyFilesDialog(filenames, destinations)
+        dialog = CopyFilesDialog(filenames, destinations, link=links)
                                  #parent=self.tree_view)
         self.tree_view.setUpdatesEnabled(True)
 
@@ -1175,6 +1372,14 @@ class VMProjectControl(ProjectTreeControl):
         node = self.selected_item
         hdf5_viewer = config.settings['environment']['hdf5_viewer']
         if hdf5_viewer:
+            # the file may be changed in the viewer, a file linked into
+            # a cloned scenario must not change the other scenario
+            success, msg = unshare_file(node.file_absolute)
+            if not success:
+                QtGui.QMessageBox.about(None, "Fehler", _fromUtf8(msg))
+                return
+            # the viewer can't write into files opened in the pool on windows
+            h5_pool.close(node.file_absolute)
             subprocess.Popen('"{0}" "{1}"'.format(hdf5_viewer,
                                                   node.file_absolute))
         else:
@@ -1531,6 +1736,7 @@ class VMProjectControl(ProjectTreeControl):
         '''
         close the currently opened project
         '''
+        self.cancel_validation()
         self.current_index = self.createIndex(0, 0, self.project)
         if self.project:
             self._remove_node(self.project)
@@ -1549,10 +1755,9 @@ class VMProjectControl(ProjectTreeControl):
         XMLParser.read_xml(self.model, filename)
         self.project.project_folder = os.path.split(filename)[0]
         self.project.on_change(lambda: self.project_changed.emit())
-        if config.settings['auto_check']:
-            self.project.update()
-            self.nodes_changed.emit(self.project)
         self.view_changed.emit()
+        if config.settings['auto_check']:
+            self.validate_in_background(self.project)
         self.tree_view.resizeColumnToContents(0)
         self.select_node(self.project)
 
@@ -1566,8 +1771,10 @@ class VMProjectControl(ProjectTreeControl):
         scenario: the scenario, where the outputs shall be removed
         '''
         for output_node in scenario.get_output_files():
+            folder = os.path.split(output_node.file_absolute)[0]
+            h5_pool.close_folder(folder)
             try:
-                rmtree(os.path.split(output_node.file_absolute)[0])
+                rmtree(folder)
             except:
                 pass
         output_parent = scenario.get_child(scenario.OUTPUT_NODES)
@@ -1578,14 +1785,16 @@ class VMProjectControl(ProjectTreeControl):
         '''
         handle what happens, if nodes have changed
         '''
-
+        # changed inputs per scenario
+        changed_inputs = OrderedDict()
         for node in args:
 
             if not config.settings['auto_check']:
                 node.is_checked = False
-            # if input changes, all other nodes have to be validated
+            # if input changes, the nodes depending on it have to be validated
             elif isinstance(node, InputNode):
-                scenario = node.scenario
-                scenario.validate()
+                changed_inputs.setdefault(node.scenario, []).append(node)
             else:
-                node.validate()
\ No newline at end of file
+                node.validate()
+        for scenario, input_nodes in changed_inputs.items():
+            scenario.validate(changed=input_nodes)
\ No newline at end of file
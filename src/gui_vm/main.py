@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from argparse import ArgumentParser
 import sys
+import multiprocessing
 from gui_vm.control.main_control import MainWindow
 from PyQt4 import QtGui, QtCore
 
@@ -11,6 +12,8 @@ except AttributeError:
         return s
 
 def startmain():
+    # validation spawns worker processes (needed for frozen executables)
+    multiprocessing.freeze_support()
     parser = ArgumentParser(description="GUI Verkehrsmodelle")
 
     parser.add_argument("--admin", action="store_true",
@@ -4,9 +4,85 @@ import os
 import sys
 import ctypes
 import platform
+import time
+import threading
+import itertools
+import tempfile
+import shutil
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from contextlib import contextmanager
+# maps contiguous datasets into memory (see memmap_array), has to be linked
+# against the same HDF5 library as PyTables (both installed with conda)
+import h5py
+
+# approximate number of bytes read at once when walking through large
+# tables or arrays chunkwise
+BUFFER_SIZE = 16 * 1024 * 1024
+
+# bounds of the size of the blocks copied at once
+COPY_MIN_BUFFER = 1024 * 1024
+COPY_MAX_BUFFER = 64 * 1024 * 1024
+# minimum time in seconds between two calls of the progress callback
+PROGRESS_INTERVAL = 0.2
+# maximum number of bytes of a column held in memory at once when searching
+# for duplicates, larger columns are partitioned into temporary files
+DUPLICATES_MAX_MEMORY = 512 * 1024 * 1024
+# maximum number of HDF5 files kept open by the pool (files in use are not
+# closed, even if there are more)
+MAX_OPEN_FILES = 16
+
+def _copy_buffer_size(file_size):
+    '''
+    size of the blocks to copy a file of given size with (about 1% of the
+    file, bounded by COPY_MIN_BUFFER and COPY_MAX_BUFFER)
+    '''
+    return int(min(max(file_size // 100, COPY_MIN_BUFFER), COPY_MAX_BUFFER))
+
+def _copy_blocks(src, dest, size, block_size):
+    '''
+    generator copying the opened file src into dest, the data is passed
+    inside the kernel if the os supports it (copy_file_range or sendfile,
+    python >= 3.3), else it is read into a reused buffer,
+    yields the number of bytes copied after each block
+    '''
+    src_fd = src.fileno()
+    dest_fd = dest.fileno()
+    copied = 0
+    for name in ['copy_file_range', 'sendfile']:
+        kernel_copy = getattr(os, name, None)
+        if kernel_copy is None:
+            continue
+        try:
+            while copied < size:
+                if name == 'sendfile':
+                    n = kernel_copy(dest_fd, src_fd, copied, block_size)
+                else:
+                    n = kernel_copy(src_fd, dest_fd, block_size,
+                                    copied, copied)
+                if n == 0:
+                    break
+                copied += n
+                yield copied
+            return
+        except OSError:
+            # not supported for these files (e.g. across file systems),
+            # nothing written yet -> try next one, else error
+            if copied > 0:
+                raise
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    while True:
+        n = src.readinto(buf)
+        if not n:
+            break
+        dest.write(view[:n])
+        copied += n
+        yield copied
 
 def hard_copy(src_filename, dest_filename,
-              callback=None, block_size=512):
+              callback=None, block_size=None, bytes_callback=None):
     '''
     copy file blockwise to given destination
 
@@ -16,18 +92,22 @@ def hard_copy(src_filename, dest_filename,
                   name of the file to copy (incl. path)
     dest_filename: String,
                    name of the file where the content of the file will be
-                   copied into (incl. path)
+                   copied into (incl. path), an existing file is replaced
+                   (not written into, hard links to it stay untouched)
     block_size: int, optional
-                size of the copied blocks
+                size of the copied blocks, depends on the size of the file
+                if not given
     callback: function, optional
-              a method tracking the progress from 0 to 100
+              a method tracking the progress from 0 to 100,
+              called at most every PROGRESS_INTERVAL seconds
+    bytes_callback: function, optional
+                    is called with the number of bytes copied after each
+                    block (may block to limit the bandwidth)
 
     Return
     ------
     successful: bool, True if copying was successful
     '''
-
-    src = open(src_filename, "rb")
     #you can't copy a file into itself
     if os.path.normpath(src_filename) == os.path.normpath(dest_filename):
         return False, 'Quelle und Ziel sind identisch!'
@@ -37,39 +117,253 @@ def hard_copy(src_filename, dest_filename,
     if not os.path.exists(dest_dir):
         os.makedirs(dest_dir)
     free = get_free_space(dest_dir)
+    if os.path.exists(dest_filename):
+        free += os.stat(dest_filename).st_size
     if src_size >= free:
         return (False,
                 'Nicht genug Speicherplatz in {} vorhanden!'.format(dest_dir))
-    dest = open(dest_filename, "wb")
+    if block_size is None:
+        block_size = _copy_buffer_size(src_size)
+    if os.path.exists(dest_filename):
+        h5_pool.close(dest_filename)
+        os.remove(dest_filename)
     if callback:
         callback(0)
-    cur_block_pos = 0
-
-    while True:
-        cur_block = src.read(block_size)
-        cur_block_pos += block_size
-        #track progress (in percentage of 100)
-        progress = (float(cur_block_pos) / float(src_size) * 100)
-        if callback:
-            callback(progress)
-
-        #end of file
-        if not cur_block:
-            sys.stderr.write('\n')
-            break
-        else:
-            dest.write(cur_block)
 
-    src.close()
-    dest.close()
+    last_call = time.time()
+    last_copied = 0
+    with open(src_filename, 'rb') as src, open(dest_filename, 'wb') as dest:
+        for copied in _copy_blocks(src, dest, src_size, block_size):
+            if bytes_callback:
+                bytes_callback(copied - last_copied)
+                last_copied = copied
+            #track progress (in percentage of 100)
+            if callback and time.time() - last_call >= PROGRESS_INTERVAL:
+                last_call = time.time()
+                callback(int(100 * copied / max(src_size, 1)))
 
     #check if destination file has same file size as input file
     dest_size = os.stat(dest_filename).st_size
     if dest_size != src_size:
         return False, 'Datei wurde nicht vollständig kopiert!'
 
-    else:
-        return True, 'Datei erfolgreich kopiert.'
+    if callback:
+        callback(100)
+    return True, 'Datei erfolgreich kopiert.'
+
+def copy_files(filenames, dest_filenames, links=None, hardlinks=False,
+               threads=4, bandwidth=None, callback=None, on_done=None):
+    '''
+    copy multiple files at the same time in a pool of threads
+
+    Parameter
+    ---------
+    filenames: list of Strings,
+               names of the files to copy (incl. path)
+    dest_filenames: list of Strings,
+                    names of the destination files (incl. path)
+    links: list of bools, optional
+           link the file instead of copying it (see link_file), the file
+           is copied if linking fails
+    hardlinks: bool, optional
+               create hard links, if the files can't be cloned
+    threads: int, optional
+             number of files copied at the same time
+    bandwidth: int, optional
+               maximum number of bytes copied per second (all files),
+               unlimited if not given
+    callback: function, optional
+              tracks the progress, is called with the number of bytes
+              copied, the number of all bytes and the current throughput
+              in bytes per second (at most every PROGRESS_INTERVAL seconds)
+    on_done: function, optional
+             is called with the index of the file, the success and a
+             message, when a file is done
+
+    Return
+    ------
+    results: list of tuples (successful, message) for each file
+    '''
+    n_files = len(filenames)
+    if links is None:
+        links = [False] * n_files
+    sizes = [os.stat(f).st_size for f in filenames]
+    total = sum(sizes)
+    lock = threading.Lock()
+    start = time.time()
+    # copied bytes incl. linked ones (progress) and bytes actually
+    # transferred (bandwidth)
+    progress = {'copied': 0, 'transferred': 0, 'last_call': 0}
+
+    def add_bytes(n_bytes, throttle=True):
+        with lock:
+            progress['copied'] += n_bytes
+            if throttle:
+                progress['transferred'] += n_bytes
+            copied = progress['copied']
+            transferred = progress['transferred']
+            now = time.time()
+            do_call = now - progress['last_call'] >= PROGRESS_INTERVAL
+            if do_call:
+                progress['last_call'] = now
+        elapsed = max(now - start, 1e-6)
+        if callback and do_call:
+            callback(copied, total, copied / elapsed)
+        # wait until the transferred bytes are within the budget
+        if bandwidth and throttle:
+            delay = float(transferred) / bandwidth - elapsed
+            if delay > 0:
+                time.sleep(delay)
+
+    def copy(i):
+        success = False
+        if links[i]:
+            success, msg = link_file(filenames[i], dest_filenames[i],
+                                     hardlink=hardlinks)
+            if success:
+                # linking doesn't take any bandwidth
+                add_bytes(sizes[i], throttle=False)
+        if not success:
+            success, msg = hard_copy(filenames[i], dest_filenames[i],
+                                     bytes_callback=add_bytes)
+        if on_done:
+            on_done(i, success, msg)
+        return success, msg
+
+    if n_files == 0:
+        return []
+    pool = ThreadPool(max(1, min(threads, n_files)))
+    try:
+        results = pool.map(copy, range(n_files))
+    finally:
+        pool.close()
+        pool.join()
+    if callback:
+        callback(progress['copied'], total,
+                 progress['copied'] / max(time.time() - start, 1e-6))
+    return results
+
+# ioctl request cloning a file on linux filesystems supporting copy on write
+# (btrfs, xfs)
+FICLONE = 0x40049409
+
+def _reflink(src_filename, dest_filename):
+    '''
+    clone the file (shares data blocks until one of the files is changed),
+    returns True if successful
+    '''
+    if platform.system() != 'Linux':
+        return False
+    import fcntl
+    try:
+        with open(src_filename, 'rb') as src, open(dest_filename, 'wb') as dest:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        return True
+    except (IOError, OSError):
+        if os.path.exists(dest_filename):
+            os.remove(dest_filename)
+        return False
+
+def _hardlink(src_filename, dest_filename):
+    '''
+    create a hard link (both names point to the same data),
+    returns True if successful
+    '''
+    if hasattr(os, 'link'):
+        try:
+            os.link(src_filename, dest_filename)
+            return True
+        except OSError:
+            return False
+    if platform.system() == 'Windows':
+        return bool(ctypes.windll.kernel32.CreateHardLinkW(
+            ctypes.c_wchar_p(unicode(dest_filename)),
+            ctypes.c_wchar_p(unicode(src_filename)), None))
+    return False
+
+def link_file(src_filename, dest_filename, hardlink=False):
+    '''
+    link the file to the given destination without copying its content,
+    a copy on write clone (reflink) is preferred, a hard link is only
+    created on request if the filesystem doesn't support it (both only
+    possible on the same drive), an existing destination file is replaced
+
+    Parameter
+    ---------
+    src_filename: String,
+                  name of the file to link (incl. path)
+    dest_filename: String,
+                   name of the linked file (incl. path)
+    hardlink: bool, optional
+              create a hard link, if the file can't be cloned; changes of
+              one of the files in place change the other one as well then
+              (see unshare_file)
+
+    Return
+    ------
+    successful: bool, True if linking was successful (copy it then)
+    '''
+    if os.path.normpath(src_filename) == os.path.normpath(dest_filename):
+        return False, 'Quelle und Ziel sind identisch!'
+    dest_dir = os.path.split(dest_filename)[0]
+    if not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
+    if os.path.exists(dest_filename):
+        h5_pool.close(dest_filename)
+        os.remove(dest_filename)
+    if _reflink(src_filename, dest_filename):
+        return True, 'Datei erfolgreich geklont.'
+    if hardlink and _hardlink(src_filename, dest_filename):
+        return True, 'Datei erfolgreich verknüpft.'
+    return False, 'Datei konnte nicht verknüpft werden!'
+
+def count_links(filename):
+    '''
+    Return number of hard links to the file (1 if not linked)
+    '''
+    if platform.system() != 'Windows':
+        return os.stat(filename).st_nlink
+    # st_nlink is not set under windows (FILETIMEs as pairs of DWORDs to
+    # keep the alignment of the struct)
+    class BY_HANDLE_FILE_INFORMATION(ctypes.Structure):
+        _fields_ = [('dwFileAttributes', ctypes.c_ulong),
+                    ('ftCreationTime', ctypes.c_ulong * 2),
+                    ('ftLastAccessTime', ctypes.c_ulong * 2),
+                    ('ftLastWriteTime', ctypes.c_ulong * 2),
+                    ('dwVolumeSerialNumber', ctypes.c_ulong),
+                    ('nFileSizeHigh', ctypes.c_ulong),
+                    ('nFileSizeLow', ctypes.c_ulong),
+                    ('nNumberOfLinks', ctypes.c_ulong),
+                    ('nFileIndexHigh', ctypes.c_ulong),
+                    ('nFileIndexLow', ctypes.c_ulong)]
+    import msvcrt
+    info = BY_HANDLE_FILE_INFORMATION()
+    with open(filename, 'rb') as f:
+        handle = msvcrt.get_osfhandle(f.fileno())
+        if not ctypes.windll.kernel32.GetFileInformationByHandle(
+            handle, ctypes.byref(info)):
+            return 1
+    return info.nNumberOfLinks
+
+def unshare_file(filename, callback=None):
+    '''
+    replace a hard linked file by a copy of its own, so that changes of the
+    file don't affect the other links (clones are copied on write anyway)
+
+    Return
+    ------
+    successful: bool, True if the file is not linked (anymore)
+    '''
+    if not os.path.exists(filename) or count_links(filename) <= 1:
+        return True, 'Datei ist nicht verknüpft.'
+    tmp_filename = filename + '.tmp'
+    success, msg = hard_copy(filename, tmp_filename, callback=callback)
+    if not success:
+        return success, msg
+    h5_pool.close(filename)
+    os.remove(filename)
+    os.rename(tmp_filename, filename)
+    return True, 'Verknüpfung der Datei aufgelöst.'
 
 def get_free_space(folder):
     """
@@ -85,26 +379,676 @@ def get_free_space(folder):
         st = os.statvfs(folder)
         return st.f_bavail * st.f_frsize
 
+def get_free_memory():
+    """
+    Return available physical memory (in bytes), None if unknown
+    """
+    if platform.system() == 'Windows':
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong),
+                        ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong),
+                        ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong),
+                        ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong),
+                        ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if not ctypes.windll.kernel32.GlobalMemoryStatusEx(
+            ctypes.byref(status)):
+            return None
+        return status.ullAvailPhys
+    try:
+        with open('/proc/meminfo') as meminfo:
+            values = {}
+            for line in meminfo:
+                key, value = line.split(':', 1)
+                # values are given in kB
+                values[key] = int(value.split()[0]) * 1024
+    except (IOError, ValueError):
+        return None
+    if 'MemAvailable' in values:
+        return values['MemAvailable']
+    # older kernels
+    return (values.get('MemFree', 0) + values.get('Buffers', 0) +
+            values.get('Cached', 0))
+
+def chunk_rows(node, buffer_size=BUFFER_SIZE):
+    '''
+    get the number of rows of a table (resp. entries along the first axis of
+    an array) that should be read at once, the number is a multiple of the
+    chunkshape of the node (if chunked), so that no chunk is read twice
+
+    Parameter
+    ---------
+    node: tables.Leaf,
+          the table or array to read
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    rows: int, number of rows to read at once
+    '''
+    if hasattr(node, 'rowsize'):
+        row_size = node.rowsize
+    else:
+        row_size = node.dtype.itemsize
+        for dim in node.shape[1:]:
+            row_size *= dim
+    row_size = max(1, row_size)
+    chunk = 1
+    chunkshape = getattr(node, 'chunkshape', None)
+    if chunkshape:
+        chunk = max(1, chunkshape[0])
+    n_chunks = max(1, buffer_size // (chunk * row_size))
+    return chunk * n_chunks
+
+
+def table_statistics(table, columns=None, buffer_size=BUFFER_SIZE):
+    '''
+    compute statistics of the columns of a PyTables table in a single pass,
+    the table is read chunkwise, so the memory usage stays bounded no matter
+    how large the table is
+
+    Parameter
+    ---------
+    table: tables.Table,
+           the table to analyse
+    columns: list of Strings, optional
+             names of the columns to compute the statistics for (defaults to
+             all columns of the table)
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    statistics: OrderedDict,
+                column names as keys, dictionaries with the 'dtype', the
+                'min' and 'max' values (None for strings) and the number of
+                null values 'n_null' (NaN resp. empty strings) as values
+    '''
+    if columns is None:
+        columns = table.colnames
+    statistics = OrderedDict()
+    for col in columns:
+        statistics[col] = {'dtype': table.dtype[col],
+                           'min': None,
+                           'max': None,
+                           'n_null': 0}
+    if len(columns) == 0:
+        return statistics
+    n_rows = table.nrows
+    step = chunk_rows(table, buffer_size=buffer_size)
+    for start in xrange(0, n_rows, step):
+        chunk = table.read(start, min(start + step, n_rows))
+        for col in columns:
+            _update_statistics(statistics[col], chunk[col])
+    return statistics
+
+
+def _update_statistics(stats, values):
+    '''
+    merge the statistics of the given values into the given statistics
+    '''
+    if values.size == 0:
+        return
+    if values.dtype.char == 'S':
+        stats['n_null'] += int((values == '').sum())
+        return
+    if values.dtype.kind == 'f':
+        stats['n_null'] += int(np.isnan(values).sum())
+    # np.maximum/np.minimum propagate NaNs like max()/min() on the full data
+    maximum = values.max()
+    minimum = values.min()
+    if stats['max'] is None:
+        stats['max'] = maximum
+        stats['min'] = minimum
+    else:
+        stats['max'] = np.maximum(stats['max'], maximum)
+        stats['min'] = np.minimum(stats['min'], minimum)
+
+
+def find_violations(node, checks, n_rows=10, buffer_size=BUFFER_SIZE):
+    '''
+    check every single value of a table or an array in a single pass, the
+    node is read chunkwise, so the memory usage stays bounded no matter how
+    large the node is
+
+    Parameter
+    ---------
+    node: tables.Leaf or np.ndarray,
+          the table or array to check (may be mapped, see memmap_array)
+    checks: list of tuples (column, function),
+            column is the name of the column of a table to check (None for
+            arrays), function is called with the values of a chunk and
+            returns an array of bools (True where the values are valid)
+    n_rows: int, optional
+            maximum number of indices of rows with invalid values to collect
+            per check
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    violations: list of dicts (one per check),
+                the number of invalid values 'count', the number of checked
+                values 'n_values', their ratio 'fraction' and the indices of
+                the first rows containing invalid values 'rows'
+    '''
+    violations = [{'count': 0, 'n_values': 0, 'fraction': 0., 'rows': []}
+                  for check in checks]
+    if len(checks) == 0 or not node.shape:
+        return violations
+    n_total = node.shape[0]
+    step = chunk_rows(node, buffer_size=buffer_size)
+    for start in xrange(0, n_total, step):
+        chunk = _read_rows(node, start, min(start + step, n_total))
+        for (column, function), result in zip(checks, violations):
+            values = chunk if column is None else chunk[column]
+            invalid = ~np.asarray(function(values), dtype=bool)
+            result['n_values'] += values.size
+            if invalid.ndim > 1:
+                # a row is invalid if any of the values in it is invalid
+                invalid = invalid.reshape(invalid.shape[0], -1)
+                count = int(invalid.sum())
+                invalid = invalid.any(axis=1)
+            else:
+                count = int(invalid.sum())
+            if count == 0:
+                continue
+            result['count'] += count
+            missing = n_rows - len(result['rows'])
+            if missing > 0:
+                rows = np.flatnonzero(invalid)[:missing] + start
+                result['rows'].extend(int(r) for r in rows)
+    for result in violations:
+        if result['n_values'] > 0:
+            result['fraction'] = float(result['count']) / result['n_values']
+    return violations
+
+
+def _read_rows(node, start, stop):
+    '''
+    read the rows of a PyTables node or a numpy array (e.g. a memmap)
+    '''
+    if isinstance(node, np.ndarray):
+        return node[start:stop]
+    return node.read(start, stop)
+
+
+def memmap_array(filename, node_path):
+    '''
+    map a contiguous and uncompressed dataset of a HDF5 file directly from the
+    file as a read-only numpy memmap (via the offset of the data in the file),
+    reductions over the mapped data need no copy of it in memory and the
+    pages read are shared with other processes mapping the same file
+
+    Parameter
+    ---------
+    filename: String,
+              the HDF5 file (incl. path)
+    node_path: String,
+               the path of the dataset inside the file
+
+    Return
+    ------
+    data: np.memmap, None if the dataset can't be mapped (chunked,
+          compressed or empty dataset etc.)
+    '''
+    try:
+        with h5py.File(filename, 'r') as h5_file:
+            dataset = h5_file.get(node_path)
+            if (not isinstance(dataset, h5py.Dataset) or
+                dataset.chunks is not None or
+                dataset.compression is not None or
+                dataset.external):
+                return None
+            offset = dataset.id.get_offset()
+            dtype = dataset.dtype
+            shape = dataset.shape
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+    # no data allocated in the file yet or nothing to map
+    if (offset is None or dtype.hasobject or not shape or
+        np.prod(shape) == 0):
+        return None
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                     shape=shape)
+
+
+def array_extrema(node, buffer_size=BUFFER_SIZE):
+    '''
+    get the minimum and the maximum of an array, without reading it into
+    memory at once, contiguous arrays are mapped from the file (see
+    memmap_array), the others are read chunkwise
+
+    Parameter
+    ---------
+    node: tables.Array,
+          the array
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    tuple (minimum, maximum), NaN if the array contains NaNs, None if empty
+    '''
+    if not node.shape:
+        data = node.read()
+        return data.min(), data.max()
+    data = memmap_array(node._v_file.filename, node._v_pathname)
+    if data is not None:
+        return data.min(), data.max()
+    stats = {'min': None, 'max': None, 'n_null': 0}
+    n_total = node.shape[0]
+    step = chunk_rows(node, buffer_size=buffer_size)
+    for start in xrange(0, n_total, step):
+        _update_statistics(stats, node.read(start, min(start + step, n_total)))
+    return stats['min'], stats['max']
+
+
+def map_array(node):
+    '''
+    get the array mapped from the file (see memmap_array) if possible,
+    else the node itself
+    '''
+    if node.shape and hasattr(node, '_v_file'):
+        mapped = memmap_array(node._v_file.filename, node._v_pathname)
+        if mapped is not None:
+            return mapped
+    return node
+
+
+def iter_blocks(node, buffer_size=BUFFER_SIZE):
+    '''
+    iterate over the blocks of an array, the array is split along its
+    leading axes into blocks of about buffer_size bytes (aligned to the
+    chunks, if chunked), if a single row along the first axis is too large,
+    it is split along the next axes as well
+
+    Parameter
+    ---------
+    node: tables.Array or np.ndarray,
+          the array to iterate
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    generator yielding tuples (slices, block), slices is the tuple of
+    slices of the leading axes the block was read with (one for each axis
+    the array was split along)
+    '''
+    shape = node.shape
+    if not shape:
+        yield (), node[()]
+        return
+    # the axis the array is split along, all axes before have length 1
+    # in a block
+    axis = 0
+    row_size = node.dtype.itemsize * int(np.prod(shape[1:]))
+    while row_size > buffer_size and axis < len(shape) - 1:
+        axis += 1
+        row_size //= max(1, shape[axis])
+    n = max(1, buffer_size // max(1, row_size))
+    chunkshape = getattr(node, 'chunkshape', None)
+    if chunkshape:
+        chunk = max(1, chunkshape[axis])
+        n = max(chunk, n // chunk * chunk)
+    for leading in itertools.product(*[xrange(d) for d in shape[:axis]]):
+        for start in xrange(0, shape[axis], n):
+            slices = (tuple(slice(i, i + 1) for i in leading) +
+                      (slice(start, min(start + n, shape[axis])), ))
+            yield slices, node[slices]
+
+
+def blockwise_sum(node, axis=None, buffer_size=BUFFER_SIZE):
+    '''
+    sum up an array blockwise with float64 accumulators, contiguous arrays
+    are mapped from the file if possible (see memmap_array), so the memory
+    usage stays bounded no matter how large the array is
+
+    Parameter
+    ---------
+    node: tables.Array,
+          the array to sum up
+    axis: int, optional
+          None to sum up all values, 0 to sum up the values of each entry
+          along the first axis (e.g. per mode)
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    total: float (axis=None) or np.ndarray of floats (axis=0)
+    '''
+    if axis not in [None, 0]:
+        raise ValueError('only sums over all values or per entry of the '
+                         'first axis supported')
+    source = map_array(node)
+    if axis is None or not node.shape:
+        total = 0.
+        for slices, block in iter_blocks(source, buffer_size=buffer_size):
+            total += np.sum(block, dtype=np.float64)
+        return total
+    totals = np.zeros(node.shape[0], dtype=np.float64)
+    for slices, block in iter_blocks(source, buffer_size=buffer_size):
+        block = np.asarray(block)
+        totals[slices[0]] += block.reshape(block.shape[0], -1).sum(
+            axis=1, dtype=np.float64)
+    return totals
+
+
+def _hash_partitions(values, n_partitions):
+    '''
+    assign the values to partitions by a hash of their raw bytes (FNV-1a),
+    equal values always end up in the same partition
+    '''
+    values = np.ascontiguousarray(values)
+    raw = values.view(np.uint8).reshape(values.shape[0], -1)
+    hashes = np.empty(values.shape[0], dtype=np.uint64)
+    hashes.fill(14695981039346656037)
+    prime = np.uint64(1099511628211)
+    with np.errstate(over='ignore'):
+        for i in xrange(raw.shape[1]):
+            hashes ^= raw[:, i]
+            hashes *= prime
+    return hashes % np.uint64(n_partitions)
+
+
+def _sorted_duplicates(values):
+    '''
+    sort the values in place and find the duplicates
+
+    Return
+    ------
+    tuple (count, duplicates), the number of values equal to a preceding one
+    and the sorted array of the distinct duplicated values
+    '''
+    values.sort()
+    is_duplicate = values[1:] == values[:-1]
+    duplicates = values[1:][is_duplicate]
+    if duplicates.size > 0:
+        # sorted already, drop the repetitions of values occuring 3+ times
+        keep = np.ones(duplicates.size, dtype=bool)
+        keep[1:] = duplicates[1:] != duplicates[:-1]
+        duplicates = duplicates[keep]
+    return int(is_duplicate.sum()), duplicates
+
+
+def find_duplicates(table, column, n_duplicates=10, buffer_size=BUFFER_SIZE,
+                    max_memory=DUPLICATES_MAX_MEMORY):
+    '''
+    search for duplicate values in a column of a PyTables table (e.g. to check
+    the uniqueness of primary keys), the raw values are compared (strings are
+    not decoded), the column is read chunkwise and is partitioned by the
+    hashes of the values into temporary files, if it doesn't fit into the
+    given memory, each partition is sorted in place
+
+    Parameter
+    ---------
+    table: tables.Table,
+           the table containing the column
+    column: String,
+            the name of the column
+    n_duplicates: int, optional
+                  maximum number of duplicate values to return
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+    max_memory: int, optional
+                the maximum number of bytes of the column held in memory
+                at once
+
+    Return
+    ------
+    tuple (count, duplicates), the number of values equal to another value
+    before them in the column (0, if all values are unique) and a list with
+    the first of the duplicated values (in sort order)
+    '''
+    n_rows = table.nrows
+    dtype = table.dtype[column]
+    step = chunk_rows(table, buffer_size=buffer_size)
+    n_partitions = int(np.ceil(float(n_rows * dtype.itemsize) /
+                               max(1, max_memory)))
+
+    def chunks():
+        for start in xrange(0, n_rows, step):
+            values = table.read(start, min(start + step, n_rows),
+                                field=column)
+            if dtype.kind == 'f':
+                # -0.0 equals 0.0, but has different bytes
+                values = values + 0.0
+            yield values
+
+    if n_partitions <= 1:
+        values = np.empty(n_rows, dtype=dtype)
+        for i, chunk in enumerate(chunks()):
+            values[i * step: i * step + chunk.shape[0]] = chunk
+        count, duplicates = _sorted_duplicates(values)
+        return count, duplicates[:n_duplicates].tolist()
+
+    tmp_folder = tempfile.mkdtemp(prefix='gui_vm_')
+    try:
+        filenames = [os.path.join(tmp_folder, '{}.bin'.format(i))
+                     for i in xrange(n_partitions)]
+        files = [open(f, 'wb') for f in filenames]
+        try:
+            for chunk in chunks():
+                partitions = _hash_partitions(chunk, n_partitions)
+                for i, f in enumerate(files):
+                    chunk[partitions == i].tofile(f)
+        finally:
+            for f in files:
+                f.close()
+        count = 0
+        duplicates = []
+        for filename in filenames:
+            values = np.fromfile(filename, dtype=dtype)
+            os.remove(filename)
+            n, dup = _sorted_duplicates(values)
+            count += n
+            duplicates.extend(dup[:n_duplicates].tolist())
+        duplicates.sort()
+        return count, duplicates[:n_duplicates]
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+
+class _PooledFile(object):
+    '''
+    an opened HDF5 file inside the pool
+    '''
+    def __init__(self, h5_file, fingerprint):
+        self.h5_file = h5_file
+        self.fingerprint = fingerprint
+        self.refcount = 0
+        # removed from the pool, closed when not in use anymore
+        self.detached = False
+
+
+class HDF5Pool(object):
+    '''
+    process wide pool of HDF5 files opened for reading, the files are shared
+    by all readers and stay open after they are released (the least recently
+    used ones are closed, if there are more than max_open files), so that
+    the headers and the metadata of the nodes are not read again;
+    files have to be closed before they are deleted or written
+    (see close and close_folder)
+
+    Parameter
+    ---------
+    max_open: int, optional
+              maximum number of open files not in use
+    '''
+    def __init__(self, max_open=MAX_OPEN_FILES):
+        self.max_open = max_open
+        # keys of the files in the order of their last use
+        self._files = OrderedDict()
+        # files in use (incl. detached ones) by the ids of the opened files
+        self._in_use = {}
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def key(filename):
+        return os.path.normcase(os.path.abspath(filename))
+
+    def _check_process(self):
+        # a forked process inherits the pool, the handles of the parent
+        # can't be used there
+        if os.getpid() != self._pid:
+            self._files = OrderedDict()
+            self._in_use = {}
+            self._pid = os.getpid()
+
+    def acquire(self, filename):
+        '''
+        get the opened file, the file is opened if not in the pool or if it
+        was changed since it was opened, has to be released after usage
+
+        Return
+        ------
+        h5_file: tables.File, the opened file
+        '''
+        key = self.key(filename)
+        stats = os.stat(filename)
+        fingerprint = (stats.st_size, stats.st_mtime)
+        with self._lock:
+            self._check_process()
+            pooled = self._files.pop(key, None)
+            if pooled is not None and pooled.fingerprint != fingerprint:
+                self._detach(pooled)
+                pooled = None
+            if pooled is None:
+                pooled = _PooledFile(tables.open_file(filename, 'r'),
+                                     fingerprint)
+            # most recently used file at the end
+            self._files[key] = pooled
+            pooled.refcount += 1
+            self._in_use[id(pooled.h5_file)] = pooled
+            self._evict()
+            return pooled.h5_file
+
+    def release(self, h5_file):
+        '''
+        release a file acquired before, it stays open in the pool
+        '''
+        with self._lock:
+            self._check_process()
+            pooled = self._in_use.get(id(h5_file))
+            if pooled is None:
+                return
+            pooled.refcount -= 1
+            if pooled.refcount <= 0:
+                pooled.refcount = 0
+                del self._in_use[id(h5_file)]
+                if pooled.detached:
+                    pooled.h5_file.close()
+            self._evict()
+
+    def _detach(self, pooled):
+        pooled.detached = True
+        if pooled.refcount == 0:
+            pooled.h5_file.close()
+
+    def _evict(self):
+        # close the least recently used files, that are not in use
+        n_open = len(self._files)
+        for key in self._files.keys():
+            if n_open <= self.max_open:
+                break
+            pooled = self._files[key]
+            if pooled.refcount == 0:
+                del self._files[key]
+                pooled.h5_file.close()
+                n_open -= 1
+
+    def close(self, filename):
+        '''
+        remove the file from the pool and close it (as soon as it is not in
+        use anymore)
+        '''
+        with self._lock:
+            self._check_process()
+            pooled = self._files.pop(self.key(filename), None)
+            if pooled is not None:
+                self._detach(pooled)
+
+    def close_folder(self, folder):
+        '''
+        close all files inside the given folder (incl. subfolders)
+        '''
+        prefix = os.path.join(self.key(folder), '')
+        with self._lock:
+            self._check_process()
+            for key in self._files.keys():
+                if key.startswith(prefix):
+                    self._detach(self._files.pop(key))
+
+    def close_all(self):
+        with self._lock:
+            self._check_process()
+            for key in self._files.keys():
+                self._detach(self._files.pop(key))
+
+    @contextmanager
+    def open(self, filename):
+        '''
+        context manager acquiring the file and releasing it afterwards
+        '''
+        h5_file = self.acquire(filename)
+        try:
+            yield h5_file
+        finally:
+            self.release(h5_file)
+
+h5_pool = HDF5Pool()
+
+# PyTables resp. HDF5 are not thread-safe, the pool only protects its own
+# bookkeeping, threads of the same process working with HDF5 files at the
+# same time (e.g. runs of the scheduler) have to hold this lock while
+# reading or writing them
+h5_lock = threading.RLock()
+
+
 class HDF5(object):
     """
-    Backend to access HDF5 files
+    Backend to access HDF5 files, the files are taken from the pool of
+    opened files (see HDF5Pool)
     """
     def __init__(self, filename):
         self.filename = filename
         self.h5_file = None
 
     def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''
+        release the file (stays open in the pool)
+        '''
         if self.h5_file is not None:
-            self.h5_file.close()
+            h5_pool.release(self.h5_file)
+            self.h5_file = None
 
     @property
     def file_exists(self):
         return os.path.isfile(self.filename)
 
     def read(self):
+        self.close()
         if self.file_exists:
             try:
-                self.h5_file = tables.open_file(self.filename, 'r')
+                self.h5_file = h5_pool.acquire(self.filename)
             except:
                 return False
             return True
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        comparison.py
+## Purpose:     comparison of the demand matrices of two runs (e.g. a scenario
+##              with a base scenario), both files are read blockwise at the
+##              same time, the matrices are never read at once
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import tables
+import numpy as np
+from collections import OrderedDict
+from gui_vm.model.backend import BUFFER_SIZE, iter_blocks, map_array, h5_pool
+
+
+def compare_matrices(base, other, buffer_size=BUFFER_SIZE):
+    '''
+    compare two demand matrices of the same shape blockwise (aligned to the
+    chunks of the base matrix, sums are accumulated in float64), the last two
+    axes of the matrices are origins and destinations, leading axes (e.g.
+    modes) are kept
+
+    Parameters
+    ----------
+    base: tables.Array or np.ndarray,
+          the demand matrix compared with
+    other: tables.Array or np.ndarray,
+           the compared demand matrix
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    results: OrderedDict, names of the results as keys and np.ndarrays
+             as values (per entry of the leading axes, the zonal differences
+             per zone as well)
+    '''
+    shape = base.shape
+    if len(shape) < 2:
+        raise ValueError('Matrix mit mindestens 2 Dimensionen erwartet, '
+                         'Dimension: {}'.format(shape))
+    if other.shape != shape:
+        raise ValueError('Dimensionen der Matrizen unterschiedlich: '
+                         '{} und {}'.format(shape, other.shape))
+    lead_shape = shape[:-2]
+    n_zones_from, n_zones_to = shape[-2:]
+    totals_base = np.zeros(lead_shape, dtype=np.float64)
+    totals = np.zeros(lead_shape, dtype=np.float64)
+    abs_difference = np.zeros(lead_shape, dtype=np.float64)
+    max_abs_difference = np.zeros(lead_shape, dtype=np.float64)
+    changed_cells = np.zeros(lead_shape, dtype=np.int64)
+    productions_difference = np.zeros(lead_shape + (n_zones_from, ),
+                                      dtype=np.float64)
+    attractions_difference = np.zeros(lead_shape + (n_zones_to, ),
+                                      dtype=np.float64)
+
+    base = map_array(base)
+    other = map_array(other)
+    for slices, block in iter_blocks(base, buffer_size=buffer_size):
+        # the position of the block in the matrix (over all axes)
+        index = slices + tuple(slice(0, d) for d in shape[len(slices):])
+        lead, rows, cols = index[:-2], index[-2], index[-1]
+        block = np.asarray(block, dtype=np.float64)
+        other_block = np.asarray(other[index], dtype=np.float64)
+        difference = other_block - block
+        totals_base[lead] += block.sum(axis=(-2, -1))
+        totals[lead] += other_block.sum(axis=(-2, -1))
+        productions_difference[lead + (rows, )] += difference.sum(axis=-1)
+        attractions_difference[lead + (cols, )] += difference.sum(axis=-2)
+        np.abs(difference, out=difference)
+        abs_difference[lead] += difference.sum(axis=(-2, -1))
+        max_abs_difference[lead] = np.maximum(
+            max_abs_difference[lead], difference.max(axis=(-2, -1)))
+        changed_cells[lead] += (difference > 0).sum(axis=(-2, -1))
+
+    difference = totals - totals_base
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_change = np.where(totals_base != 0,
+                                   difference / totals_base, np.nan)
+
+    results = OrderedDict()
+    results['totals_base'] = totals_base
+    results['totals'] = totals
+    results['difference'] = difference
+    results['relative_change'] = relative_change
+    results['abs_difference'] = abs_difference
+    results['max_abs_difference'] = max_abs_difference
+    results['changed_cells'] = changed_cells
+    results['productions_difference'] = productions_difference
+    results['attractions_difference'] = attractions_difference
+    return results
+
+
+def compare_outputs(base_node, output_node, buffer_size=BUFFER_SIZE):
+    '''
+    compare the demand matrices of the results of two runs, the matrices
+    are taken from the evaluation script of the model (MATRICES)
+
+    Parameters
+    ----------
+    base_node: OutputNode,
+               the run compared with (e.g. primary run of the base scenario)
+    output_node: OutputNode,
+                 the compared run
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    comparison: OrderedDict, names of the matrices as keys and the results
+                of their comparison as values (see compare_matrices),
+                matrices missing in one of the files are skipped
+    '''
+    module = output_node.model.evaluation_module
+    matrices = getattr(module, 'MATRICES', None)
+    if not matrices:
+        raise ValueError('Ergebnisse des Modells {} können nicht verglichen '
+                         'werden.'.format(output_node.model.name))
+    base_file = base_node.file_absolute
+    output_file = output_node.file_absolute
+    for filename in [base_file, output_file]:
+        if filename is None or not os.path.exists(filename):
+            raise ValueError('Datei {} nicht vorhanden!'.format(filename))
+    comparison = OrderedDict()
+    with h5_pool.open(base_file) as h5_base:
+        with h5_pool.open(output_file) as h5_other:
+            for name, (path, travel_times) in matrices.items():
+                try:
+                    base = h5_base.get_node(path)
+                    other = h5_other.get_node(path)
+                except tables.NoSuchNodeError:
+                    continue
+                comparison[name] = compare_matrices(
+                    base, other, buffer_size=buffer_size)
+    return comparison
+
+
+def comparison_summary(comparison):
+    '''
+    format the results of a comparison to be displayed
+
+    Parameters
+    ----------
+    comparison: OrderedDict, the results of the comparison
+                (see compare_outputs)
+
+    Return
+    ------
+    summary: OrderedDict, labels as keys and formatted Strings as values
+    '''
+    summary = OrderedDict()
+    for name, results in comparison.items():
+        lead_shape = results['totals'].shape
+        for lead in np.ndindex(*lead_shape):
+            label = name
+            if lead:
+                label += ' ' + ' '.join(str(i) for i in lead)
+            relative = results['relative_change'][lead]
+            relative = ('-' if np.isnan(relative)
+                        else '{:+.2%}'.format(relative))
+            summary['Wege ' + label] = '{:,.0f} -> {:,.0f} ({:+,.0f}, {})'.format(
+                results['totals_base'][lead], results['totals'][lead],
+                results['difference'][lead], relative)
+            summary['Abweichungen ' + label] = (
+                '{:,.0f} (max. {:,.2f}, {} Relationen geändert)'.format(
+                    results['abs_difference'][lead],
+                    results['max_abs_difference'][lead],
+                    results['changed_cells'][lead]))
+            productions = results['productions_difference'][lead]
+            attractions = results['attractions_difference'][lead]
+            i = int(np.abs(productions).argmax())
+            j = int(np.abs(attractions).argmax())
+            summary['Bezirke ' + label] = (
+                'max. Änderung Quellverkehr Bezirk an Position {}: {:+,.0f}, '
+                'Zielverkehr Bezirk an Position {}: {:+,.0f}'.format(
+                    i + 1, productions[i], j + 1, attractions[j]))
+    return summary
@@ -4,9 +4,47 @@ from argparse import ArgumentParser
 from collections import OrderedDict
 import os
 import csv
+from gui_vm.model.backend import h5_pool, blockwise_sum
+from gui_vm.model.summary import (summarize_file, read_summary, AGGREGATES,
+                                  TIME_BINS)
 
-def evaluate(h5_in_path, csv_out):
+# the summarized demand matrices and the travel times they are classified
+# by (name of the input resource and path of the travel times), the travel
+# times of the public transport are given per time slice and can't be
+# matched with the demand
+MATRICES = OrderedDict([
+    ('bicycle', ('/modes/bicycle', ('Fuss und Rad', '/nmt/t_bicycle'))),
+    ('car', ('/modes/car', ('MIV', '/visum/tAkt'))),
+    ('foot', ('/modes/foot', ('Fuss und Rad', '/nmt/t_foot'))),
+    ('passenger', ('/modes/passenger', ('MIV', '/visum/tAkt'))),
+    ('put', ('/modes/put', None)),
+])
+
+
+def summarize(h5_in_path, input_files=None, aggregates=AGGREGATES,
+              bins=TIME_BINS):
+    '''
+    compute the aggregates of the demand matrices of the modes
+    (see summary.summarize_file)
+    '''
+    return summarize_file(h5_in_path, MATRICES, input_files=input_files,
+                          aggregates=aggregates, bins=bins)
+
+
+def compute(h5_in_path):
+    '''
+    compute the sums and shares of the trips per mode of the demand file
 
+    Parameter
+    ---------
+    h5_in_path: String, the demand file (incl. path)
+
+    Return
+    ------
+    meta: OrderedDict, names of the results as keys and their values as
+          values (sums as ints, shares as formatted Strings), None if the
+          file doesn't exist
+    '''
     mode_path = '/modes'
     modes = OrderedDict({
         'Fahrrad': 'bicycle',
@@ -20,33 +58,51 @@ def evaluate(h5_in_path, csv_out):
 
     if h5_in_path is None or not os.path.exists(h5_in_path):
         print 'Datei {} nicht vorhanden!'.format(h5_in_path)
-        return
+        return None
+
+    # the totals of an up to date summary are taken instead of reading the
+    # matrices again
+    summary = read_summary(h5_in_path) or {}
 
-    with tables.open_file(h5_in_path) as h5_in:
+    with h5_pool.open(h5_in_path) as h5_in:
 
         try:
             for name, mode_table in modes.items():
                 path = mode_path + '/' + mode_table
-                table = h5_in.get_node(path).read()
-                mode_sum = table.sum()
+                aggregates = summary.get(mode_table, {})
+                if 'totals' in aggregates:
+                    mode_sum = float(aggregates['totals'].sum())
+                else:
+                    # summed up blockwise, the matrix is not read at once
+                    mode_sum = blockwise_sum(h5_in.get_node(path))
                 meta['Wegesumme ' + name] = int(round(mode_sum))
                 modes[name] = mode_sum
                 modes_sum += mode_sum
         except tables.NoSuchNodeError as e:
             print e.message
-            meta = {'Fehler': 'Benötigte Tabelle fehlt: "{}"'.format(
+            meta = OrderedDict([('Fehler', 'Benötigte Tabelle fehlt: "{}"'.format(
                 e.message
-            )}
+            ))])
         else:
             meta['Summe aller Wege'] = int(round(modes_sum))
             for name, mode_sum in modes.items():
                 meta['Anteil ' + name] = '{:.2%}'.format(mode_sum / modes_sum)
+    return meta
 
+def write_csv(meta, csv_out):
+    '''
+    export the computed results into a csv file (header and a single row)
+    '''
     with open(csv_out, 'wb') as csv_file:
         w = csv.DictWriter(csv_file, meta.keys())
         w.writeheader()
         w.writerow(meta)
 
+def evaluate(h5_in_path, csv_out):
+    meta = compute(h5_in_path)
+    if meta is not None:
+        write_csv(meta, csv_out)
+
 def startmain():
     parser = ArgumentParser(description="Maxem")
 
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        outcome.py
+## Purpose:     decides whether a traffic model run succeeded, failed or hung,
+##              combines the exit status of the process, the final message of
+##              the model, the check of the output file and a heartbeat
+##              timeout on the output of the run
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import time
+
+# outcomes of a run
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+HUNG = 'hung'
+
+
+class RunOutcome(object):
+    '''
+    the outcome of a run, decided when the process finished (see finish)
+
+    Parameters
+    ----------
+    check_output: function, optional
+                  called without arguments when the process finished,
+                  returns True if the expected output (file) is valid
+    heartbeat_timeout: float, optional
+                       seconds without any output after which the run is
+                       regarded as hung (0: no timeout)
+    '''
+    def __init__(self, check_output=None, heartbeat_timeout=0):
+        self.check_output = check_output
+        self.heartbeat_timeout = float(heartbeat_timeout or 0)
+        self.status = RUNNING
+        self.message = ''
+        self.exit_code = None
+        self.last_heartbeat = time.time()
+
+    @property
+    def is_finished(self):
+        return self.status != RUNNING
+
+    @property
+    def succeeded(self):
+        return self.status == SUCCEEDED
+
+    def heartbeat(self):
+        '''
+        the run is alive (e.g. wrote some output)
+        '''
+        self.last_heartbeat = time.time()
+
+    def check_heartbeat(self):
+        '''
+        check if the run is hung (no heartbeat for longer than the timeout),
+        the run is marked as hung then, it is up to the caller to kill the
+        process
+
+        Return
+        ------
+        hung: bool, True if the run was marked as hung by this call
+        '''
+        if self.status != RUNNING or self.heartbeat_timeout <= 0:
+            return False
+        silence = time.time() - self.last_heartbeat
+        if silence < self.heartbeat_timeout:
+            return False
+        self.status = HUNG
+        self.message = ('Keine Ausgabe des Modells seit {:.0f} Sekunden, '
+                        'der Lauf hängt.'.format(silence))
+        return True
+
+    def finish(self, parser, exit_code, crashed=False, exit_codes=True):
+        '''
+        decide the outcome of the finished process, a run marked as hung
+        stays hung
+
+        Parameters
+        ----------
+        parser: ProgressParser,
+                the parser of the output of the run (flushed), the final
+                message is required if the model has one (see
+                ProgressParser.has_sentinel),
+                the run fails if any errors were parsed
+        exit_code: int, the exit code of the process
+        crashed: bool, optional
+                 True if the process crashed or was killed
+        exit_codes: bool, optional
+                    False if the model doesn't return usable exit codes
+
+        Return
+        ------
+        status: String, the outcome (SUCCEEDED, FAILED or HUNG)
+        '''
+        self.exit_code = exit_code
+        if self.status == HUNG:
+            return self.status
+        has_sentinel = parser.has_sentinel
+        self.status = FAILED
+        if crashed:
+            self.message = 'Der Lauf wurde abgebrochen.'
+        elif parser.errors:
+            # errors after the final message fail the run as well (e.g. while
+            # writing the results)
+            self.message = 'Fehler im Modell: {}'.format(parser.errors[-1])
+        elif has_sentinel and not parser.is_done:
+            self.message = 'Der Lauf wurde nicht abgeschlossen.'
+        elif not has_sentinel and exit_codes and exit_code != 0:
+            self.message = 'Das Modell wurde mit Fehlercode {} beendet.'.format(
+                exit_code)
+        elif self.check_output is not None and not self.check_output():
+            self.message = 'Die Ergebnisdatei fehlt oder ist fehlerhaft.'
+        else:
+            self.status = SUCCEEDED
+            self.message = ''
+        return self.status
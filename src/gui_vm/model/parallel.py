@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        parallel.py
+## Purpose:     update the resources of scenarios in a pool of processes,
+##              the resulting states are merged back into the resources of the
+##              traffic models of the calling process
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import multiprocessing
+import traceback
+from gui_vm.config.config import Config
+from gui_vm.model.traffic_model import TrafficModel
+
+config = Config()
+
+# traffic models of a worker process, are created once per model type
+_models = {}
+
+
+def monitor_resources(model):
+    '''
+    get the names of the resources, the monitored attributes of the given
+    traffic model are taken from
+
+    Return
+    ------
+    resources: dict, names of the monitored attributes as keys and the
+               names of the resources as values
+    '''
+    return model.monitor_resources()
+
+
+def _update_resource(task):
+    '''
+    update and validate a resource inside a worker process, the traffic model
+    the resource belongs to is built once per process (one open h5 file per
+    worker)
+
+    Parameter
+    ---------
+    task: tuple of (index, model name, resource name, path, subfolder,
+          filename, monitors), monitors is a dict with the values of the
+          monitored attributes of the model the resource depends on
+
+    Return
+    ------
+    result: tuple of (index, state, monitors, error), state is None and error
+            the traceback if the update failed
+    '''
+    index, model_name, resource_name, path, subfolder, filename, monitors = task
+    try:
+        model = _models.get(model_name)
+        if model is None:
+            model = TrafficModel.new_specific_model(model_name)
+            _models[model_name] = model
+        # multiplies placeholder columns depending on other resources
+        for monitor_name, value in monitors.items():
+            model.set(monitor_name, value)
+        resource = model.resources[resource_name]
+        resource.subfolder = subfolder
+        resource.set_source(filename)
+        resource.update(path)
+        # the values violating the rules are searched here as well, the
+        # caller finds the reports in the state (see H5Resource.validate)
+        resource.validate(path)
+        provided = dict(
+            (m, getattr(model, m))
+            for m, res_name in monitor_resources(model).items()
+            if res_name == resource_name)
+        return index, resource.get_state(), provided, None
+    except Exception:
+        return index, None, {}, traceback.format_exc()
+
+
+def is_provider(node):
+    '''
+    True if the resource of the given node provides monitored attributes
+    '''
+    return node.resource_name in monitor_resources(node.model).values()
+
+
+def split_providers(resource_nodes):
+    '''
+    split the given nodes into the ones, whose resources provide monitored
+    attributes, and the ones that may depend on them
+
+    Return
+    ------
+    tuple of (providers, dependents), both lists of ResourceNodes
+    '''
+    providers = []
+    dependents = []
+    for node in resource_nodes:
+        if is_provider(node):
+            providers.append(node)
+        else:
+            dependents.append(node)
+    return providers, dependents
+
+
+def default_processes():
+    '''
+    number of processes as defined in the settings (all cores if not set)
+    '''
+    processes = int(config.settings.get('validation_processes', 0) or 0)
+    if processes <= 0:
+        processes = multiprocessing.cpu_count()
+    return processes
+
+
+def collect_tasks(resource_nodes):
+    '''
+    collect the plain data needed to update the resources of the given nodes
+    in worker processes, has to be called in the thread the nodes belong to
+    (iter_states doesn't access the nodes, the project tree may change in the
+    meantime)
+
+    Parameter
+    ---------
+    resource_nodes: list of ResourceNodes, the nodes to update
+
+    Return
+    ------
+    tasks:    list of tuples (index, scenario key, is provider, task), index
+              is the position of the node in the given list, task is a tuple
+              of (model name, resource name, path, subfolder, filename)
+    monitors: dict, the keys of the scenarios as keys and dicts with the
+              current values of their monitored attributes as values
+    '''
+    tasks = []
+    monitors = {}
+    for index, node in enumerate(resource_nodes):
+        scenario_key = id(node.scenario)
+        model = node.model
+        if scenario_key not in monitors:
+            monitors[scenario_key] = dict(
+                (m, getattr(model, m)) for m in model.monitored)
+        tasks.append((index, scenario_key, is_provider(node),
+                      (model.name, node.resource_name, node.path,
+                       node.resource.subfolder, node.resource.filename)))
+    return tasks, monitors
+
+
+def iter_states(tasks, monitors, processes=None):
+    '''
+    update and validate the resources of the given tasks in a pool of
+    processes and yield the resulting states as soon as they are available
+    (unordered), the resources providing monitored attributes are updated
+    first, because the other ones may depend on them (placeholders in column
+    names), the values violating the rules are searched in the workers as
+    well (see H5Resource.validate); no resources are touched in the calling
+    process, the states are applied by the consumer (see update_parallel)
+
+    Parameters
+    ----------
+    tasks:     list of tuples, the tasks as collected by collect_tasks
+    monitors:  dict, the values of the monitored attributes per scenario as
+               collected by collect_tasks, updated with the provided values
+    processes: int, optional
+               number of processes (defaults to the settings)
+
+    Return
+    ------
+    generator yielding tuples of (index, state, error), index is the
+    position of the node the task was collected for, state is None if the
+    update of the resource failed (error contains the traceback then)
+    '''
+    if not tasks:
+        return
+    if processes is None:
+        processes = default_processes()
+    processes = max(1, min(processes, len(tasks)))
+    scenario_keys = {}
+    providers = []
+    dependents = []
+    for index, scenario_key, provider, task in tasks:
+        scenario_keys[index] = scenario_key
+        if provider:
+            providers.append((index, task))
+        else:
+            dependents.append((index, task))
+
+    def worker_tasks(tasks):
+        for index, task in tasks:
+            yield (index, ) + task + (monitors[scenario_keys[index]], )
+
+    # the resources are always read in other processes, PyTables is not
+    # thread-safe and the calling process may read files at the same time
+    pool = multiprocessing.Pool(processes)
+    try:
+        for group in [providers, dependents]:
+            for index, state, provided, error in pool.imap_unordered(
+                _update_resource, worker_tasks(group)):
+                monitors[scenario_keys[index]].update(provided)
+                yield index, state, error
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def failure_message(node, error):
+    '''
+    the message reported if the update of the resource of the given node
+    failed in a worker process (with the last line of the traceback)
+    '''
+    lines = (error or '').strip().splitlines()
+    reason = lines[-1] if lines else ''
+    return ('Prüfung von "{}" im Hintergrund fehlgeschlagen, wird erneut '
+            'geprüft ({})'.format(node.resource_name, reason))
+
+
+def update_parallel(resource_nodes, processes=None, callback=None,
+                    on_error=None):
+    '''
+    update the resources of the given nodes in a pool of processes,
+    states that are cached (see InputNode.restore_cached_state) are restored
+    without reading the files again, the resulting states are applied to the
+    resources in the order of the given nodes (triggering the monitors like
+    a serial update would, providers of monitored attributes first),
+    resources that failed to update in a worker are updated in this process
+
+    Parameters
+    ----------
+    resource_nodes: list of ResourceNodes, the nodes to update
+    processes:      int, optional
+                    number of processes (defaults to the settings)
+    callback:       function, optional
+                    is called with the number of updated nodes and the number
+                    of all nodes each time a state is applied
+    on_error:       function, optional
+                    is called with a message, if the update of a resource in
+                    a worker failed
+    '''
+    uncached = []
+    providers, dependents = split_providers(resource_nodes)
+    for node in providers + dependents:
+        if node.resource is None:
+            continue
+        if (hasattr(node, 'restore_cached_state') and
+            node.restore_cached_state()):
+            continue
+        uncached.append(node)
+    n_done = len(resource_nodes) - len(uncached)
+    if callback:
+        callback(n_done, len(resource_nodes))
+
+    if processes is None:
+        processes = default_processes()
+    # the overhead of the pool doesn't pay off for single resources
+    if processes <= 1 or len(uncached) <= 1:
+        for node in uncached:
+            node.resource.update(node.path)
+            n_done += 1
+            if callback:
+                callback(n_done, len(resource_nodes))
+        return
+
+    states = {}
+    tasks, monitors = collect_tasks(uncached)
+    for index, state, error in iter_states(tasks, monitors,
+                                           processes=processes):
+        if error and on_error:
+            on_error(failure_message(uncached[index], error))
+        states[index] = state
+    for i, node in enumerate(uncached):
+        state = states.get(i)
+        if state is not None:
+            node.resource.restore(state)
+        else:
+            node.resource.update(node.path)
+        n_done += 1
+        if callback:
+            callback(n_done, len(resource_nodes))
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        process.py
+## Purpose:     run external programs without Qt, offers the parts of the
+##              interface of the QProcess the traffic models use
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import shlex
+import subprocess
+import threading
+import Queue
+
+
+class Signal(object):
+    '''
+    minimal replacement of a Qt signal, the connected callbacks are called
+    with the arguments of emit
+    '''
+    def __init__(self):
+        self._callbacks = []
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def disconnect(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def emit(self, *args):
+        for callback in list(self._callbacks):
+            callback(*args)
+
+
+class Process(object):
+    '''
+    runs an external program in a subprocess, the output is read in threads
+    and the signals are emitted like the ones of a QProcess (only one signal
+    is handled at a time, all of them in one dispatching thread, except for
+    started, which is emitted in the thread starting the process)
+    '''
+    # exit status (like QProcess.ExitStatus)
+    NormalExit = 0
+    CrashExit = 1
+
+    def __init__(self):
+        self.started = Signal()
+        self.finished = Signal()
+        self.readyReadStandardOutput = Signal()
+        self.readyReadStandardError = Signal()
+        self._popen = None
+        self._threads = []
+        self._stdout = []
+        self._stderr = []
+        self._buffer_lock = threading.Lock()
+        # signals to emit, handled one after another by the dispatcher
+        # (no lock is held while handling them)
+        self._signals = Queue.Queue()
+        self._done = threading.Event()
+        self._killed = False
+
+    def start(self, command):
+        '''
+        start the given command (string, arguments separated by whitespaces,
+        quotes are respected)
+        '''
+        if os.name == 'nt':
+            args = command
+        else:
+            args = shlex.split(command)
+        self._done.clear()
+        self._killed = False
+        self._popen = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+        # emitted before any other signal can be
+        self.started.emit()
+        self._threads = [
+            threading.Thread(target=self._read,
+                             args=(self._popen.stdout, self._stdout,
+                                   self.readyReadStandardOutput)),
+            threading.Thread(target=self._read,
+                             args=(self._popen.stderr, self._stderr,
+                                   self.readyReadStandardError))
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        for target in [self._watch, self._dispatch]:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def _emit(self, signal, *args):
+        self._signals.put((signal, args))
+
+    def _dispatch(self):
+        while True:
+            item = self._signals.get()
+            # finished was handled
+            if item is None:
+                break
+            signal, args = item
+            signal.emit(*args)
+        self._done.set()
+
+    def _read(self, pipe, buffer, signal):
+        for line in iter(pipe.readline, b''):
+            with self._buffer_lock:
+                buffer.append(line)
+            self._emit(signal)
+        pipe.close()
+
+    def _watch(self):
+        # finished is emitted after all of the output was read
+        for thread in self._threads:
+            thread.join()
+        exit_code = self._popen.wait()
+        self._emit(self.finished, exit_code)
+        self._signals.put(None)
+
+    def _read_all(self, buffer):
+        with self._buffer_lock:
+            content = ''.join(buffer)
+            del buffer[:]
+        return content
+
+    def readAllStandardOutput(self):
+        return self._read_all(self._stdout)
+
+    def readAllStandardError(self):
+        return self._read_all(self._stderr)
+
+    def pid(self):
+        if self._popen is None:
+            return None
+        return self._popen.pid
+
+    def exitCode(self):
+        if self._popen is None:
+            return None
+        return self._popen.returncode
+
+    def exitStatus(self):
+        '''
+        CrashExit if the process was killed (resp. terminated by a signal),
+        else NormalExit
+        '''
+        if self._popen is None or self._popen.returncode is None:
+            return self.NormalExit
+        if self._killed or self._popen.returncode < 0:
+            return self.CrashExit
+        return self.NormalExit
+
+    def is_running(self):
+        return self._popen is not None and not self._done.is_set()
+
+    def kill(self):
+        if self.is_running():
+            self._killed = True
+            try:
+                self._popen.kill()
+            except OSError:
+                # already terminated
+                pass
+
+    def wait(self, timeout=None):
+        '''
+        block until the process finished and all signals were handled
+
+        Return
+        ------
+        exit code of the process, None if not finished yet (timeout)
+        '''
+        if self._popen is None:
+            return None
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            return None
+        return self._popen.returncode
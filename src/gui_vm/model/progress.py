@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        progress.py
+## Purpose:     incremental parsing of the output of traffic model runs, the
+##              output is split into lines (chunks may contain partial lines
+##              or multiple lines), the lines are matched with the handlers
+##              of the traffic model and turned into events to track the
+##              progress of the run
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import re
+from gui_vm.config.config import Config
+
+config = Config()
+
+# kinds of events
+ITERATION = 'iteration'
+GROUP = 'group'
+EMPTY_GROUP = 'empty_group'
+TRIP_CHAIN = 'trip_chain'
+DONE = 'done'
+ERROR = 'error'
+
+
+class ProgressEvent(object):
+    '''
+    event parsed from a line of the output of a run
+
+    Parameters
+    ----------
+    kind:   String, the kind of the event (e.g. ITERATION)
+    values: dict, the named groups of the matching regular expression
+    line:   String, the line the event was parsed from
+    '''
+    def __init__(self, kind, values, line):
+        self.kind = kind
+        self.values = values
+        self.line = line
+
+    def __repr__(self):
+        return '{} {}'.format(self.kind, self.values)
+
+
+class ProgressParser(object):
+    '''
+    line buffered parser of the output of a run, the chunks of output are
+    fed as they are read, incomplete lines are kept until they are completed
+    by following chunks (separately for each output stream), each complete
+    line is matched with all handlers once
+
+    subclasses define the handlers of the output of their traffic model and
+    track the progress by handling the events, the patterns of the errors and
+    of the final message of a successful run are taken from the settings of
+    the model (error_pattern, done_pattern), the defaults of the parser are
+    taken if they are not set there
+
+    Parameters
+    ----------
+    model: TrafficModel, the traffic model that is run
+    '''
+    # list of tuples (kind of event, regular expression), the named groups
+    # of the expression are passed as values of the event
+    HANDLERS = []
+    # header of the traceback of an uncaught exception of a model written in
+    # python (lines only containing 'error' may be harmless messages)
+    ERROR_PATTERN = r'^Traceback \(most recent call last\):'
+    # final message of a successful run, None if the model has none
+    DONE_PATTERN = None
+
+    def __init__(self, model):
+        self.model = model
+        self.progress = 0.
+        self.is_done = False
+        self.errors = []
+        models = config.settings.get('trafficmodels', {})
+        model_settings = models.get(getattr(model, 'name', None)) or {}
+        self.error_pattern = (model_settings.get('error_pattern') or
+                              self.ERROR_PATTERN)
+        self.done_pattern = (model_settings.get('done_pattern') or
+                             self.DONE_PATTERN)
+        handlers = list(self.HANDLERS)
+        if self.error_pattern:
+            handlers.append((ERROR, self.error_pattern))
+        if self.done_pattern:
+            handlers.append((DONE, self.done_pattern))
+        self._handlers = [(kind, re.compile(pattern))
+                          for kind, pattern in handlers]
+        # the incomplete last lines of the streams, as lists of chunks
+        # (joined once when the line is completed)
+        self._pending = {}
+
+    @property
+    def has_sentinel(self):
+        '''
+        True if the model writes a final message on success (the run is only
+        successful if it was parsed)
+        '''
+        return bool(self.done_pattern)
+
+    def feed(self, data, stream=None):
+        '''
+        parse a chunk of output
+
+        Parameters
+        ----------
+        data:   String, the chunk of output
+        stream: String, optional
+                the name of the stream the chunk was read from (e.g. stderr),
+                partial lines of different streams are not mixed up
+
+        Return
+        ------
+        tuple (lines, events), the lines completed by the chunk and the
+        events parsed from them
+        '''
+        if not data:
+            return [], []
+        pending = self._pending.setdefault(stream, [])
+        if '\n' not in data:
+            pending.append(data)
+            return [], []
+        lines = data.split('\n')
+        rest = lines.pop()
+        if pending:
+            lines[0] = ''.join(pending) + lines[0]
+            del pending[:]
+        if rest:
+            pending.append(rest)
+        return self._parse(lines)
+
+    def flush(self):
+        '''
+        parse the incomplete last lines of all streams (e.g. when the run
+        finished)
+
+        Return
+        ------
+        tuple (lines, events)
+        '''
+        lines = []
+        for pending in self._pending.values():
+            if pending:
+                lines.append(''.join(pending))
+                del pending[:]
+        return self._parse(lines)
+
+    def _parse(self, lines):
+        lines = [line.rstrip('\r') for line in lines]
+        events = []
+        for line in lines:
+            for kind, regex in self._handlers:
+                match = regex.search(line)
+                if match:
+                    event = ProgressEvent(kind, match.groupdict(), line)
+                    self.handle(event)
+                    events.append(event)
+        return lines, events
+
+    def handle(self, event):
+        '''
+        track the progress, override in subclasses to handle the events of
+        the traffic model
+        '''
+        if event.kind == ERROR:
+            self.errors.append(event.line)
+        elif event.kind == DONE:
+            self.is_done = True
+            self.progress = 100.
@@ -16,13 +16,19 @@ from copy import deepcopy
 import os
 import time
 import imp
+import numbers
 from lxml import etree
-from shutil import copytree
+from shutil import copytree, rmtree
 from gui_vm.config.config import Config
 from gui_vm.model.resources import ResourceFile, H5Resource
 from gui_vm.model.traffic_model import TrafficModel
 from gui_vm.model.observable import Observable
-from gui_vm.model.backend import hard_copy
+from gui_vm.model.backend import hard_copy, h5_pool, h5_lock
+from gui_vm.model.validation_cache import ValidationCache
+from gui_vm.model.parallel import update_parallel
+from gui_vm.model.telemetry import RunTelemetry
+from gui_vm.model.outcome import RunOutcome
+from gui_vm.model.summary import summary_file
 from collections import OrderedDict
 
 #dictionary defines how classes are called when written to xml
@@ -437,7 +443,25 @@ class Scenario(TreeNode):
             return None
         return pr[0]
 
-    def run(self, process, run_name, options=None, callback=None):
+    def run(self, process, run_name, options=None, callback=None,
+            resume=False):
+        '''
+        run the traffic model of the scenario, the results are evaluated after
+        the run succeeded, after a successful primary run the specific runs
+        are removed (they depend on the results of the primary run)
+
+        Parameters
+        ----------
+        resume: bool, optional
+                resume the run from its last checkpoint (if there is one),
+                else the checkpoints of previous runs are removed
+
+        Return
+        ------
+        outcome: RunOutcome, the outcome of the run (decided when the process
+                 finished), check_heartbeat has to be called regularly to
+                 detect hung runs
+        '''
         results_run = self.get_output(run_name)
         #results with given name do not exist yet -> create them
         if results_run is None:
@@ -447,24 +471,143 @@ class Scenario(TreeNode):
             self.project.emit()
         project_xml = self.project.filename
 
+        checkpoint_folder = None
+        resume_from = None
+        if self.model.supports_checkpoints:
+            checkpoint_folder = results_run.checkpoint_folder
+            if resume:
+                resume_from = results_run.last_checkpoint
+            if resume_from is None:
+                results_run.remove_checkpoints()
+            if checkpoint_folder is not None and not os.path.exists(
+                checkpoint_folder):
+                os.makedirs(checkpoint_folder)
+        # the results of a previous run must not be taken for the results of
+        # this run, they are restored if this run fails (the specific runs
+        # still depend on the previous results of the primary run)
+        with h5_lock:
+            results_run.keep_previous_results()
+
         def on_success():
+            # the specific runs, the previous results and the checkpoints are
+            # invalidated not before the new results are there
+            if run_name == self.PRIMARY_RUN:
+                self.remove_output_files(specific_only=True)
+            results_run.remove_previous_results()
+            results_run.remove_checkpoints()
             output_file = results_run.file_absolute
-            self.model.evaluate(output_file, overwrite=True)
+            input_files = dict((node.resource_name, node.file_absolute)
+                               for node in self.get_input_files())
+            # summarized first, the evaluation takes the totals from the
+            # summary instead of reading the results again
+            self.model.summarize(output_file, input_files=input_files,
+                                 overwrite=True)
+            self.model.evaluate(
+                output_file, overwrite=True,
+                export_csv=config.settings.get('evaluation_csv', True))
             self.project.emit()
 
+        # the resource usage of the run is sampled, the summary is stored
+        # together with the monitored attributes of the model (e.g. number
+        # of zones) to see how runs scale
+        interval = float(config.settings.get('telemetry_interval', 5) or 0)
+        telemetry = RunTelemetry(interval) if interval > 0 else None
+        parameters = OrderedDict()
+        for attr in self.model.monitored:
+            value = getattr(self.model, attr, None)
+            if isinstance(value, numbers.Number):
+                parameters[attr] = value
+
+        def on_finished(*args):
+            summary = OrderedDict(parameters)
+            summary.update(telemetry.summary)
+            summary['outcome'] = outcome.status
+            results_run.telemetry = summary
+            output_file = results_run.file_absolute
+            if output_file is not None:
+                csv_file = os.path.splitext(output_file)[0] + '_telemetry.csv'
+                try:
+                    telemetry.write_csv(csv_file)
+                except (IOError, OSError), e:
+                    if callback:
+                        callback('Die Messwerte des Laufs konnten nicht '
+                                 'geschrieben werden ({})'.format(e))
+            self.project.emit()
+
+        def check_output():
+            # the results file has to exist and has to be readable
+            results_run.update()
+            results_run.validate()
+            if not results_run.is_valid:
+                return False
+            try:
+                with h5_pool.open(results_run.file_absolute):
+                    pass
+            except Exception:
+                return False
+            return True
+
+        def on_failed(*args):
+            if outcome.succeeded:
+                return
+            with h5_lock:
+                results_run.restore_previous_results()
+                results_run.update()
+                results_run.validate()
+
+        outcome = RunOutcome(
+            check_output=check_output,
+            heartbeat_timeout=config.settings.get('run_heartbeat_timeout', 0))
+
+        # the model writes into the folder of the scenario
+        with h5_lock:
+            h5_pool.close_folder(self.path)
+
         #model defines run command etc.
         self.model.run(self.name,
                        process,
                        xml_file=project_xml,
                        run_name=run_name,
                        on_success=on_success,
-                       callback=callback)
+                       callback=callback,
+                       telemetry=telemetry,
+                       outcome=outcome,
+                       checkpoint_folder=checkpoint_folder,
+                       resume_from=resume_from)
+        # connected after the model, the outcome is decided and the sampling
+        # is stopped by then
+        process.finished.connect(on_failed)
+        if telemetry is not None:
+            process.finished.connect(on_finished)
+        return outcome
 
         #temporary add manually, on success adding doesn't work by now (tdmks doesn't complete
         #successful)
         #results_run = self.add_run(run_name)
 
 
+    def remove_output_files(self, specific_only=False):
+        '''
+        remove the folders with the results of all runs of this scenario
+        from disk (they become invalid, if the primary run is executed again)
+
+        Parameters
+        ----------
+        specific_only: bool, optional
+                       remove only the results of the specific runs, if True
+        '''
+        for output in self.get_output_files():
+            if specific_only and output.name == self.PRIMARY_RUN:
+                continue
+            if output.file_absolute is None:
+                continue
+            folder = os.path.split(output.file_absolute)[0]
+            h5_pool.close_folder(folder)
+            try:
+                rmtree(folder)
+            except:
+                pass
+
     def add_run(self, run_name, options=None):
         filename = '{} - {}{}'.format(self.name, run_name, '.h5')
         results_node = self.get_child(self.OUTPUT_NODES)
@@ -485,17 +628,51 @@ class Scenario(TreeNode):
 
         return results_run
 
-    def validate(self):
+    def update(self, callback=None):
+        '''
+        Override:
+        update the inputs in parallel, the outputs afterwards
+
+        Parameter
+        ---------
+        callback: function, optional
+                  is called with messages of failed updates in the worker
+                  processes (updated in this process again)
+        '''
+        update_parallel(self.get_input_files(), on_error=callback)
+        for node in self.get_output_files():
+            node.update()
+
+    def validate(self, changed=None):
+        '''
+        Override:
+        validate the inputs and outputs of the scenario
+
+        Parameter
+        ---------
+        changed: list of InputNodes, optional
+                 the inputs that changed, only these and the inputs whose
+                 rules depend on them (see TrafficModel.dependent_resources)
+                 are validated again, the outputs are kept as they are;
+                 all nodes are validated if not given
+        '''
         resource_nodes = self.get_input_files()
         #for input in resource_nodes:
             #input.update()
+        affected = None
+        if changed is not None:
+            affected = self.model.dependent_resources(
+                [node.resource_name for node in changed])
         self.is_valid = True
         inputs_parent_node = self.get_child(self.INPUT_NODES)
         inputs_parent_node.is_checked = False
         for input_node in resource_nodes:
             input_parent = input_node.get_parent_by_class(TreeNode)
             input_parent.is_checked = False
-            input_node.validate()
+        for input_node in resource_nodes:
+            input_parent = input_node.get_parent_by_class(TreeNode)
+            if affected is None or input_node.resource_name in affected:
+                input_node.validate(write_cache=False)
             if input_node.is_checked and not input_node.is_valid:
                 self.is_valid = False
                 # 'Eingaben' is not valid as well (for colouring purposes in gui)
@@ -504,8 +681,13 @@ class Scenario(TreeNode):
                 # direct parent (e.g. 'OV') is not valid too
                 input_parent.is_checked = True
                 input_parent.is_valid = False
-        for node in self.get_output_files():
-            node.validate()
+        if changed is None:
+            for node in self.get_output_files():
+                node.validate()
+        # write the states of all inputs at once
+        project = self.project
+        if project is not None and project.validation_cache is not None:
+            project.validation_cache.write()
         self.is_checked = True
 
     def get_default_scenario(self):
@@ -733,6 +915,26 @@ class Project(TreeNode):
         self.meta['Uhrzeit'] = time.strftime("%H:%M:%S")
         self.meta['Beschreibung'] = 'erstellt am ' + self.meta['Datum']
         self.meta['Autor'] = ''
+        self._validation_cache = None
+
+    @property
+    def validation_cache(self):
+        '''
+        the cache of the states of the checked resources of this project,
+        None if caching is disabled in the settings
+        '''
+        if not config.settings.get('validation_cache', True):
+            return None
+        if self.project_folder is None:
+            return None
+        use_hash = config.settings.get('validation_cache_hash', False)
+        # project may have been moved in the meantime
+        if (self._validation_cache is None or
+            self._validation_cache.project_folder != self.project_folder or
+            self._validation_cache.use_hash != use_hash):
+            self._validation_cache = ValidationCache(self.project_folder,
+                                                     use_hash=use_hash)
+        return self._validation_cache
 
     def set_meta(self, key, value):
         self.meta[key] = value
@@ -740,6 +942,27 @@ class Project(TreeNode):
     def remove_meta(self, key):
         self.meta.pop(key, None)
 
+    def update(self, callback=None):
+        '''
+        Override:
+        update the inputs of all scenarios at once in parallel,
+        the outputs afterwards
+
+        Parameter
+        ---------
+        callback: function, optional
+                  is called with messages of failed updates in the worker
+                  processes (updated in this process again)
+        '''
+        scenarios = self.find_all_by_class(Scenario)
+        input_nodes = []
+        for scen in scenarios:
+            input_nodes.extend(scen.get_input_files())
+        update_parallel(input_nodes, on_error=callback)
+        for scen in scenarios:
+            for node in scen.get_output_files():
+                node.update()
+
     def validate(self):
         '''
         validate the active project and it's scenarios
@@ -992,6 +1215,8 @@ class InputNode(ResourceNode):
                  parent=None):
         super(InputNode, self).__init__(name, parent=parent)
         self.subfolder = Scenario.INPUT_NODES
+        # key and fingerprint of the file at the time of the last update
+        self._cache_entry = None
 
     @property
     def resource(self):
@@ -1004,14 +1229,118 @@ class InputNode(ResourceNode):
         else:
             return None
 
+    @property
+    def validation_cache(self):
+        project = self.scenario.project
+        if project is None:
+            return None
+        return project.validation_cache
+
+    @property
+    def cache_key(self):
+        return ValidationCache.key(self.model.name, self.resource_name,
+                                   self.file_absolute)
+
+    def update(self):
+        '''
+        Override:
+        restore the state of the resource from the validation cache, if the
+        file didn't change since the last check, read the file else
+        '''
+        if not self.restore_cached_state():
+            super(InputNode, self).update()
+
+    def cached_state(self):
+        '''
+        look up the state of the resource in the validation cache, the
+        resource itself is not touched (the fingerprint may take long to
+        compute, if the content of the file is hashed), the fingerprint of
+        the file is remembered for storing the state after validation in
+        any case
+
+        Return
+        ------
+        state: dict, the cached state, None if the file changed since the
+               last check (or was never checked)
+        '''
+        self.remember_fingerprint(None)
+        cache = self.validation_cache
+        if cache is None or self.file_absolute is None:
+            return None
+        # fingerprint is taken before reading, a file changed while reading
+        # won't match the cache afterwards
+        fingerprint = cache.fingerprint(self.file_absolute)
+        self.remember_fingerprint(fingerprint)
+        return cache.lookup(self.cache_key, fingerprint)
+
+    def remember_fingerprint(self, fingerprint):
+        '''
+        remember the fingerprint of the file, the state of the resource is
+        stored with it in the validation cache after validation
+
+        Parameter
+        ---------
+        fingerprint: tuple, fingerprint of the file taken before the resource
+                     was updated (see ValidationCache.fingerprint), None if
+                     the state shall not be stored
+        '''
+        self._cache_entry = None
+        if (fingerprint is None or self.validation_cache is None or
+            self.file_absolute is None):
+            return
+        self._cache_entry = self.cache_key, fingerprint
+
+    def restore_cached_state(self):
+        '''
+        restore the state of the resource from the validation cache, if the
+        file didn't change since the last check (see cached_state)
+
+        Return
+        ------
+        success: bool, True if the state was restored from the cache
+        '''
+        state = self.cached_state()
+        if state is None:
+            return False
+        self.resource.restore(state)
+        return True
+
+    def validate(self, write_cache=True):
+        '''
+        Override:
+        store the validated state in the cache (only if the resource was
+        updated before, stored with the file it was updated with)
+
+        Parameter
+        ---------
+        write_cache: bool, optional
+                     write the cache to file immediately
+        '''
+        super(InputNode, self).validate()
+        cache = self.validation_cache
+        if cache is None or self._cache_entry is None:
+            return
+        key, fingerprint = self._cache_entry
+        cache.store(key, fingerprint, self.resource)
+        if write_cache:
+            cache.write()
+
 
 class OutputNode(ResourceNode):
+    # subfolder of the folder of the run the model writes its checkpoints into
+    CHECKPOINT_FOLDER = 'checkpoints'
+    # suffix of the results of the previous run, while the run is executed
+    PREVIOUS_SUFFIX = '.previous'
+
     def __init__(self, name=None, filename=None, parent=None, subfolder=None):
         super(OutputNode, self).__init__(name, parent=parent)
         self.subfolder = Scenario.OUTPUT_NODES
         self.resource = H5Resource(name, filename=filename,
                                    subfolder=name)
         self.options = {}
+        # summary of the resource usage of the last run
+        # (see telemetry.RunTelemetry)
+        self.telemetry = OrderedDict()
 
     def add_to_xml(self, parent):
         xml_element = super(OutputNode, self).add_to_xml(parent)
@@ -1021,6 +1350,10 @@ class OutputNode(ResourceNode):
                     xml_element, 'Option')
                 opt.text = ','.join((str(e) for e in opt_arr))
                 opt.attrib['name'] = opt_name
+        if self.telemetry:
+            telemetry = etree.SubElement(xml_element, 'Telemetry')
+            for key, value in self.telemetry.items():
+                telemetry.attrib[key] = str(value)
 
     def from_xml(self, element):
         super(OutputNode, self).from_xml(element)
@@ -1029,10 +1362,128 @@ class OutputNode(ResourceNode):
             text = opt.text
             if text:
                 self.options[opt.attrib['name']] = text.split(',')
+        telemetry = element.find('Telemetry')
+        if telemetry is not None:
+            self.telemetry = OrderedDict(telemetry.attrib.items())
 
     def get_results(self):
         return self.model.evaluate(self.file_absolute)
 
+    @property
+    def checkpoint_folder(self):
+        '''
+        the folder the model writes the checkpoints of the run into
+        '''
+        if self.file_absolute is None:
+            return None
+        return os.path.join(os.path.dirname(self.file_absolute),
+                            self.CHECKPOINT_FOLDER)
+
+    @property
+    def last_checkpoint(self):
+        '''
+        the most recent checkpoint of an interrupted run (incl. path), None if
+        the run can't be resumed
+        '''
+        folder = self.checkpoint_folder
+        if folder is None or not os.path.isdir(folder):
+            return None
+        checkpoints = [os.path.join(folder, f) for f in os.listdir(folder)]
+        checkpoints = [f for f in checkpoints if os.path.isfile(f)]
+        if not checkpoints:
+            return None
+        return max(checkpoints, key=os.path.getmtime)
+
+    def remove_checkpoints(self):
+        folder = self.checkpoint_folder
+        if folder is not None and os.path.isdir(folder):
+            h5_pool.close_folder(folder)
+            rmtree(folder, ignore_errors=True)
+
+    @property
+    def results_files(self):
+        '''
+        the results file and the summary of the results (incl. path)
+        '''
+        filename = self.file_absolute
+        if filename is None:
+            return []
+        return [filename, summary_file(filename)]
+
+    def keep_previous_results(self):
+        '''
+        put the results of the previous run aside (see PREVIOUS_SUFFIX), they
+        are restored if the next run fails (see restore_previous_results);
+        results already put aside by an interrupted run are kept, the
+        incomplete results of the interrupted run are removed then, results
+        put aside by a run that succeeded after all are stale and removed
+        instead (see previous_results_stale)
+        '''
+        if self.previous_results_stale:
+            self.remove_previous_results()
+        for filename in self.results_files:
+            if not os.path.exists(filename):
+                continue
+            h5_pool.close(filename)
+            previous = filename + self.PREVIOUS_SUFFIX
+            if os.path.exists(previous):
+                os.remove(filename)
+            else:
+                os.rename(filename, previous)
+
+    @property
+    def previous_results_stale(self):
+        '''
+        True, if the results put aside are older than the results of a
+        successful run (the summary of the results is only written after a
+        run succeeded, the summary of the previous results was put aside as
+        well), False if there are no results put aside or the current ones
+        are incomplete
+        '''
+        filename = self.file_absolute
+        if filename is None:
+            return False
+        previous = filename + self.PREVIOUS_SUFFIX
+        summary = summary_file(filename)
+        if not os.path.exists(previous) or not os.path.exists(summary):
+            return False
+        return os.path.getmtime(summary) >= os.path.getmtime(previous)
+
+    def restore_previous_results(self):
+        '''
+        replace the results by the ones put aside before the run
+        '''
+        for filename in self.results_files:
+            previous = filename + self.PREVIOUS_SUFFIX
+            if not os.path.exists(previous):
+                continue
+            if os.path.exists(filename):
+                h5_pool.close(filename)
+                os.remove(filename)
+            os.rename(previous, filename)
+
+    def remove_previous_results(self):
+        '''
+        remove the results put aside before the run (after the run
+        succeeded), results that can't be removed (e.g. opened by another
+        program) are left as they are, they are recognized as stale before
+        the next run (see previous_results_stale)
+
+        Return
+        ------
+        success: bool, False if results put aside could not be removed
+        '''
+        success = True
+        for filename in self.results_files:
+            previous = filename + self.PREVIOUS_SUFFIX
+            if not os.path.exists(previous):
+                continue
+            try:
+                os.remove(previous)
+            except OSError:
+                success = False
+        return success
+
     def validate(self):
         self.resource.validate(self.path)
         self.is_checked = True
@@ -85,6 +85,7 @@ class ResourceConfigXMLParser(object):
                 table_xml.attrib['maximum'] = ''
             else:
                 continue
+        h5_input.close()
 
     def write(self, filename):
         etree.ElementTree(self.root).write(str(filename), pretty_print=True)
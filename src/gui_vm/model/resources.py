@@ -10,7 +10,8 @@
 ## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
 ##------------------------------------------------------------------------------
 
-from backend import HDF5
+from backend import (HDF5, table_statistics, find_violations,
+                     find_duplicates, array_extrema, memmap_array)
 import os
 import numpy as np
 import time
@@ -19,6 +20,12 @@ import re
 from collections import OrderedDict
 from gui_vm.model.observable import Observable
 from gui_vm.model.rules import DtypeCompareRule, CompareRule, Rule
+from gui_vm.config.config import Config
+
+config = Config()
+
+# fields, whose rules can only be checked by reading the data of a node
+DATA_FIELDS = ['min_value', 'max_value']
 
 class Status(object):
     '''
@@ -193,6 +200,8 @@ class Resource(Observable):
 
     #dictionary for monitored attributes
     monitored = OrderedDict()
+    #attributes that are stored and restored with the state of the resource
+    STATE_ATTRIBUTES = []
 
     def __init__(self, name):
         super(Resource, self).__init__()
@@ -324,6 +333,8 @@ class Resource(Observable):
         validate the resource and set the status
         '''
         #self.update(path)
+        # referenced targets of the rules are resolved once per validation
+        Rule.new_pass()
         #only check rules if resource-file is found
         if self._status.code != Status.NOT_FOUND:
             self._validate(path)
@@ -365,6 +376,78 @@ class Resource(Observable):
                 child = self.children.pop(0)
                 child.remove_children()
 
+    def get_state(self):
+        '''
+        get the current state of the resource and its children (attributes
+        and status flags), the state can be pickled and restored via set_state
+
+        Return
+        ------
+        state: dict, nested dictionary with the attributes, flags and
+               the states of the children
+        '''
+        attributes = {}
+        for attr in self.STATE_ATTRIBUTES:
+            attributes[attr] = getattr(self, attr)
+        flags = {}
+        for flag in self._status.flags:
+            value = self._status.get(flag)
+            # child status is part of the state of the child
+            if not isinstance(value, Status):
+                flags[flag] = value
+        children = [(child.name, child.get_state())
+                    for child in self.children]
+        return {'attributes': attributes,
+                'flags': flags,
+                'children': children}
+
+    def set_state(self, state):
+        '''
+        restore a state of the resource and its children as returned by
+        get_state, observed attributes are set, so that their observers are
+        informed
+
+        Parameter
+        ---------
+        state: dict, the state to restore
+        '''
+        for attr, value in state['attributes'].items():
+            if attr in self._observed:
+                self.set(attr, value)
+            else:
+                setattr(self, attr, value)
+        for flag, value in state['flags'].items():
+            self._status.set(flag, *value)
+        for name, child_state in state['children']:
+            child = self.get_child(name)
+            if child is None:
+                child = self.new_child(name)
+                if child is None:
+                    continue
+                self.add_child(child)
+            child.set_state(child_state)
+        self._status.merge()
+
+    def restore(self, state):
+        '''
+        reset the resource and restore the given state (as returned by
+        get_state), replaces an update of the resource
+        '''
+        self.reset()
+        self.reset_status()
+        self.set_state(state)
+
+    def new_child(self, name):
+        '''
+        create a child with the given name, that is not defined but found
+        while restoring a state, override in subclasses with dynamic children
+
+        Return
+        ------
+        child: Resource, None if resource can't have dynamic children
+        '''
+        return None
+
 
 class ResourceFile(Resource):
     '''
@@ -386,6 +469,7 @@ class ResourceFile(Resource):
     '''
     monitored = OrderedDict([('filename', 'Datei'),
                              ('file_modified', 'Datum')])
+    STATE_ATTRIBUTES = ['file_modified']
 
     def __init__(self, name, subfolder='', filename=None):
         self.monitored.update(super(ResourceFile, self).monitored)
@@ -457,6 +541,9 @@ class H5Resource(ResourceFile):
         super(H5Resource, self).__init__(
             name, subfolder=subfolder,
             filename=filename)
+        # reports of the values violating the rules on the data,
+        # field names as keys, tuples (target value, report) as values
+        self.violations = {}
 
     def read(self, path):
         '''
@@ -495,10 +582,53 @@ class H5Resource(ResourceFile):
             self._status.set('filename', Status.NOT_FOUND, 'keine gueltige HDF5 Datei')
         for child in self.children:
             child.update(path, h5_in=h5_in)
-        #close file
-        del(h5_in)
+        #release file (stays open in the pool)
+        if h5_in is not None:
+            h5_in.close()
         self._status.merge()
 
+    def validate(self, path):
+        '''
+        Override:
+        the values violating the failed rules on the data (like minima or
+        maxima) are searched in the file, the numbers and the rows of these
+        values are added to the messages of the status
+        '''
+        super(H5Resource, self).validate(path)
+        n_rows = config.settings.get('validation_report_rows', 10)
+        if path is None or n_rows <= 0:
+            return
+        nodes = [child for child in self.children
+                 if isinstance(child, H5Node) and child.violation_checks()]
+        if not nodes:
+            return
+        # the file is only opened, if there are reports missing
+        h5_in = None
+        if any(node.violation_checks(missing=True) for node in nodes):
+            h5_in, success = self.read(path)
+            if not success:
+                return
+        for node in nodes:
+            node.report_violations(h5_in, n_rows=n_rows)
+        if h5_in is not None:
+            h5_in.close()
+        self._status.merge()
+
+    def failed_data_rules(self):
+        '''
+        Return
+        ------
+        list of the rules on the data of this resource (see DATA_FIELDS),
+        that are not met
+        '''
+        failed = []
+        for rule in self.rules:
+            if (rule.field_name in DATA_FIELDS and
+                rule.field_name in self._status.flags and
+                self._status.get_flag_code(rule.field_name) == Status.MISMATCH):
+                failed.append(rule)
+        return failed
+
 
 class H5Node(H5Resource):
     '''
@@ -510,6 +640,7 @@ class H5Node(H5Resource):
     '''
     monitored = OrderedDict([('table_path', 'Pfad'),
                              ('shape', 'Dimension')])
+    STATE_ATTRIBUTES = ['shape', 'violations']
 
     def __init__(self, table_path):
         #name = os.path.split(table_path)[1]
@@ -530,16 +661,35 @@ class H5Node(H5Resource):
             return None
         return table
 
-    def update(self, path, h5_in = None):
+    @property
+    def needs_data(self):
         '''
-        read and set the attributes of this node
+        Return
+        ------
+        boolean - True, if the data has to be read to check the rules of this
+                  resource or to set its observed attributes, False if the
+                  metadata of the node is sufficient
+        '''
+        for rule in self.rules:
+            if rule.field_name in DATA_FIELDS:
+                return True
+        return 'content' in self._observed
+
+    def update(self, path, h5_in = None, read_data=False):
+        '''
+        read and set the attributes of this node, the shape is taken from the
+        metadata of the node, the data itself is only read on demand
 
         Parameter
         ---------
         path: String, name of the working directory,
                       where the file is in (without subfolder)
+        read_data: bool, optional
+                   if True, the data of the node is read and returned,
+                   else the (unread) PyTables node is returned
         '''
         self.reset()
+        self.violations = {}
         if path is None:
             return None
         table = self.read(path, h5_in=h5_in)
@@ -548,11 +698,76 @@ class H5Node(H5Resource):
             self.set('shape', None)
             return None
         self._status.set('table_path', Status.FOUND)
-        if table._c_classid != 'UNIMPLEMENTED':
+        if read_data and table._c_classid != 'UNIMPLEMENTED':
             table = table.read()
         self.set('shape', table.shape)
         return table
 
+    def violation_checks(self, missing=False):
+        '''
+        get the failed rules on the data of this node
+
+        Parameter
+        ---------
+        missing: bool, optional
+                 if True, only the rules without a report of the violating
+                 values for the current target are returned
+
+        Return
+        ------
+        list of tuples (resource, rule, column), column is the name of the
+        column in the node the rule applies to (None for arrays)
+        '''
+        checks = [(self, rule, None) for rule in self.failed_data_rules()]
+        if missing:
+            checks = [(resource, rule, column)
+                      for resource, rule, column in checks
+                      if not _has_report(resource, rule)]
+        return checks
+
+    def report_violations(self, h5_in, n_rows=10):
+        '''
+        search the values violating the failed rules on the data in a single
+        chunkwise pass and add their number and the indices of the first rows
+        containing them to the status messages, reports found before for the
+        same targets are taken without reading the node again
+
+        Parameters
+        ----------
+        h5_in:  HDF5, opened hdf5 file containing this node (may be None, if
+                all reports are already there)
+        n_rows: int, optional
+                maximum number of reported row indices per rule
+        '''
+        missing = self.violation_checks(missing=True)
+        if missing and h5_in is not None:
+            node = self.read(None, h5_in=h5_in)
+            if node is not None and node._c_classid != 'UNIMPLEMENTED':
+                # arrays are checked on the mapped data if possible
+                if node.dtype.names is None:
+                    mapped = memmap_array(node._v_file.filename,
+                                          node._v_pathname)
+                    if mapped is not None:
+                        node = mapped
+                names = node.dtype.names or []
+                missing = [(resource, rule, column)
+                           for resource, rule, column in missing
+                           if column is None or column in names]
+                reports = find_violations(
+                    node, [(column, rule.mask)
+                           for resource, rule, column in missing],
+                    n_rows=n_rows)
+                for (resource, rule, column), report in zip(missing, reports):
+                    resource.violations[rule.field_name] = (
+                        rule.pass_target_value, report)
+        for resource, rule, column in self.violation_checks():
+            if not _has_report(resource, rule):
+                continue
+            report = resource.violations[rule.field_name][1]
+            message = resource._status.get_flag_message(rule.field_name)
+            resource._status.set(rule.field_name, Status.MISMATCH,
+                                 violation_message(message, report))
+
     @property
     def status(self):
         '''
@@ -588,6 +803,9 @@ class H5Table(H5Node):
         self.monitored.update(super(H5Table, self).monitored)
         self.monitored['shape'] = 'Reihen'
         self._required_columns = []
+        # names of the referenced fields, the placeholder columns (and so the
+        # dynamic columns cloned from them) depend on
+        self.placeholder_fields = []
         super(H5Table, self).__init__(table_path)
 
     def __repr__(self):
@@ -611,6 +829,7 @@ class H5Table(H5Node):
                 child.reset()
                 tmp.append(child)
         self.children = tmp
+        # the table is not read at once, the columns are analysed chunkwise
         table = super(H5Table, self).update(path, h5_in=h5_in)
         if table is None:
             return
@@ -621,8 +840,44 @@ class H5Table(H5Node):
                 col = H5TableColumn(existing_col)
                 self.add_child(col)
 
+        # only the columns needing their data are read
+        needed = [c.name for c in self.children
+                  if c.name in table.dtype.names and c.needs_data]
+        statistics = table_statistics(table, needed)
+
         for child in self.children:
-            child.update(table)
+            child.update(table, statistics=statistics.get(child.name))
+
+    def violation_checks(self, missing=False):
+        '''
+        Override:
+        the failed rules on the data of the columns found in the table
+        '''
+        checks = []
+        for column in self.children:
+            if column.dtype is None or column.dtype.char == 'S':
+                continue
+            for rule in column.failed_data_rules():
+                if missing and _has_report(column, rule):
+                    continue
+                checks.append((column, rule, column.name))
+        return checks
+
+    def set_state(self, state):
+        '''
+        Override:
+        remove the columns, that are not required, before restoring the state
+        (the ones found in the file are part of the state)
+        '''
+        self.children = [c for c in self.children if c.is_required]
+        super(H5Table, self).set_state(state)
+
+    def new_child(self, name):
+        '''
+        Override:
+        columns, that are not required, are created while restoring the state
+        '''
+        return H5TableColumn(name)
 
     @property
     def column_names(self):
@@ -671,6 +926,9 @@ class H5Table(H5Node):
             if old_dynamic:
                 dynamic_column.dtype = old_dynamic.dtype
                 dynamic_column.content = old_dynamic.content
+                dynamic_column.min_value = old_dynamic.min_value
+                dynamic_column.max_value = old_dynamic.max_value
+                dynamic_column.n_null = old_dynamic.n_null
                 dynamic_column._status.set('dtype', Status.FOUND)
             else:
                 dynamic_column._status.set('dtype', Status.NOT_FOUND)
@@ -724,6 +982,9 @@ class H5Table(H5Node):
                                       1:col_name.find(Rule.replace_indicators[1])]
                 # on change of the referenced field the dynamic cols will be be
                 # cloned from the placeholder column
+                self.placeholder_fields.append(field_name)
+                for rule in column.rules:
+                    self.placeholder_fields.extend(rule.referenced_fields)
                 reference.bind(field_name,
                                lambda value: self.multiply_placeholder(column,
                                                                        field_name,
@@ -758,6 +1019,9 @@ class H5TableColumn(H5Resource):
                              ('is_primary_key', 'Primaerschluessel'),
                              ('max_value', 'Maximum'),
                              ('min_value', 'Minimum')])
+    # the number of null values (n_null) is only kept internally
+    STATE_ATTRIBUTES = ['dtype', 'max_value', 'min_value', 'n_null',
+                        'content', 'violations']
 
     def __init__(self, name, exp_dtype=None,
                    exp_minimum=None, exp_maximum=None,
@@ -767,6 +1031,7 @@ class H5TableColumn(H5Resource):
 
         self.max_value = None
         self.min_value = None
+        self.n_null = None
         self.dtype = None
         self.content = None
         self.is_required = is_required
@@ -774,13 +1039,37 @@ class H5TableColumn(H5Resource):
         self.is_primary_key = is_primary_key
         self.referenced_name = None
 
-    def update(self, table):
+    @property
+    def needs_data(self):
+        '''
+        Return
+        ------
+        boolean - True, if the content of the column has to be read to check
+                  the rules or to set the observed content, False if the dtype
+                  is sufficient
+        '''
+        if self.is_primary_key or 'content' in self._observed:
+            return True
+        for rule in self.rules:
+            if rule.field_name in DATA_FIELDS:
+                return True
+        return False
+
+    def update(self, table, statistics=None):
         '''
         look for the column in the given table, the success will be shown
         by the dtype flag
         check for uniqueness of primary keys
-        '''
 
+        Parameter
+        ---------
+        table:      tables.Table, the table containing this column
+        statistics: dict, optional
+                    precalculated statistics of the column
+                    (see backend.table_statistics), calculated if not given
+                    and the data of the column is needed
+        '''
+        self.violations = {}
         if table is None or self.name not in table.dtype.names:
             self.reset()
             message = 'Spalte fehlt'
@@ -789,28 +1078,45 @@ class H5TableColumn(H5Resource):
             self._status.set('dtype', Status.NOT_FOUND, message)
             self.max_value = None
             self.min_value = None
+            self.n_null = None
             self.dtype = None
             self.content = None
         else:
+            if statistics is None and self.needs_data:
+                statistics = table_statistics(table, [self.name])[self.name]
             self.dtype = table.dtype[self.name]
             if self.is_required:
                 self._status.set('dtype', Status.FOUND)
             else:
                 self._status.set('dtype', Status.NOT_NEEDED)
-            content = table[self.name]
-            # für Nicht-String-Variablen checke die Min- und Max-Grenzen
-            if self.dtype.char != 'S':
-                self.max_value = content.max()
-                self.min_value = content.min()
-            # für String-Variablen: Konvertiere in UTF 8
-            else:
-                content = np.char.decode(content, encoding='CP1252')
+            if statistics is None:
+                self.max_value = None
+                self.min_value = None
+                self.n_null = None
+                return
+            # Min- und Max-Grenzen (nur für Nicht-String-Variablen gesetzt)
+            self.max_value = statistics['max']
+            self.min_value = statistics['min']
+            self.n_null = statistics['n_null']
             #check if all values are unique if primary key
-            if self.is_primary_key and np.unique(content).size != content.size:
-
-                self._status.set('is_primary_key', Status.MISMATCH, 'Werte nicht eindeutig')
+            #(the raw values are compared chunkwise, no need to decode them)
+            if self.is_primary_key:
+                count, duplicates = find_duplicates(table, self.name)
+                if count > 0:
+                    if self.dtype.char == 'S':
+                        # messages are utf-8 encoded byte strings
+                        duplicates = [d.decode('CP1252').encode('utf-8')
+                                      for d in duplicates]
+                    message = 'Werte nicht eindeutig ({} doppelt, z.B. {})'.format(
+                        count, ', '.join(str(d) for d in duplicates))
+                    self._status.set('is_primary_key', Status.MISMATCH, message)
             #if content of column is observed, set it
+            #(the full column is only read then)
             if 'content' in self._observed:
+                content = table.col(self.name)
+                # für String-Variablen: Konvertiere in UTF 8
+                if self.dtype.char == 'S':
+                    content = np.char.decode(content, encoding='CP1252')
                 self.set('content', list(content))
 
 
@@ -878,6 +1184,7 @@ class H5Array(H5Node):
     '''
     monitored = OrderedDict([('min_value', 'Minimalwert'),
                              ('max_value', 'Maximalwert')])
+    STATE_ATTRIBUTES = H5Node.STATE_ATTRIBUTES + ['min_value', 'max_value']
 
     def __init__(self, table_path):
         #set dict for monitored attributes, then call super constructor
@@ -895,17 +1202,18 @@ class H5Array(H5Node):
 
     def update(self, path, h5_in=None):
         '''
-        add the minima/maxima
+        add the minima/maxima (only if needed by the rules, the array is
+        not read otherwise)
         '''
         table = super(H5Array, self).update(path, h5_in=h5_in)
-        if getattr(table, '_c_classid', '') == 'UNIMPLEMENTED':
+        self.max_value = None
+        self.min_value = None
+        if (table is None or
+            getattr(table, '_c_classid', '') == 'UNIMPLEMENTED'):
             return
-        if table is not None and table.dtype.char != 'S':
-            self.max_value = table.max()
-            self.min_value = table.min()
-        else:
-            self.max_value = None
-            self.min_value = None
+        if self.needs_data and table.dtype.char != 'S':
+            # mapped from file or read chunkwise, no copy of the whole array
+            self.min_value, self.max_value = array_extrema(table)
 
     def from_xml(self, element, reference=None):
 
@@ -941,6 +1249,32 @@ class H5Array(H5Node):
                                    success_msg='Dimension überprüft')
             self.add_rule(dim_rule)
 
+def _has_report(resource, rule):
+    '''
+    check if the resource has a report of the values violating the rule for
+    its current target
+    '''
+    if rule.field_name not in resource.violations:
+        return False
+    target, report = resource.violations[rule.field_name]
+    return target == rule.pass_target_value
+
+
+def violation_message(message, report):
+    '''
+    add the number of the invalid values and the first rows containing them
+    (see backend.find_violations) to the given message
+    '''
+    if report['count'] == 0:
+        return message
+    rows = ', '.join(str(row) for row in report['rows'])
+    if report['count'] > len(report['rows']):
+        rows += ', ...'
+    return '{} ({} von {} Werten = {:.2%}, Zeilen {})'.format(
+        message, report['count'], report['n_values'], report['fraction'],
+        rows)
+
+
 def is_number(s):
     '''
     check if String represents a number
@@ -12,6 +12,17 @@
 
 import operator as op
 import copy
+import numpy as np
+
+# messages of a check, if the function of the rule doesn't return one
+DEFAULT_SUCCESS_MSG = 'überprüft'
+DEFAULT_ERROR_MSG = 'Fehler'
+
+# kinds of the precompiled entries of a target
+WILDCARD = 0
+NUMBER = 1
+REFERENCE = 2
+STRING = 3
 
 class Rule(object):
     '''
@@ -21,6 +32,9 @@ class Rule(object):
     that should be taken from the referenced object have
     to appear as strings in the target_value)
 
+    the target is parsed once when the rule is created, references are
+    resolved once per validation pass (see Rule.new_pass)
+
     Parameter
     ---------
     field_name: String,
@@ -39,6 +53,9 @@ class Rule(object):
     replace_indicators = ['{', '}']
     # wildcards will be ignored while checking the rule
     wildcards = ['*', '']
+    # counter of the validation passes, referenced values don't change
+    # during a pass
+    generation = 0
 
     def __init__(self, field_name, target_value,
                  function, reference=None):
@@ -47,66 +64,96 @@ class Rule(object):
         self.field_name = field_name
         #cast represented number in target values to float or int
         if isinstance(target_value, str) and is_number(target_value):
-            target_value = float(target_value)
-            if target_value % 1 == 0:
-                target_value = int(target_value)
+            target_value = to_number(target_value)
         self._target = target_value
+        self._compiled = self._compile(target_value)
+        self._resolved = None
+        self._resolved_generation = None
 
-    @property
-    def target_value(self):
+    @classmethod
+    def new_pass(cls):
         '''
-        return the targeted values
+        start a new validation pass, referenced values are resolved again
+        '''
+        Rule.generation += 1
 
-        if referenced: strings in target representing a referenced field name
-        will be replaced by the actual values of the field
+    def _compile(self, target):
+        '''
+        parse the target into a list of tuples (kind, value), numbers are
+        casted and the names of referenced fields are extracted
         '''
-        # copy needed (otherwise side effect is caused)
-        target = copy.copy(self._target)
-        ref_target = []
-        former_type = target.__class__
-        cast = False
-        # look if value is iterable (like lists, arrays, tuples)
         if not hasattr(target, '__iter__'):
             target = [target]
-        # iterate over the values
-        for i, val in enumerate(target):
-            #ignore wildcards
-            if val not in self.wildcards:
-                # strings may be references to a field
-                # (if there is a reference at all)
-                if self.reference is not None and not is_number(val):
-                    # find fieldname in between indicating brackets
-                    val = val[val.find(self.replace_indicators[0]) +
-                              1:val.find(self.replace_indicators[1])]
-
-                    # look if the referenced object has a field with this name
-                    # and get the referenced value
-                    if hasattr(self.reference, val):
-                        field = getattr(self.reference, val)
-                        val = field
+        compiled = []
+        for val in target:
+            if val in self.wildcards:
+                compiled.append((WILDCARD, val))
+            elif is_number(val):
+                compiled.append((NUMBER, to_number(val)))
+            elif self.reference is not None:
+                # find fieldname in between indicating brackets
+                val = val[val.find(self.replace_indicators[0]) +
+                          1:val.find(self.replace_indicators[1])]
+                compiled.append((REFERENCE, val))
+            else:
+                compiled.append((STRING, val))
+        return compiled
+
+    def _resolve(self):
+        '''
+        resolve the precompiled target with the current values of the
+        referenced fields
+        '''
+        ref_target = []
+        for kind, val in self._compiled:
+            if kind == REFERENCE:
+                # look if the referenced object has a field with this name
+                # and get the referenced value
+                if hasattr(self.reference, val):
+                    val = getattr(self.reference, val)
                 # cast to number if string wraps a number
                 if is_number(val):
-                    val = float(val)
-                    if val % 1 == 0:
-                        val = int(val)
+                    val = to_number(val)
             ref_target.append(val)
         # cast back if list is unnecessary
         if len(ref_target) == 1:
             ref_target = ref_target[0]
         return ref_target
 
+    @property
+    def target_value(self):
+        '''
+        return the targeted values
+
+        if referenced: strings in target representing a referenced field name
+        will be replaced by the actual values of the field
+        '''
+        return self._resolve()
+
+    @property
+    def pass_target_value(self):
+        '''
+        the targeted values, resolved only once per validation pass
+        '''
+        if self._resolved_generation != Rule.generation:
+            self._resolved = self._resolve()
+            self._resolved_generation = Rule.generation
+        return self._resolved
+
+    @property
+    def referenced_fields(self):
+        '''
+        the names of the fields of the referenced object the target depends on
+        '''
+        return [val for kind, val in self._compiled if kind == REFERENCE]
+
     @property
     def target_pretty_names(self):
         if not self.reference or not hasattr(self.reference, 'monitored'):
             return None
-        target = copy.copy(self._target)
-        if not hasattr(target, '__iter__'):
-            target = [target]
         pretty_names = []
-        for val in target:
-            if not is_number(val):
-                val = val[val.find(self.replace_indicators[0]) +
-                          1:val.find(self.replace_indicators[1])]
+        for kind, val in self._compiled:
+            if kind == REFERENCE:
                 name = self.reference.monitored[val]
                 pretty_names.append(name)
         if len(pretty_names) > 0:
@@ -134,17 +181,16 @@ class Rule(object):
             raise Exception('The object {} does not own a field {}'
                             .format(obj, self.field_name))
         attr_value = getattr(obj, self.field_name)
-        #wrap all values with a list (if they are not already)
-        target_value = self.target_value
+        target_value = self.pass_target_value
         result = self.function(attr_value, target_value)
         #check if there is a message sent with, if not, append default messages
         if isinstance(result, tuple):
             message = result[1]
             result = result[0]
         elif result:
-            message = DEFAULT_MESSAGES[CHECKED_AND_VALID]
+            message = DEFAULT_SUCCESS_MSG
         else:
-            message = DEFAULT_MESSAGES[MISMATCH]
+            message = DEFAULT_ERROR_MSG
 
         if not result:
             pretty_names = self.target_pretty_names
@@ -166,6 +212,24 @@ def is_number(s):
         return False
 
 
+def to_number(s):
+    '''
+    cast a String representing a number to int (if integral) or float,
+    integers are casted exactly (beyond the precision of floats)
+    '''
+    if isinstance(s, (int, long, np.integer)):
+        return int(s)
+    if isinstance(s, basestring):
+        try:
+            return int(s)
+        except ValueError:
+            pass
+    val = float(s)
+    if val % 1 == 0:
+        val = int(val)
+    return val
+
+
 def is_in_list(self, left_list, right_list):
     '''
     check if all elements of left list are in right list
@@ -217,9 +281,55 @@ class CompareRule(Rule):
         self.error_msg = error_msg
         self.operator = operator
 
+    def _as_numbers(self, values):
+        '''
+        convert the values to an array of numbers, integers are kept (and
+        compared exactly) if all of the values are integral, floats else
+
+        Return
+        ------
+        numbers:   np.ndarray (int64, objects for integers exceeding 64 bits
+                   or float64), None if there are values not representing
+                   numbers
+        wildcards: np.ndarray of bools, True where the values are wildcards
+        '''
+        numbers = [0] * len(values)
+        wildcards = np.zeros(len(values), dtype=bool)
+        integral = True
+        for i, v in enumerate(values):
+            if isinstance(v, basestring):
+                if v in self.wildcards:
+                    wildcards[i] = True
+                    continue
+                if not is_number(v):
+                    return None, wildcards
+                try:
+                    v = int(v)
+                except ValueError:
+                    v = float(v)
+            elif v is None or isinstance(v, (bool, np.bool_)):
+                return None, wildcards
+            elif isinstance(v, (int, long, np.integer)):
+                v = int(v)
+            else:
+                try:
+                    v = float(v)
+                except (TypeError, ValueError):
+                    return None, wildcards
+            if isinstance(v, float):
+                integral = False
+            numbers[i] = v
+        if not integral:
+            return np.array(numbers, dtype=np.float64), wildcards
+        try:
+            return np.array(numbers, dtype=np.int64), wildcards
+        except OverflowError:
+            return np.array(numbers, dtype=object), wildcards
+
     def compare(self, left, right):
         '''
-        compare two values (or lists of values elementwise)
+        compare two values (or lists of values elementwise), numbers are
+        compared vectorised
         '''
         operator = self.mapping[self.operator]
         #make both values iterable
@@ -228,31 +338,58 @@ class CompareRule(Rule):
         if not hasattr(right, '__iter__'):
             right = [right]
 
-        if self.error_msg:
-            error_msg = self.error_msg + ' - erwartet: {} {}'.format(self.operator, right)
+        error_msg = self.error_msg or DEFAULT_ERROR_MSG
+        error_msg += ' - erwartet: {} {}'.format(self.operator, right)
 
         #elementwise compare -> same number of elements needed
         if len(right) != len(left):
             return False, error_msg
-        #compare left and right elementwise
-        for i in xrange(len(left)):
-            l = left[i]
-            r = right[i]
+
+        left_numbers, left_wildcards = self._as_numbers(left)
+        right_numbers, right_wildcards = self._as_numbers(right)
+        if left_numbers is not None and right_numbers is not None:
             #ignore wildcards
-            if (left[i] in self.wildcards) or (right[i] in self.wildcards):
-                continue
-            #compare the value with the field of the given object
-            if not operator(left[i], right[i]):
-                #check again if value is number in string
-                if isinstance(l, str) and is_number(l):
-                    l = float(l)
-                if isinstance(r, str) and is_number(r):
-                    r = float(r)
+            mask = ~(left_wildcards | right_wildcards)
+            if not operator(left_numbers[mask], right_numbers[mask]).all():
+                return False, error_msg
+        else:
+            #compare left and right elementwise (e.g. dtypes or strings)
+            for l, r in zip(left, right):
+                #ignore wildcards
+                if (l in self.wildcards) or (r in self.wildcards):
+                    continue
                 if not operator(l, r):
-                    return False, error_msg
-        if self.success_msg:
-            return True, self.success_msg
-        return True
+                    #check again if value is number in string
+                    if isinstance(l, str) and is_number(l):
+                        l = float(l)
+                    if isinstance(r, str) and is_number(r):
+                        r = float(r)
+                    if not operator(l, r):
+                        return False, error_msg
+        return True, self.success_msg or DEFAULT_SUCCESS_MSG
+
+    def mask(self, values):
+        '''
+        apply the rule to every single value (vectorised), e.g. to find the
+        values violating a minimum, the target has to be a single value
+
+        Parameter
+        ---------
+        values: np.ndarray, the values to check
+
+        Return
+        ------
+        mask: np.ndarray of bools, True where the values meet the rule
+        '''
+        operator = self.mapping[self.operator]
+        target = self.pass_target_value
+        values = np.asarray(values)
+        if (hasattr(target, '__iter__') or target in self.wildcards or
+            not is_number(target) or values.dtype.char == 'S'):
+            return np.ones(values.shape, dtype=bool)
+        # NaNs don't meet any target
+        with np.errstate(invalid='ignore'):
+            return operator(values, to_number(target))
 
 class DtypeCompareRule(CompareRule):
     wildcards = []
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        run_log.py
+## Purpose:     streams the complete output of a traffic model run into a
+##              compressed log file in the folder of the run, so views only
+##              have to keep the most recent lines
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import gzip
+import time
+import threading
+
+
+class RunLog(object):
+    '''
+    gzip compressed log file of a run, a new file is written for each run
+    (named after the time the run was started), may be written to from
+    multiple threads
+
+    Parameters
+    ----------
+    folder: String, the folder of the run the log file is written into
+            (created if not existing)
+    '''
+    PREFIX = 'log_'
+    EXTENSION = '.txt.gz'
+
+    def __init__(self, folder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.filename = os.path.join(folder, '{}{}{}'.format(
+            self.PREFIX, time.strftime('%Y%m%d_%H%M%S'), self.EXTENSION))
+        self._file = gzip.open(self.filename, 'wb')
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        '''
+        append the text as a line to the log (ignored after closing)
+        '''
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        with self._lock:
+            if self._file is not None:
+                self._file.write(str(text) + '\n')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
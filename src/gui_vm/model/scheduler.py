@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        scheduler.py
+## Purpose:     queue of traffic model runs, executes multiple runs of
+##              different scenarios at the same time depending on the
+##              available slots and memory, keeps a log to resume the queue
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import json
+import time
+import threading
+import traceback
+from gui_vm.config.config import Config
+from gui_vm.model.backend import get_free_memory
+from gui_vm.model.project_tree import Scenario
+
+config = Config()
+
+
+class RunJob(object):
+    '''
+    a run of a scenario in the queue of the scheduler
+
+    Parameters
+    ----------
+    scenario_name: String, the name of the scenario
+    run_name:      String, optional
+                   the name of the run (defaults to the primary run)
+    options:       dict, optional
+                   the options the run will be executed with
+    '''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    # killed, because there was no output for too long (see outcome.py)
+    HUNG = 'hung'
+
+    def __init__(self, scenario_name, run_name=Scenario.PRIMARY_RUN,
+                 options=None):
+        self.scenario_name = scenario_name
+        self.run_name = run_name
+        self.options = options
+        self.status = self.QUEUED
+        self.message = ''
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return '{} / {} ({})'.format(self.scenario_name, self.run_name,
+                                     self.status)
+
+    @property
+    def is_primary(self):
+        return self.run_name == Scenario.PRIMARY_RUN
+
+    @property
+    def is_done(self):
+        return self.status in [self.SUCCEEDED, self.FAILED, self.HUNG]
+
+    def to_dict(self):
+        return {'scenario': self.scenario_name,
+                'run': self.run_name,
+                'options': self.options,
+                'status': self.status,
+                'message': self.message,
+                'started': self.started,
+                'finished': self.finished}
+
+    @classmethod
+    def from_dict(cls, d):
+        job = cls(d['scenario'], run_name=d['run'], options=d['options'])
+        job.status = d['status']
+        job.message = d['message']
+        job.started = d['started']
+        job.finished = d['finished']
+        return job
+
+
+class RunScheduler(object):
+    '''
+    executes the queued runs, runs of different scenarios are executed at
+    the same time, if there are free slots and enough free memory,
+    runs of the same scenario are executed one after another, special runs
+    wait for the primary run of their scenario (and fail, if it failed)
+
+    Parameters
+    ----------
+    project:         Project, the project containing the scenarios
+    run_function:    function, executes a job and waits until it is finished,
+                     is called with the project, the name of the scenario,
+                     the run_name and the options as keyword arguments,
+                     returns a tuple (status, message), status is the
+                     outcome of the run (succeeded, failed or hung) or a
+                     bool (succeeded or not); the jobs are executed in
+                     threads, the function has to hold backend.h5_lock
+                     while working with HDF5 files (e.g. validating), only
+                     the waiting for the model may be concurrent
+    slots:           int, optional
+                     maximum number of runs at the same time
+                     (defaults to the settings)
+    min_free_memory: int, optional
+                     free memory in MB needed to start another run
+                     (defaults to the settings)
+    callback:        function, optional
+                     is called with a message, each time the status of a
+                     job changes
+    '''
+    LOG_FILENAME = 'run_log.json'
+    # seconds to wait after a run was started before starting the next one
+    # (the started model needs time to allocate its memory)
+    START_DELAY = 10
+    # seconds between checks of the queue
+    POLL_INTERVAL = 5
+
+    def __init__(self, project, run_function, slots=None,
+                 min_free_memory=None, callback=None):
+        self.project = project
+        self.run_function = run_function
+        if slots is None:
+            slots = config.settings.get('run_slots', 2)
+        self.slots = max(1, int(slots))
+        if min_free_memory is None:
+            min_free_memory = config.settings.get('run_min_free_memory', 0)
+        self.min_free_memory = int(min_free_memory) * 1024 * 1024
+        self.callback = callback
+        self.jobs = []
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._last_start = None
+
+    @property
+    def log_file(self):
+        return os.path.join(self.project.project_folder, self.LOG_FILENAME)
+
+    @staticmethod
+    def _find_queued(jobs, scenario_name, run_name):
+        '''
+        the job of the given jobs queued for the given run, None if there is
+        none
+        '''
+        for job in jobs:
+            if (job.status == RunJob.QUEUED and
+                job.scenario_name == scenario_name and
+                job.run_name == run_name):
+                return job
+        return None
+
+    def add(self, scenario_name, run_name=Scenario.PRIMARY_RUN,
+            options=None):
+        '''
+        add a run to the queue, a run already queued is not queued twice
+
+        Return
+        ------
+        job: RunJob, the queued job (resp. the one already queued)
+        '''
+        with self._lock:
+            job = self._find_queued(self.jobs, scenario_name, run_name)
+            if job is not None:
+                return job
+            job = RunJob(scenario_name, run_name=run_name, options=options)
+            self.jobs.append(job)
+            self.write_log()
+        return job
+
+    def resume(self):
+        '''
+        load the jobs from the log of a previous (interrupted) queue, jobs
+        that were not finished are queued again (unless their run is already
+        queued), the finished ones are dropped
+
+        Return
+        ------
+        n_queued: int, number of jobs queued again
+        '''
+        if not os.path.exists(self.log_file):
+            return 0
+        with open(self.log_file, 'r') as f:
+            jobs = [RunJob.from_dict(d) for d in json.load(f)]
+        with self._lock:
+            resumed = []
+            for job in jobs:
+                if job.is_done:
+                    continue
+                if (self._find_queued(resumed + self.jobs, job.scenario_name,
+                                      job.run_name) is not None):
+                    continue
+                job.status = RunJob.QUEUED
+                job.message = ''
+                job.started = None
+                resumed.append(job)
+            self.jobs = resumed + self.jobs
+            self.write_log()
+        return len(resumed)
+
+    def write_log(self):
+        with self._lock:
+            tmp_filename = self.log_file + '.tmp'
+            with open(tmp_filename, 'w') as f:
+                json.dump([job.to_dict() for job in self.jobs], f, indent=2)
+            if os.path.exists(self.log_file):
+                os.remove(self.log_file)
+            os.rename(tmp_filename, self.log_file)
+
+    def _set_status(self, job, status, message=''):
+        with self._lock:
+            job.status = status
+            job.message = message
+            if status == RunJob.RUNNING:
+                job.started = time.strftime('%d.%m.%Y %H:%M:%S')
+            elif job.is_done:
+                job.finished = time.strftime('%d.%m.%Y %H:%M:%S')
+            self.write_log()
+            self._changed.notify_all()
+        if self.callback:
+            self.callback('{} / {}: {} {}'.format(
+                job.scenario_name, job.run_name, status, message))
+
+    def _is_ready(self, job, running):
+        '''
+        check if the job can be started now, fails special runs whose primary
+        run failed
+
+        Return
+        ------
+        bool, True if the job can be started
+        '''
+        for other in running:
+            if other.scenario_name == job.scenario_name:
+                return False
+        if job.is_primary:
+            return True
+        for other in self.jobs:
+            if other is job:
+                break
+            if other.scenario_name != job.scenario_name or not other.is_primary:
+                continue
+            if other.status in [RunJob.FAILED, RunJob.HUNG]:
+                self._set_status(job, RunJob.FAILED,
+                                 'Gesamtlauf fehlgeschlagen')
+                return False
+            if not other.is_done:
+                return False
+        return True
+
+    def _has_resources(self):
+        '''
+        check if there is enough free memory to start another run (and the
+        last run was started long enough ago)
+        '''
+        if (self._last_start is not None and
+            time.time() - self._last_start < self.START_DELAY):
+            return False
+        if self.min_free_memory <= 0:
+            return True
+        free_memory = get_free_memory()
+        if free_memory is None:
+            return True
+        return free_memory >= self.min_free_memory
+
+    def _execute(self, job):
+        try:
+            status, message = self.run_function(
+                project=self.project, scenario_name=job.scenario_name,
+                run_name=job.run_name, options=job.options)
+        except Exception:
+            status, message = False, traceback.format_exc()
+        if status is True:
+            status = RunJob.SUCCEEDED
+        elif status not in [RunJob.SUCCEEDED, RunJob.HUNG]:
+            status = RunJob.FAILED
+        self._set_status(job, status, message)
+
+    def run(self):
+        '''
+        execute all queued jobs, blocks until all of them are finished
+
+        Return
+        ------
+        success: bool, True if all jobs succeeded
+        '''
+        with self._lock:
+            while True:
+                queued = [j for j in self.jobs if j.status == RunJob.QUEUED]
+                running = [j for j in self.jobs if j.status == RunJob.RUNNING]
+                if not queued and not running:
+                    break
+                for job in queued:
+                    if len(running) >= self.slots:
+                        break
+                    if not self._is_ready(job, running):
+                        continue
+                    if not self._has_resources():
+                        break
+                    self._set_status(job, RunJob.RUNNING)
+                    running.append(job)
+                    self._last_start = time.time()
+                    thread = threading.Thread(target=self._execute,
+                                              args=(job, ))
+                    # interrupted runs are queued again on resume
+                    thread.daemon = True
+                    thread.start()
+                # woken up, when a job finished
+                self._changed.wait(self.POLL_INTERVAL)
+        return all(job.status == RunJob.SUCCEEDED for job in self.jobs)
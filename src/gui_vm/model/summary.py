@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        summary.py
+## Purpose:     aggregates of the demand matrices of runs (totals, trips per
+##              zone, histograms by travel time), computed in one pass over
+##              the matrices and stored in a small HDF5 file next to the
+##              results, so they don't have to be read from the results again
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import tables
+import numpy as np
+from collections import OrderedDict
+from gui_vm.model.backend import BUFFER_SIZE, iter_blocks, h5_pool
+
+# name of the group in the summary file the aggregates are stored in
+SUMMARY_GROUP = 'summary'
+# suffix of the summary file (appended to the name of the results file)
+SUMMARY_SUFFIX = '_summary.h5'
+
+# the aggregates that can be computed:
+# totals - sum of the trips (per mode)
+# productions - sum of the trips per origin zone (per mode)
+# attractions - sum of the trips per destination zone (per mode)
+# travel_time_histogram - sum of the trips per class of travel times
+#                         (per mode, needs the travel times)
+AGGREGATES = ['totals', 'productions', 'attractions',
+              'travel_time_histogram']
+# lower bounds of the classes of travel times in minutes, the last class
+# contains all trips with travel times greater than its bound
+TIME_BINS = [0, 5, 10, 15, 20, 30, 45, 60, 90, 120]
+
+
+def summary_file(results_file):
+    '''
+    the summary file belonging to the given results file
+    '''
+    return os.path.splitext(results_file)[0] + SUMMARY_SUFFIX
+
+
+def parse_list(value, default, cast=str):
+    '''
+    parse a comma separated list (as stored in the settings)
+    '''
+    if value is None or value == '':
+        return list(default)
+    if isinstance(value, basestring):
+        value = [v.strip() for v in value.split(',') if v.strip()]
+    return [cast(v) for v in value]
+
+
+def summarize_matrix(demand, travel_times=None, aggregates=AGGREGATES,
+                     bins=TIME_BINS, buffer_size=BUFFER_SIZE):
+    '''
+    compute the aggregates of a demand matrix in one pass over its blocks
+    (sums are accumulated in float64), the last two axes of the matrix are
+    origins and destinations, leading axes (e.g. modes) are kept
+
+    Parameters
+    ----------
+    demand: tables.Array or np.ndarray,
+            the demand matrix (zones x zones or e.g. modes x zones x zones)
+    travel_times: tables.Array or np.ndarray, optional
+                  the travel times in minutes, same shape as the demand,
+                  the histogram by travel times is skipped if not given
+    aggregates: list of Strings, optional
+                the names of the aggregates to compute (see AGGREGATES)
+    bins: list of numbers, optional
+          lower bounds of the classes of travel times
+    buffer_size: int, optional
+                 the approximate number of bytes to read at once
+
+    Return
+    ------
+    results: OrderedDict, names of the aggregates as keys and np.ndarrays
+             as values (the histogram comes with its bins)
+    '''
+    shape = demand.shape
+    if len(shape) < 2:
+        raise ValueError('Matrix mit mindestens 2 Dimensionen erwartet, '
+                         'Dimension: {}'.format(shape))
+    if travel_times is not None and travel_times.shape != shape:
+        travel_times = None
+    lead_shape = shape[:-2]
+    n_zones_from, n_zones_to = shape[-2:]
+    bins = np.asarray(bins, dtype=np.float64)
+    n_bins = len(bins)
+
+    totals = productions = attractions = histogram = None
+    if 'totals' in aggregates:
+        totals = np.zeros(lead_shape, dtype=np.float64)
+    if 'productions' in aggregates:
+        productions = np.zeros(lead_shape + (n_zones_from, ), dtype=np.float64)
+    if 'attractions' in aggregates:
+        attractions = np.zeros(lead_shape + (n_zones_to, ), dtype=np.float64)
+    if 'travel_time_histogram' in aggregates and travel_times is not None:
+        histogram = np.zeros(lead_shape + (n_bins, ), dtype=np.float64)
+
+    for slices, block in iter_blocks(demand, buffer_size=buffer_size):
+        # the position of the block in the matrix (over all axes)
+        index = slices + tuple(slice(0, d) for d in shape[len(slices):])
+        lead, rows, cols = index[:-2], index[-2], index[-1]
+        block = np.asarray(block)
+        if totals is not None:
+            totals[lead] += block.sum(axis=(-2, -1), dtype=np.float64)
+        if productions is not None:
+            productions[lead + (rows, )] += block.sum(axis=-1,
+                                                      dtype=np.float64)
+        if attractions is not None:
+            attractions[lead + (cols, )] += block.sum(axis=-2,
+                                                      dtype=np.float64)
+        if histogram is not None:
+            times = np.asarray(travel_times[index])
+            # trips with unknown travel times are not classified
+            valid = ~np.isnan(times)
+            classes = np.searchsorted(bins, times, side='right') - 1
+            classes = np.clip(classes, 0, n_bins - 1)
+            n_lead = int(np.prod(block.shape[:-2]))
+            classes = classes.reshape(n_lead, -1)
+            weights = np.where(valid, block, 0).reshape(n_lead, -1)
+            counts = np.array([np.bincount(c, weights=w, minlength=n_bins)
+                               for c, w in zip(classes, weights)])
+            histogram[lead] += counts.reshape(block.shape[:-2] + (n_bins, ))
+
+    results = OrderedDict()
+    if totals is not None:
+        results['totals'] = totals
+    if productions is not None:
+        results['productions'] = productions
+    if attractions is not None:
+        results['attractions'] = attractions
+    if histogram is not None:
+        results['travel_time_histogram'] = histogram
+        results['travel_time_bins'] = bins
+    return results
+
+
+def summarize_file(h5_in_path, matrices, input_files=None,
+                   aggregates=AGGREGATES, bins=TIME_BINS):
+    '''
+    compute the aggregates of the demand matrices in the results file
+
+    Parameters
+    ----------
+    h5_in_path: String, the results file (incl. path)
+    matrices: OrderedDict, names of the matrices as keys and tuples
+              (path of the demand matrix, travel times) as values,
+              travel times are tuples (name of the input resource, path of
+              the travel time matrix in the resource file) or None
+    input_files: dict, optional
+                 names of the input resources as keys and their files
+                 (incl. path) as values, the travel times are taken from
+    aggregates: list of Strings, optional
+                the names of the aggregates to compute (see AGGREGATES)
+    bins: list of numbers, optional
+          lower bounds of the classes of travel times
+
+    Return
+    ------
+    summaries: OrderedDict, names of the matrices as keys and their
+               aggregates as values (missing matrices are skipped),
+               None if the file doesn't exist
+    '''
+    if h5_in_path is None or not os.path.exists(h5_in_path):
+        return None
+    input_files = input_files or {}
+    summaries = OrderedDict()
+    with h5_pool.open(h5_in_path) as h5_in:
+        for name, (demand_path, travel_times) in matrices.items():
+            try:
+                demand = h5_in.get_node(demand_path)
+            except tables.NoSuchNodeError:
+                continue
+            times_file = None
+            if travel_times is not None:
+                resource_name, times_path = travel_times
+                times_file = input_files.get(resource_name)
+            if times_file is None or not os.path.exists(times_file):
+                summaries[name] = summarize_matrix(
+                    demand, aggregates=aggregates, bins=bins)
+                continue
+            with h5_pool.open(times_file) as h5_times:
+                try:
+                    times = h5_times.get_node(times_path)
+                except tables.NoSuchNodeError:
+                    times = None
+                summaries[name] = summarize_matrix(
+                    demand, travel_times=times,
+                    aggregates=aggregates, bins=bins)
+    return summaries
+
+
+def write_summary(results_file, summaries):
+    '''
+    write the aggregates into the summary file of the results file, the
+    size and the time of modification of the results file are stored with
+    them (see read_summary)
+
+    Parameters
+    ----------
+    results_file: String, the results file (incl. path) the aggregates
+                  were computed of
+    summaries: OrderedDict, names of the matrices as keys and the aggregates
+               of each matrix as values (see summarize_matrix)
+    '''
+    filename = summary_file(results_file)
+    stats = os.stat(results_file)
+    # write into temporary file first, an interrupted write shall not
+    # leave a corrupt summary
+    tmp_filename = filename + '.tmp'
+    h5_out = tables.open_file(tmp_filename, 'w')
+    try:
+        group = h5_out.create_group('/', SUMMARY_GROUP)
+        group._v_attrs.source_size = stats.st_size
+        group._v_attrs.source_mtime = stats.st_mtime
+        for name, aggregates in summaries.items():
+            matrix_group = h5_out.create_group(group, name)
+            for aggregate, values in aggregates.items():
+                h5_out.create_array(matrix_group, aggregate, values)
+    finally:
+        h5_out.close()
+    h5_pool.close(filename)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp_filename, filename)
+
+
+def read_summary(results_file):
+    '''
+    read the aggregates from the summary file of the results file
+
+    Return
+    ------
+    summaries: OrderedDict, names of the matrices as keys and the aggregates
+               of each matrix as values, None if there is no summary or if
+               the results file changed after it was summarized
+    '''
+    filename = summary_file(results_file)
+    if not os.path.exists(filename) or not os.path.exists(results_file):
+        return None
+    stats = os.stat(results_file)
+    summaries = OrderedDict()
+    with h5_pool.open(filename) as h5_in:
+        try:
+            group = h5_in.get_node('/' + SUMMARY_GROUP)
+        except tables.NoSuchNodeError:
+            return None
+        attrs = group._v_attrs
+        if (getattr(attrs, 'source_size', None) != stats.st_size or
+            getattr(attrs, 'source_mtime', None) != stats.st_mtime):
+            return None
+        for matrix_group in h5_in.iter_nodes(group, classname='Group'):
+            aggregates = OrderedDict()
+            for array in h5_in.iter_nodes(matrix_group, classname='Array'):
+                aggregates[array._v_name] = array.read()
+            summaries[matrix_group._v_name] = aggregates
+    return summaries
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        telemetry.py
+## Purpose:     samples the resource usage (cpu, memory, i/o) of the process of
+##              a traffic model run in a background thread, the samples are
+##              kept as a compact time series and summed up when the run is
+##              finished
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import csv
+import time
+import ctypes
+import platform
+import threading
+from collections import OrderedDict
+
+# maximum number of samples kept, if exceeded every second sample is dropped
+# and the interval is doubled (long runs still cover the whole run)
+MAX_SAMPLES = 1000
+
+# columns of the time series
+SAMPLE_FIELDS = ['time', 'cpu_percent', 'rss', 'read_bytes', 'write_bytes']
+
+
+def process_id(process):
+    '''
+    get the id of the process of a QProcess (resp. Process), on Windows the
+    QProcess returns a pointer to the PROCESS_INFORMATION instead of the id
+
+    Return
+    ------
+    pid: int, None if not running
+    '''
+    pid = process.pid()
+    if not pid:
+        return None
+    if platform.system() == 'Windows' and not isinstance(pid, (int, long)):
+        class PROCESS_INFORMATION(ctypes.Structure):
+            _fields_ = [('hProcess', ctypes.c_void_p),
+                        ('hThread', ctypes.c_void_p),
+                        ('dwProcessId', ctypes.c_ulong),
+                        ('dwThreadId', ctypes.c_ulong)]
+        info = ctypes.cast(int(pid), ctypes.POINTER(PROCESS_INFORMATION))
+        return info.contents.dwProcessId
+    return int(pid)
+
+
+def _read_windows_stats(pid):
+    class FILETIME(ctypes.Structure):
+        _fields_ = [('dwLowDateTime', ctypes.c_ulong),
+                    ('dwHighDateTime', ctypes.c_ulong)]
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', ctypes.c_ulong),
+                    ('PageFaultCount', ctypes.c_ulong),
+                    ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t),
+                    ('PeakPagefileUsage', ctypes.c_size_t)]
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [('ReadOperationCount', ctypes.c_ulonglong),
+                    ('WriteOperationCount', ctypes.c_ulonglong),
+                    ('OtherOperationCount', ctypes.c_ulonglong),
+                    ('ReadTransferCount', ctypes.c_ulonglong),
+                    ('WriteTransferCount', ctypes.c_ulonglong),
+                    ('OtherTransferCount', ctypes.c_ulonglong)]
+    PROCESS_QUERY_INFORMATION = 0x0400
+    PROCESS_VM_READ = 0x0010
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(
+        PROCESS_QUERY_INFORMATION | PROCESS_VM_READ, False, pid)
+    if not handle:
+        return None
+    try:
+        creation, exit, kernel, user = (FILETIME(), FILETIME(), FILETIME(),
+                                        FILETIME())
+        if not kernel32.GetProcessTimes(
+            handle, ctypes.byref(creation), ctypes.byref(exit),
+            ctypes.byref(kernel), ctypes.byref(user)):
+            return None
+        # times are given in 100 ns
+        cpu_time = sum(((t.dwHighDateTime << 32) + t.dwLowDateTime) * 1e-7
+                       for t in [kernel, user])
+        memory = PROCESS_MEMORY_COUNTERS()
+        memory.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            handle, ctypes.byref(memory), memory.cb)
+        io = IO_COUNTERS()
+        kernel32.GetProcessIoCounters(handle, ctypes.byref(io))
+        return {'cpu_time': cpu_time,
+                'rss': memory.WorkingSetSize,
+                'peak_rss': memory.PeakWorkingSetSize,
+                'read_bytes': io.ReadTransferCount,
+                'write_bytes': io.WriteTransferCount}
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _read_proc_stats(pid):
+    folder = os.path.join('/proc', str(pid))
+    try:
+        with open(os.path.join(folder, 'stat')) as f:
+            # the name of the program (2nd field) may contain whitespaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = float(os.sysconf('SC_CLK_TCK'))
+        # utime and stime (14th and 15th field)
+        cpu_time = (int(fields[11]) + int(fields[12])) / ticks
+        stats = {'cpu_time': cpu_time, 'rss': 0, 'peak_rss': 0,
+                 'read_bytes': 0, 'write_bytes': 0}
+        with open(os.path.join(folder, 'status')) as f:
+            for line in f:
+                # values are given in kB
+                if line.startswith('VmRSS:'):
+                    stats['rss'] = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    stats['peak_rss'] = int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    try:
+        with open(os.path.join(folder, 'io')) as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in ['read_bytes', 'write_bytes']:
+                    stats[key] = int(value)
+    except (IOError, OSError, ValueError):
+        # no permission to read the i/o of the process
+        pass
+    return stats
+
+
+def read_process_stats(pid):
+    '''
+    get the resource usage of the process with the given id
+
+    Return
+    ------
+    stats: dict with the cpu time in seconds (cpu_time), the current and the
+           peak resident memory (rss, peak_rss) and the bytes read from
+           and written to storage (read_bytes, write_bytes),
+           None if the process is not running (anymore)
+    '''
+    try:
+        if platform.system() == 'Windows':
+            return _read_windows_stats(pid)
+        return _read_proc_stats(pid)
+    except Exception:
+        return None
+
+
+class RunTelemetry(object):
+    '''
+    samples the resource usage of the process of a run in a background thread
+
+    Parameters
+    ----------
+    interval: float, optional
+              seconds between two samples
+    '''
+    def __init__(self, interval=5):
+        self.interval = max(0.1, float(interval))
+        self.samples = []
+        self.summary = OrderedDict()
+        self._pid = None
+        self._start_time = None
+        self._end_time = None
+        self._last = None
+        self._peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, pid):
+        '''
+        start sampling the process with the given id
+        '''
+        self._pid = pid
+        self._start_time = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        stop sampling and sum up the samples (see summary)
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._end_time = time.time()
+        self.summary = self._summarize()
+
+    def _run(self):
+        interval = self.interval
+        while True:
+            self._sample()
+            if len(self.samples) > MAX_SAMPLES:
+                with self._lock:
+                    self.samples = self.samples[::2]
+                interval *= 2
+            if self._stop.wait(interval):
+                break
+
+    def _sample(self):
+        stats = read_process_stats(self._pid)
+        if stats is None:
+            return
+        now = time.time()
+        cpu_percent = 0.
+        if self._last is not None:
+            last_time, last_cpu = self._last
+            if now > last_time:
+                cpu_percent = (100. * (stats['cpu_time'] - last_cpu) /
+                               (now - last_time))
+        self._last = (now, stats['cpu_time'])
+        self._peak_rss = max(self._peak_rss, stats['peak_rss'],
+                             stats['rss'])
+        with self._lock:
+            self.samples.append((round(now - self._start_time, 1),
+                                 round(cpu_percent, 1), stats['rss'],
+                                 stats['read_bytes'], stats['write_bytes']))
+
+    def _summarize(self):
+        summary = OrderedDict()
+        wall_time = self._end_time - self._start_time
+        summary['wall_time'] = round(wall_time, 1)
+        if self._last is not None:
+            cpu_time = self._last[1]
+            summary['cpu_time'] = round(cpu_time, 1)
+            if wall_time > 0:
+                summary['cpu_percent'] = round(100. * cpu_time / wall_time, 1)
+        summary['peak_rss'] = self._peak_rss
+        if self.samples:
+            summary['read_bytes'] = self.samples[-1][3]
+            summary['write_bytes'] = self.samples[-1][4]
+        return summary
+
+    def write_csv(self, filename):
+        '''
+        write the samples as time series into a csv file
+        '''
+        with self._lock:
+            samples = list(self.samples)
+        with open(filename, 'wb') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(SAMPLE_FIELDS)
+            writer.writerows(samples)
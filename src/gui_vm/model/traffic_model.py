@@ -22,7 +22,14 @@ from gui_vm.config.config import Config
 from functools import partial
 import importlib
 import re
+import threading
 from gui_vm.model.rules import Rule
+from gui_vm.model.summary import (read_summary, write_summary, parse_list,
+                                  AGGREGATES, TIME_BINS)
+from gui_vm.model.progress import ProgressParser
+from gui_vm.model.telemetry import process_id
+from gui_vm.model.outcome import RunOutcome
+from gui_vm.model.backend import h5_lock
 
 config = Config()
 
@@ -32,6 +39,26 @@ class TrafficModel(Observable):
     base class for traffic models
     '''
     FILENAME_DEFAULT = 'project.xml'
+    # name of the script evaluating the results of the model (relative to
+    # the module of the model), the script has to define the functions
+    # compute(h5_file) returning an OrderedDict with the results and
+    # write_csv(results, csv_file), it may define
+    # summarize(h5_file, input_files, aggregates, bins) returning the
+    # aggregates of the demand matrices (see summary.py)
+    EVALUATION_SCRIPT = None
+    # parser of the output of the runs, subclasses of ProgressParser define
+    # the handlers of the output of their model (see progress.py)
+    PROGRESS_PARSER = ProgressParser
+    # False, if the exit codes of the model can't be used to tell whether a
+    # run succeeded (the outcome is decided by the output then)
+    EXIT_CODES = True
+
+    # loaded evaluation scripts by filename (loaded once per process)
+    _evaluation_modules = {}
+    # memoised results by filename of the evaluated file, values are tuples
+    # (size and time of modification of the file, results)
+    _evaluations = {}
+    _evaluation_lock = threading.Lock()
 
     def __init__(self, name):
         super(TrafficModel, self).__init__()
@@ -42,6 +69,8 @@ class TrafficModel(Observable):
         # dictionary with categories of resources as keys
         # items are lists of the resources to this category
         self.resources = {}
+        # dependency graph, built on demand (see dependencies)
+        self._dependencies = None
 
     def process(self):
         pass
@@ -79,6 +108,7 @@ class TrafficModel(Observable):
                             .format(resource.name) +
                             'but the names have to be unique!')
         self.resources[resource.name] = resource
+        self._dependencies = None
 
     def add_resources(self, *args):
         '''
@@ -99,6 +129,86 @@ class TrafficModel(Observable):
         for resource in self.resources:
             resource.validate()
 
+    def monitor_resources(self):
+        '''
+        get the names of the resources, the monitored attributes are taken
+        from
+
+        Return
+        ------
+        resources: dict, names of the monitored attributes as keys and the
+                   names of the resources as values
+        '''
+        resources = {}
+        for monitor_name, (pretty_name, reference) in self.monitored.items():
+            # reference is name of resource + path inside the resource
+            resources[monitor_name] = reference.split('/')[0]
+        return resources
+
+    @property
+    def dependencies(self):
+        '''
+        dependency graph between the resources and the monitored attributes,
+        a resource depends on a monitored attribute, if rules of the resource
+        (or of its children) or its placeholder columns reference it
+
+        Return
+        ------
+        tuple of dicts (provided, dependents),
+        provided: names of the resources as keys, lists of the names of the
+                  monitored attributes taken from them as values
+        dependents: names of the monitored attributes as keys, sets of the
+                    names of the resources depending on them as values
+        '''
+        if self._dependencies is not None:
+            return self._dependencies
+        provided = {}
+        for monitor_name, res_name in self.monitor_resources().items():
+            provided.setdefault(res_name, []).append(monitor_name)
+        dependents = {}
+
+        def add_references(res_name, resource):
+            fields = list(getattr(resource, 'placeholder_fields', []))
+            for rule in resource.rules:
+                if rule.reference is not None:
+                    fields.extend(rule.referenced_fields)
+            for field in fields:
+                if field in self.monitored:
+                    dependents.setdefault(field, set()).add(res_name)
+            for child in resource.children:
+                add_references(res_name, child)
+
+        for res_name, resource in self.resources.items():
+            add_references(res_name, resource)
+        self._dependencies = provided, dependents
+        return self._dependencies
+
+    def dependent_resources(self, resource_names):
+        '''
+        get the resources, whose validity may change, if the given resources
+        change (transitive via the monitored attributes)
+
+        Parameters
+        ----------
+        resource_names: list of Strings, names of the changed resources
+
+        Return
+        ------
+        names: set of Strings, names of the affected resources
+               (incl. the given ones)
+        '''
+        provided, dependents = self.dependencies
+        affected = set(resource_names)
+        queue = list(resource_names)
+        while queue:
+            res_name = queue.pop()
+            for monitor_name in provided.get(res_name, []):
+                for dependent in dependents.get(monitor_name, []):
+                    if dependent not in affected:
+                        affected.add(dependent)
+                        queue.append(dependent)
+        return affected
+
     def resource_config_from_xml(self, filename):
         parser = ResourceConfigXMLParser()
         parser.read(filename)
@@ -151,6 +261,9 @@ class TrafficModel(Observable):
                     # change the value of the monitor each time shape is reset
                     table.bind('shape', (lambda attr: lambda shape: self.set(attr, int(shape[0]) if shape else None))(monitor_name))
 
+        # the graph has to be built again with the new monitors
+        self._dependencies = None
+
         # OPTIONS FOR RUNNING THE MODEL (need to be parsed and updated at runtime)
         self._options = OrderedDict()
         options_node = parser.root.find('RunOptions')
@@ -232,32 +345,236 @@ class TrafficModel(Observable):
         else:
             return None
 
-    # SUBCLASSES HAVE TO OVERRIDE THIS METHOD! (called by the GUI control)
+    @property
+    def supports_checkpoints(self):
+        '''
+        True, if the arguments passing the folder for the checkpoints to the
+        model are set in the settings of the model
+        '''
+        model_settings = config.settings['trafficmodels'][self.name]
+        return bool(model_settings.get('checkpoint_arguments'))
+
+    def command(self, scenario_name, xml_file=None, run_name=None,
+                checkpoint_folder=None, resume_from=None):
+        '''
+        the command running the traffic model (executable and arguments are
+        taken from the settings of the model)
+
+        Parameters
+        ----------
+        checkpoint_folder: String, optional
+                           the folder the model writes its checkpoints into
+                           (only passed if the model supports checkpoints)
+        resume_from: String, optional
+                     the checkpoint (incl. path) the model resumes the run
+                     from
+
+        Return
+        ------
+        command: String
+        '''
+        model_settings = config.settings['trafficmodels'][self.name]
+        arguments = model_settings['arguments']
+        executable = model_settings['executable']
+        cmd = '"{e}" {a}'.format(e=executable, a=arguments)
+        cmd_scen_name = '-n "{}"'.format(scenario_name)
+
+        if run_name is not None:
+            cmd_run_name = '-r "{}"'.format(run_name)
+        else:
+            cmd_run_name=''
+
+        if xml_file is not None:
+            cmd_xml_file = '-xml "{}"'.format(xml_file)
+        else:
+            cmd_xml_file=''
+
+        # the arguments are templates, e.g. '-checkpoints "{folder}"' and
+        # '-resume "{checkpoint}"'
+        cmd_checkpoints = ''
+        if checkpoint_folder is not None and self.supports_checkpoints:
+            cmd_checkpoints = model_settings['checkpoint_arguments'].format(
+                folder=checkpoint_folder)
+            if resume_from is not None:
+                cmd_checkpoints += ' ' + model_settings.get(
+                    'resume_arguments', '').format(checkpoint=resume_from)
+
+        return ' '.join([cmd, cmd_scen_name, cmd_run_name, cmd_xml_file,
+                         cmd_checkpoints])
+
     def run(self, scenario_name, process, callback=None,
-            on_success=None, xml_file=None, run_name=None):
+            on_success=None, xml_file=None, run_name=None, telemetry=None,
+            outcome=None, checkpoint_folder=None, resume_from=None):
         '''
-        run the traffic model
+        run the traffic model, the output is parsed with the progress parser
+        of the model (see PROGRESS_PARSER), the outcome of the run is decided
+        when the process finished
 
         Parameters
         ----------
         scenario_name: String, name of the scenario
         process: a clean qtProcess to run the model in
         callback: function to track the progress
-        on_success: is executed after successfully running the model
+        on_success: is executed after the process finished, if the run
+                    succeeded (see outcome)
         run_name: name of the run inside the scenario
         xml_file: absolute path to a xml-file containing the paths to the used resources and the settings for the scenario and run with the given names (gui_vm project-style)
+        telemetry: RunTelemetry, optional, samples the process while running
+        outcome: RunOutcome, optional, decides the outcome of the run
+        checkpoint_folder: the folder the model writes its checkpoints into
+        resume_from: the checkpoint the run is resumed from
         '''
-        raise NotImplementedError
+        full_cmd = self.command(scenario_name, xml_file=xml_file,
+                                run_name=run_name,
+                                checkpoint_folder=checkpoint_folder,
+                                resume_from=resume_from)
+        parser = self.PROGRESS_PARSER(self)
+        if outcome is None:
+            outcome = RunOutcome()
+
+        def report(lines):
+            if callback and lines:
+                callback('\n'.join(lines), parser.progress)
+
+        def read_output():
+            outcome.heartbeat()
+            lines, events = parser.feed(
+                str(process.readAllStandardOutput()), stream='stdout')
+            err_lines, err_events = parser.feed(
+                str(process.readAllStandardError()), stream='stderr')
+            report(lines + err_lines)
+
+        def start_sampling(*args):
+            telemetry.start(process_id(process))
+
+        def read_rest(*args):
+            if telemetry is not None:
+                telemetry.stop()
+            # the last lines may not be terminated
+            lines, events = parser.flush()
+            report(lines)
+            # the results are handled not before the process finished
+            # (the model may still write them after its final message)
+            exit_code = args[0] if args else process.exitCode()
+            crashed = process.exitStatus() == process.CrashExit
+            # the results are checked and evaluated while other runs may
+            # still be validated or evaluated in other threads
+            with h5_lock:
+                outcome.finish(parser, exit_code, crashed=crashed,
+                               exit_codes=self.EXIT_CODES)
+                if outcome.message and callback:
+                    callback(outcome.message, parser.progress)
+                if outcome.succeeded and on_success:
+                    on_success()
+
+        # QProcess emits `readyRead` when there is data to be read
+        process.readyReadStandardOutput.connect(read_output)
+        process.readyReadStandardError.connect(read_output)
+        process.finished.connect(read_rest)
+        if telemetry is not None:
+            process.started.connect(start_sampling)
+
+        # log the command issued
+        if callback:
+            callback(full_cmd, 0)
+        # start
+        process.start(full_cmd)
 
-    # SUBCLASSES HAVE TO OVERRIDE THIS METHOD! (called by the GUI control)
-    def evaluate (self, file_path, overwrite=False):
+    @property
+    def evaluation_module(self):
+        '''
+        the module of the evaluation script, loaded once
         '''
-        evaluate the demand file at the given path and run the evaluation script
-        (creates csv file)
+        if self.EVALUATION_SCRIPT is None:
+            return None
+        model_path = os.path.dirname(sys.modules[self.__module__].__file__)
+        script = os.path.join(model_path, self.EVALUATION_SCRIPT)
+        with self._evaluation_lock:
+            module = self._evaluation_modules.get(script)
+            if module is None:
+                module = imp.load_source(
+                    'evaluate_{}'.format(self.name.lower()), script)
+                self._evaluation_modules[script] = module
+        return module
+
+    def evaluate(self, file_path, overwrite=False, export_csv=False):
+        '''
+        evaluate the results file at the given path with the evaluation
+        script (in this process), the results are memoised per file as long
+        as the file doesn't change
 
         Parameters
         ----------
-        file_path: path to file, the evaluation will be written to
-        overwrite: overwrite existing files, if True
+        file_path:  path to the results file, that will be evaluated
+        overwrite:  evaluate again even if the results are memoised and
+                    overwrite an existing csv file, if True
+        export_csv: write the results into a csv file next to the results
+                    file, if True
+
+        Return
+        ------
+        results: OrderedDict, names of the results as keys and their values
+                 as values, None if file is not found
+        '''
+        module = self.evaluation_module
+        if module is None or file_path is None or not os.path.exists(file_path):
+            return None
+        key = os.path.normcase(os.path.abspath(file_path))
+        stats = os.stat(file_path)
+        fingerprint = (stats.st_size, stats.st_mtime)
+        with self._evaluation_lock:
+            memo = self._evaluations.get(key)
+        if memo is not None and memo[0] == fingerprint and not overwrite:
+            results = memo[1]
+        else:
+            results = module.compute(file_path)
+            if results is None:
+                return None
+            with self._evaluation_lock:
+                self._evaluations[key] = (fingerprint, results)
+        if export_csv:
+            csv_out = os.path.splitext(file_path)[0] + '.csv'
+            if overwrite or not os.path.exists(csv_out):
+                module.write_csv(results, csv_out)
+        return results
+
+    def summarize(self, file_path, input_files=None, overwrite=False):
+        '''
+        compute the aggregates of the demand matrices in the results file
+        at the given path with the evaluation script and store them in the
+        summary file next to it (see summary.py), the aggregates and the
+        classes of travel times are taken from the settings
+
+        Parameters
+        ----------
+        file_path:   path to the results file, that will be summarized
+        input_files: dict, optional
+                     names of the input resources as keys and their files
+                     (incl. path) as values (needed for the travel times)
+        overwrite:   summarize again even if there is an up to date summary,
+                     if True
+
+        Return
+        ------
+        summaries: OrderedDict, names of the matrices as keys and their
+                   aggregates as values, None if file is not found or the
+                   model can't be summarized
         '''
-        raise NotImplementedError
\ No newline at end of file
+        module = self.evaluation_module
+        if (module is None or not hasattr(module, 'summarize') or
+            file_path is None or not os.path.exists(file_path)):
+            return None
+        if not overwrite:
+            summaries = read_summary(file_path)
+            if summaries is not None:
+                return summaries
+        aggregates = parse_list(config.settings.get('summary_aggregates'),
+                                AGGREGATES)
+        bins = parse_list(config.settings.get('summary_time_bins'),
+                          TIME_BINS, cast=float)
+        summaries = module.summarize(file_path, input_files=input_files,
+                                     aggregates=aggregates, bins=bins)
+        if summaries is None:
+            return None
+        write_summary(file_path, summaries)
+        return summaries
\ No newline at end of file
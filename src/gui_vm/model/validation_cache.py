@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        validation_cache.py
+## Purpose:     persistent cache of the states of checked resources, allows
+##              skipping the analysis of resource files that didn't change
+##              since they were checked the last time
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import hashlib
+import cPickle as pickle
+import threading
+from gui_vm.model.backend import BUFFER_SIZE
+
+# increase, if the layout of the stored states changes
+# (caches of older versions are discarded then)
+CACHE_VERSION = 2
+
+
+class ValidationCache(object):
+    '''
+    stores the states of resources (see Resource.get_state) together with a
+    fingerprint of the resource file in a file inside the project folder,
+    a state is only restored if the fingerprint of the file still matches
+
+    Parameters
+    ----------
+    project_folder: String,
+                    the folder of the project, the cache is stored in
+    use_hash:       bool, optional
+                    if True, the md5 hash of the file content is part of the
+                    fingerprint (slow for large files), else only the size and
+                    the time of the last modification are compared
+    '''
+    FILENAME = 'validation_cache.pickle'
+
+    def __init__(self, project_folder, use_hash=False):
+        self.project_folder = project_folder
+        self.use_hash = use_hash
+        self.filename = os.path.join(project_folder, self.FILENAME)
+        self._entries = {}
+        # messages of failed reads and writes of the cache file, reported by
+        # the callers (see pop_warnings)
+        self.warnings = []
+        # scenarios may be validated in multiple threads (see scheduler)
+        self._lock = threading.RLock()
+        self.read()
+
+    @staticmethod
+    def key(model_name, resource_name, filename):
+        '''
+        the key a state of a resource is stored with, the same file may be
+        stored for different resources (different rules apply)
+        '''
+        return (model_name, resource_name,
+                os.path.normcase(os.path.abspath(filename)))
+
+    def fingerprint(self, filename):
+        '''
+        get the fingerprint of a file
+
+        Parameter
+        ---------
+        filename: String, the file (incl. path)
+
+        Return
+        ------
+        fingerprint: tuple of (size, time of modification, md5 hash or None),
+                     None if the file doesn't exist
+        '''
+        if filename is None or not os.path.isfile(filename):
+            return None
+        stats = os.stat(filename)
+        md5 = None
+        if self.use_hash:
+            md5 = hashlib.md5()
+            with open(filename, 'rb') as f:
+                while True:
+                    block = f.read(BUFFER_SIZE)
+                    if not block:
+                        break
+                    md5.update(block)
+            md5 = md5.hexdigest()
+        return (stats.st_size, stats.st_mtime, md5)
+
+    def lookup(self, key, fingerprint):
+        '''
+        get the state of a resource, if it is cached with the given
+        fingerprint
+
+        Parameters
+        ----------
+        key:         tuple, the key of the resource (see ValidationCache.key)
+        fingerprint: tuple, the current fingerprint of the resource file
+
+        Return
+        ------
+        state: dict, the cached state (see Resource.get_state), None if not
+               cached with this fingerprint
+        '''
+        if fingerprint is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        cached_fingerprint, state = entry
+        if cached_fingerprint != fingerprint:
+            return None
+        return state
+
+    def restore(self, key, fingerprint, resource):
+        '''
+        restore the state of the resource, if it is cached with the given
+        fingerprint
+
+        Parameters
+        ----------
+        key:         tuple, the key of the resource (see ValidationCache.key)
+        fingerprint: tuple, the current fingerprint of the resource file
+        resource:    Resource, the resource to restore the state of
+
+        Return
+        ------
+        success: bool, True if the state was restored
+        '''
+        state = self.lookup(key, fingerprint)
+        if state is None:
+            return False
+        resource.restore(state)
+        return True
+
+    def store(self, key, fingerprint, resource):
+        '''
+        store the current state of the resource with the fingerprint of the
+        file it was read from
+        '''
+        if fingerprint is None:
+            return
+        state = resource.get_state()
+        with self._lock:
+            self._entries[key] = (fingerprint, state)
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def pop_warnings(self):
+        '''
+        get the messages of the failed reads and writes of the cache file
+        since the last call
+
+        Return
+        ------
+        warnings: list of Strings
+        '''
+        with self._lock:
+            warnings = self.warnings
+            self.warnings = []
+        return warnings
+
+    def read(self):
+        '''
+        read the cache from file, corrupt caches or caches of older versions
+        are discarded
+        '''
+        self._entries = {}
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, 'rb') as f:
+                content = pickle.load(f)
+        except Exception, e:
+            self.warnings.append('Der Cache der Prüfungen konnte nicht '
+                                 'gelesen werden ({})'.format(e))
+            return
+        if (not isinstance(content, dict) or
+            content.get('version') != CACHE_VERSION):
+            return
+        self._entries = content['entries']
+
+    def write(self):
+        '''
+        write the cache to file, the entries of files that don't exist anymore
+        are dropped
+        '''
+        with self._lock:
+            for key in self._entries.keys():
+                if not os.path.isfile(key[2]):
+                    del self._entries[key]
+            content = {'version': CACHE_VERSION,
+                       'entries': self._entries}
+            # write into temporary file first, an interrupted write shall not
+            # leave a corrupt cache
+            tmp_filename = self.filename + '.tmp'
+            try:
+                with open(tmp_filename, 'wb') as f:
+                    pickle.dump(content, f, pickle.HIGHEST_PROTOCOL)
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(tmp_filename, self.filename)
+            except (IOError, OSError), e:
+                self.warnings.append('Der Cache der Prüfungen konnte nicht '
+                                     'geschrieben werden ({})'.format(e))
@@ -4,27 +4,68 @@ from argparse import ArgumentParser
 from collections import OrderedDict
 import os
 import csv
+from gui_vm.model.backend import h5_pool, blockwise_sum
+from gui_vm.model.summary import (summarize_file, read_summary, AGGREGATES,
+                                  TIME_BINS)
 
-def evaluate(h5_in_path, csv_out):
+# the summarized demand matrices and the travel times they are classified
+# by (name of the input resource and path of the travel times)
+MATRICES = OrderedDict([
+    ('trips_mij', ('/trips_mij', ('matrices', '/travel_time'))),
+])
+
+
+def summarize(h5_in_path, input_files=None, aggregates=AGGREGATES,
+              bins=TIME_BINS):
+    '''
+    compute the aggregates of the demand matrices per mode
+    (see summary.summarize_file)
+    '''
+    return summarize_file(h5_in_path, MATRICES, input_files=input_files,
+                          aggregates=aggregates, bins=bins)
+
+
+def compute(h5_in_path):
+    '''
+    compute the sums and shares of the trips per mode of the demand file
 
+    Parameter
+    ---------
+    h5_in_path: String, the demand file (incl. path)
+
+    Return
+    ------
+    meta: OrderedDict, names of the results as keys and their values as
+          values (sums as ints, shares as formatted Strings), None if the
+          file doesn't exist
+    '''
     mode_path = '/trips_mij'
     meta = OrderedDict()
     modes_sum = 0
 
     if h5_in_path is None or not os.path.exists(h5_in_path):
         print('Datei {} nicht vorhanden!'.format(h5_in_path))
-        return
+        return None
 
-    with tables.open_file(h5_in_path) as h5_in:
+    # the totals of an up to date summary are taken instead of reading the
+    # matrices again
+    summary = read_summary(h5_in_path) or {}
+    aggregates = summary.get('trips_mij', {})
 
-        try:
-            table = h5_in.get_node(mode_path).read()
-            sum_of_each_mode = table.sum(1).sum(1)
-        except tables.NoSuchNodeError as e:
-            print(e.message)
-            meta = {'Fehler': 'Benötigte Tabelle fehlt: "{}"'.format(
-                e.message
-            )}
+    if 'totals' in aggregates:
+        sum_of_each_mode = aggregates['totals']
+    else:
+        with h5_pool.open(h5_in_path) as h5_in:
+            try:
+                # summed up blockwise per mode, the matrices are not read at
+                # once
+                sum_of_each_mode = blockwise_sum(h5_in.get_node(mode_path),
+                                                 axis=0)
+            except tables.NoSuchNodeError as e:
+                print(e.message)
+                return OrderedDict([('Fehler', 'Benötigte Tabelle fehlt: "{}"'.format(
+                    e.message
+                ))])
 
     n_modes = len(sum_of_each_mode)
     for mode in xrange(n_modes):
@@ -38,12 +79,22 @@ def evaluate(h5_in_path, csv_out):
         name = 'Verkehrsmittel {}'.format(mode)
         mode_sum = sum_of_each_mode[mode]
         meta['Anteil ' + name] = '{:.2%}'.format(mode_sum / modes_sum)
+    return meta
 
+def write_csv(meta, csv_out):
+    '''
+    export the computed results into a csv file (header and a single row)
+    '''
     with open(csv_out, 'wb') as csv_file:
         w = csv.DictWriter(csv_file, meta.keys())
         w.writeheader()
         w.writerow(meta)
 
+def evaluate(h5_in_path, csv_out):
+    meta = compute(h5_in_path)
+    if meta is not None:
+        write_csv(meta, csv_out)
+
 def startmain():
     parser = ArgumentParser(description="Wiver Evaluation")
 
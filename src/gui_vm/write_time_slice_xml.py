@@ -22,6 +22,7 @@ import sys
 from tables.exceptions import NoSuchNodeError
 
 from gui_vm.get_param_from_config import Params
+from gui_vm.model.backend import h5_pool
 
 
 class GetTimeSclices(object):
@@ -35,7 +36,7 @@ class GetTimeSclices(object):
                                                             ('Params', ))[0].file_absolute
 
     def import_time_series(self):
-        with tables.open_file(self.h5_params_file) as h:
+        with h5_pool.open(self.h5_params_file) as h:
             try:
                 time_series = h.root.activities.time_series[:]
             except NoSuchNodeError:
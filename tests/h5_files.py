@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        h5_files.py
+## Purpose:     base of the tests working on small HDF5 files written into a
+##              temporary folder
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+import tables
+from gui_vm.model.backend import h5_pool
+
+
+class H5TestCase(unittest.TestCase):
+    '''
+    writes HDF5 files into a temporary folder, the folder is removed after
+    each test (incl. the files opened in the pool)
+    '''
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='gui_vm_test_')
+        self._opened = []
+
+    def tearDown(self):
+        for h5_file in self._opened:
+            h5_file.close()
+        h5_pool.close_folder(self.folder)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write_file(self, nodes, name=None, chunkshape=None):
+        '''
+        write the given nodes into a file, structured arrays are written as
+        tables, the others as arrays (chunked and compressed, if chunkshape
+        is given, contiguous else)
+
+        Parameters
+        ----------
+        nodes:      dict, paths of the nodes (without leading /) as keys and
+                    numpy arrays as values
+        name:       String, optional
+                    the name of the file (a new one if not given)
+        chunkshape: tuple, optional
+                    the chunkshape of the arrays
+
+        Return
+        ------
+        filename: String, the file (incl. path)
+        '''
+        if name is None:
+            name = 'test_{}.h5'.format(len(os.listdir(self.folder)))
+        filename = os.path.join(self.folder, name)
+        with tables.open_file(filename, 'w') as h5_file:
+            for path, data in nodes.items():
+                if data.dtype.names is not None:
+                    h5_file.create_table('/', path, obj=data)
+                elif chunkshape is not None:
+                    h5_file.create_carray('/', path, obj=data,
+                                          chunkshape=chunkshape,
+                                          filters=tables.Filters(complevel=1))
+                else:
+                    h5_file.create_array('/', path, obj=data)
+        return filename
+
+    def open_node(self, filename, path):
+        '''
+        open the file for reading and get the node with the given path, the
+        file is closed after the test
+        '''
+        h5_file = tables.open_file(filename, 'r')
+        self._opened.append(h5_file)
+        return h5_file.get_node('/' + path)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        test_backend.py
+## Purpose:     tests of the chunkwise analysis of the content of HDF5 files
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+from h5_files import H5TestCase
+from gui_vm.model.backend import (table_statistics, find_violations,
+                                  find_duplicates, iter_blocks, blockwise_sum,
+                                  memmap_array, array_extrema)
+from gui_vm.model.rules import CompareRule, Rule
+
+# small buffers, so that the nodes are read in many chunks
+BUFFER_SIZE = 64
+
+
+class TableStatisticsTest(H5TestCase):
+
+    def setUp(self):
+        super(TableStatisticsTest, self).setUp()
+        n_rows = 1000
+        data = np.zeros(n_rows, dtype=[('zone', np.int64),
+                                       ('share', np.float64),
+                                       ('name', 'S8')])
+        data['zone'] = np.arange(n_rows) - 10
+        data['share'] = np.linspace(0., 1., n_rows)
+        data['name'] = 'zone'
+        data['share'][[3, 500, 999]] = np.nan
+        data['name'][[7, 8]] = ''
+        self.data = data
+        filename = self.write_file({'zones': data})
+        self.table = self.open_node(filename, 'zones')
+
+    def test_statistics(self):
+        statistics = table_statistics(self.table, buffer_size=BUFFER_SIZE)
+        self.assertEqual(list(statistics.keys()), ['zone', 'share', 'name'])
+        zone = statistics['zone']
+        self.assertEqual((zone['min'], zone['max']), (-10, 989))
+        self.assertEqual(zone['n_null'], 0)
+        self.assertEqual(zone['dtype'], np.dtype(np.int64))
+        # NaNs propagate into the extrema like they do in max() and min()
+        share = statistics['share']
+        self.assertTrue(np.isnan(share['min']) and np.isnan(share['max']))
+        self.assertEqual(share['n_null'], 3)
+        name = statistics['name']
+        self.assertEqual((name['min'], name['max']), (None, None))
+        self.assertEqual(name['n_null'], 2)
+
+    def test_chunks_match_full_read(self):
+        # the same statistics for any buffer size
+        small = table_statistics(self.table, columns=['zone'],
+                                 buffer_size=BUFFER_SIZE)
+        full = table_statistics(self.table, columns=['zone'])
+        self.assertEqual(small['zone']['min'], self.data['zone'].min())
+        self.assertEqual(small['zone']['max'], full['zone']['max'])
+
+    def test_without_columns(self):
+        self.assertEqual(table_statistics(self.table, columns=[]), {})
+
+    def test_empty_table(self):
+        filename = self.write_file(
+            {'empty': np.zeros(0, dtype=[('zone', np.int64)])})
+        statistics = table_statistics(self.open_node(filename, 'empty'))
+        self.assertEqual(statistics['zone']['min'], None)
+        self.assertEqual(statistics['zone']['n_null'], 0)
+
+
+class FindViolationsTest(H5TestCase):
+
+    def setUp(self):
+        super(FindViolationsTest, self).setUp()
+        Rule.new_pass()
+        self.minimum = CompareRule('min', '>=', '0').mask
+        self.maximum = CompareRule('max', '<=', '100').mask
+
+    def test_table(self):
+        data = np.zeros(500, dtype=[('zone', np.int64), ('share', np.float64)])
+        data['zone'] = np.arange(500)
+        data['zone'][[10, 20, 30, 400]] = -1
+        data['share'][450] = np.nan
+        data['share'][499] = 101.
+        filename = self.write_file({'zones': data})
+        table = self.open_node(filename, 'zones')
+        zone, share = find_violations(
+            table, [('zone', self.minimum), ('share', self.maximum)],
+            n_rows=3, buffer_size=BUFFER_SIZE)
+        self.assertEqual(zone['count'], 4)
+        self.assertEqual(zone['n_values'], 500)
+        self.assertEqual(zone['rows'], [10, 20, 30])
+        self.assertAlmostEqual(zone['fraction'], 4 / 500.)
+        # NaNs violate a maximum as well
+        self.assertEqual(share['count'], 2)
+        self.assertEqual(share['rows'], [450, 499])
+
+    def test_array(self):
+        data = np.ones((50, 4, 4))
+        data[7, 1, 2] = -1
+        data[7, 3, 3] = -2
+        data[42, 0, 0] = -1
+        for chunkshape in [None, (5, 4, 4)]:
+            filename = self.write_file({'matrix': data},
+                                       chunkshape=chunkshape)
+            array = self.open_node(filename, 'matrix')
+            violation, = find_violations(array, [(None, self.minimum)],
+                                         buffer_size=BUFFER_SIZE)
+            # each value is counted, the rows along the first axis are
+            # reported
+            self.assertEqual(violation['count'], 3)
+            self.assertEqual(violation['n_values'], data.size)
+            self.assertEqual(violation['rows'], [7, 42])
+
+    def test_valid(self):
+        data = np.arange(10)
+        filename = self.write_file({'values': data})
+        array = self.open_node(filename, 'values')
+        violation, = find_violations(array, [(None, self.minimum)])
+        self.assertEqual(violation, {'count': 0, 'n_values': 10,
+                                     'fraction': 0., 'rows': []})
+        self.assertEqual(find_violations(array, []), [])
+
+
+class FindDuplicatesTest(H5TestCase):
+
+    def find(self, data, column, **kwargs):
+        filename = self.write_file({'zones': data})
+        table = self.open_node(filename, 'zones')
+        kwargs.setdefault('buffer_size', BUFFER_SIZE)
+        return find_duplicates(table, column, **kwargs)
+
+    def zones(self, dtype, values):
+        data = np.zeros(len(values), dtype=[('key', dtype)])
+        data['key'] = values
+        return data
+
+    def test_unique(self):
+        data = self.zones(np.int64, np.arange(1000)[::-1])
+        self.assertEqual(self.find(data, 'key'), (0, []))
+
+    def test_duplicates(self):
+        values = np.arange(1000)
+        values[[10, 20, 30]] = 5
+        values[999] = 998
+        count, duplicates = self.find(self.zones(np.int64, values), 'key')
+        # 5 occurs 4 times, 998 twice
+        self.assertEqual(count, 4)
+        self.assertEqual(duplicates, [5, 998])
+
+    def test_partitions(self):
+        # the column doesn't fit into memory, it is partitioned by hashes
+        values = np.arange(2000) % 1500
+        data = self.zones(np.int64, values)
+        count, duplicates = self.find(data, 'key', max_memory=1024,
+                                      n_duplicates=3)
+        self.assertEqual(count, 500)
+        self.assertEqual(duplicates, [0, 1, 2])
+        self.assertEqual(self.find(data, 'key')[0], 500)
+
+    def test_int64_extremes(self):
+        values = [2 ** 63 - 1, 2 ** 63 - 2, -2 ** 63, 2 ** 63 - 1]
+        count, duplicates = self.find(self.zones(np.int64, values), 'key',
+                                      max_memory=16)
+        self.assertEqual((count, duplicates), (1, [2 ** 63 - 1]))
+
+    def test_floats(self):
+        # -0.0 equals 0.0, NaNs are never equal
+        values = [0.0, -0.0, np.nan, np.nan, 1.5]
+        count, duplicates = self.find(self.zones(np.float64, values), 'key')
+        self.assertEqual((count, duplicates), (1, [0.0]))
+
+    def test_strings(self):
+        values = ['a', 'b', 'a', 'ab']
+        count, duplicates = self.find(self.zones('S2', values), 'key',
+                                      max_memory=4)
+        self.assertEqual((count, duplicates), (1, ['a']))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class BlockwiseSumTest(H5TestCase):
+
+    def setUp(self):
+        super(BlockwiseSumTest, self).setUp()
+        # modes x zones x zones
+        self.data = np.arange(3 * 7 * 7, dtype=np.float32).reshape(3, 7, 7)
+        self.data[1] *= 0.1
+        self.nodes = [
+            self.open_node(self.write_file({'matrix': self.data}), 'matrix'),
+            self.open_node(self.write_file({'matrix': self.data},
+                                           chunkshape=(1, 3, 7)), 'matrix')
+        ]
+
+    def test_total(self):
+        expected = self.data.astype(np.float64).sum()
+        for node in self.nodes:
+            for buffer_size in [1, BUFFER_SIZE, 10 ** 6]:
+                total = blockwise_sum(node, buffer_size=buffer_size)
+                self.assertAlmostEqual(total, expected, places=6)
+
+    def test_per_mode(self):
+        expected = self.data.astype(np.float64).sum(axis=(1, 2))
+        for node in self.nodes:
+            for buffer_size in [1, BUFFER_SIZE, 10 ** 6]:
+                totals = blockwise_sum(node, axis=0, buffer_size=buffer_size)
+                np.testing.assert_allclose(totals, expected)
+
+    def test_float64_accumulators(self):
+        # float32 sums would lose the small values next to the large one
+        data = np.ones(10 ** 4, dtype=np.float32)
+        data[0] = 2 ** 24
+        node = self.open_node(self.write_file({'values': data}), 'values')
+        self.assertEqual(blockwise_sum(node, buffer_size=BUFFER_SIZE),
+                         2 ** 24 + 10 ** 4 - 1)
+
+    def test_unsupported_axis(self):
+        self.assertRaises(ValueError, blockwise_sum, self.nodes[0], axis=1)
+
+    def test_blocks_cover_array(self):
+        # every value is read exactly once, rows too large for the buffer
+        # are split along the next axis
+        for node in self.nodes:
+            for buffer_size in [1, BUFFER_SIZE, 10 ** 6]:
+                seen = np.zeros(self.data.shape, dtype=int)
+                for slices, block in iter_blocks(node,
+                                                 buffer_size=buffer_size):
+                    seen[slices] += 1
+                    np.testing.assert_array_equal(block, self.data[slices])
+                self.assertTrue((seen == 1).all())
+
+
+class MemmapArrayTest(H5TestCase):
+
+    def setUp(self):
+        super(MemmapArrayTest, self).setUp()
+        self.data = np.arange(5 * 6, dtype=np.int32).reshape(5, 6) - 7
+
+    def test_contiguous(self):
+        filename = self.write_file({'matrix': self.data})
+        mapped = memmap_array(filename, '/matrix')
+        self.assertIsInstance(mapped, np.memmap)
+        np.testing.assert_array_equal(mapped, self.data)
+        del mapped
+
+    def test_not_mappable(self):
+        chunked = self.write_file({'matrix': self.data}, chunkshape=(2, 6))
+        self.assertIsNone(memmap_array(chunked, '/matrix'))
+        empty = self.write_file({'matrix': np.zeros((0, 3))})
+        self.assertIsNone(memmap_array(empty, '/matrix'))
+        self.assertIsNone(memmap_array(empty, '/missing'))
+
+    def test_extrema(self):
+        for chunkshape in [None, (2, 6)]:
+            node = self.open_node(
+                self.write_file({'matrix': self.data}, chunkshape=chunkshape),
+                'matrix')
+            self.assertEqual(array_extrema(node, buffer_size=BUFFER_SIZE),
+                             (-7, 22))
+
+    def test_extrema_nan(self):
+        data = np.linspace(0., 1., 100)
+        data[50] = np.nan
+        for chunkshape in [None, (10, )]:
+            node = self.open_node(
+                self.write_file({'values': data}, chunkshape=chunkshape),
+                'values')
+            minimum, maximum = array_extrema(node, buffer_size=BUFFER_SIZE)
+            self.assertTrue(np.isnan(minimum) and np.isnan(maximum))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        test_comparison.py
+## Purpose:     tests of the comparison of the demand matrices of two runs
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+from h5_files import H5TestCase
+from gui_vm.model.comparison import compare_matrices
+
+# small buffers, so that the matrices are read in many blocks
+BUFFER_SIZE = 64
+
+
+class CompareMatricesTest(H5TestCase):
+
+    def setUp(self):
+        super(CompareMatricesTest, self).setUp()
+        # modes x origins x destinations, the second mode has no trips in
+        # the base matrix
+        self.base = np.arange(2 * 4 * 5, dtype=np.float32).reshape(2, 4, 5)
+        self.base[1] = 0
+        self.other = self.base.copy()
+        self.other[0, 1, 2] += 3
+        self.other[0, 3, 0] -= 5
+        self.other[1, 2, 4] = 0.5
+
+    def check(self, results):
+        base = self.base.astype(np.float64)
+        other = self.other.astype(np.float64)
+        difference = other - base
+        np.testing.assert_allclose(results['totals_base'],
+                                   base.sum(axis=(1, 2)))
+        np.testing.assert_allclose(results['totals'], other.sum(axis=(1, 2)))
+        np.testing.assert_allclose(results['difference'], [-2, 0.5])
+        # no relative change of a mode without trips in the base matrix
+        self.assertAlmostEqual(results['relative_change'][0],
+                               -2. / base[0].sum())
+        self.assertTrue(np.isnan(results['relative_change'][1]))
+        np.testing.assert_allclose(results['abs_difference'], [8, 0.5])
+        np.testing.assert_allclose(results['max_abs_difference'], [5, 0.5])
+        np.testing.assert_array_equal(results['changed_cells'], [2, 1])
+        np.testing.assert_allclose(results['productions_difference'],
+                                   difference.sum(axis=2))
+        np.testing.assert_allclose(results['attractions_difference'],
+                                   difference.sum(axis=1))
+
+    def test_arrays(self):
+        for buffer_size in [1, BUFFER_SIZE, 10 ** 6]:
+            self.check(compare_matrices(self.base, self.other,
+                                        buffer_size=buffer_size))
+
+    def test_files(self):
+        # differently chunked (or contiguous) matrices are compared
+        for base_chunks, other_chunks in [(None, None), ((1, 2, 5), None),
+                                          (None, (1, 3, 5)),
+                                          ((1, 4, 5), (2, 1, 5))]:
+            base = self.open_node(
+                self.write_file({'demand': self.base}, chunkshape=base_chunks),
+                'demand')
+            other = self.open_node(
+                self.write_file({'demand': self.other},
+                                chunkshape=other_chunks), 'demand')
+            for buffer_size in [1, BUFFER_SIZE]:
+                self.check(compare_matrices(base, other,
+                                            buffer_size=buffer_size))
+
+    def test_equal(self):
+        results = compare_matrices(self.base[0], self.base[0])
+        self.assertEqual(results['difference'], 0)
+        self.assertEqual(results['relative_change'], 0)
+        self.assertEqual(results['changed_cells'], 0)
+
+    def test_wrong_shapes(self):
+        self.assertRaises(ValueError, compare_matrices, self.base,
+                          self.other[0])
+        self.assertRaises(ValueError, compare_matrices, np.ones(3),
+                          np.ones(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
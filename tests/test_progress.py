@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        test_progress.py
+## Purpose:     tests of the parsing of the output of traffic model runs and
+##              of the decision of the outcome of the runs
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import copy
+import unittest
+from gui_vm.config.config import Config
+from gui_vm.model.progress import ProgressParser, ERROR, DONE
+from gui_vm.model.outcome import RunOutcome, SUCCEEDED, FAILED, HUNG
+from gui_vm.model.maxem.maxem import MaxemProgress
+from gui_vm.model.wiver.wiver import WiverProgress
+
+config = Config()
+
+# output of a successful tdmks run (stderr, shortened), the warnings contain
+# 'error' without the run failing
+MAXEM_SUCCESS = '''\
+Start iteration 1
+Calculating Group 1
+INFO->['Erwerbstaetige', 2]
+INFO->['Erwerbstaetige', 2]
+Calculating Group 2
+Wege_Soll: 0, Wege_Ist: 0
+WARNING: ERROR of balancing above tolerance (0.012 > 0.01)
+writing results ... completed
+'''
+
+# output of a tdmks run crashing while writing the results
+MAXEM_TRACEBACK = '''\
+Start iteration 1
+Calculating Group 1
+INFO->['Erwerbstaetige', 1]
+writing results ... completed
+Traceback (most recent call last):
+  File "C:\\tdmks\\main_xml.py", line 212, in <module>
+    main()
+IOError: [Errno 28] No space left on device
+'''
+
+# output of a tdmks run killed during the first iteration
+MAXEM_INCOMPLETE = '''\
+Start iteration 1
+Calculating Group 1
+INFO->['Erwerbstaetige', 4]
+'''
+
+
+class StubModel(object):
+    '''
+    traffic model with the attributes the parsers access
+    '''
+    def __init__(self, name, **values):
+        self.name = name
+        self.values = values
+
+    def get(self, name):
+        return self.values.get(name)
+
+
+def parse(parser, output, chunk_size=7):
+    '''
+    feed the output in chunks splitting the lines and flush the parser
+    '''
+    for i in range(0, len(output), chunk_size):
+        parser.feed(output[i:i + chunk_size], stream='stderr')
+    parser.flush()
+    return parser
+
+
+class LineBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = ProgressParser(StubModel('Test'))
+
+    def test_partial_lines(self):
+        self.assertEqual(self.parser.feed('Trace'), ([], []))
+        self.assertEqual(self.parser.feed('back (most rec'), ([], []))
+        lines, events = self.parser.feed('ent call last):\nnext')
+        self.assertEqual(lines, ['Traceback (most recent call last):'])
+        self.assertEqual([event.kind for event in events], [ERROR])
+        self.assertEqual(self.parser.errors,
+                         ['Traceback (most recent call last):'])
+        # the incomplete line is kept until it is completed or flushed
+        self.assertEqual(self.parser.flush(), (['next'], []))
+        self.assertEqual(self.parser.flush(), ([], []))
+
+    def test_chunk_sizes(self):
+        # the same lines and events, however the output is split
+        expected = MAXEM_TRACEBACK.rstrip('\n').split('\n')
+        for chunk_size in [1, 2, 7, 64, len(MAXEM_TRACEBACK)]:
+            parser = ProgressParser(StubModel('Test'))
+            lines = []
+            for i in range(0, len(MAXEM_TRACEBACK), chunk_size):
+                lines += parser.feed(MAXEM_TRACEBACK[i:i + chunk_size])[0]
+            lines += parser.flush()[0]
+            self.assertEqual(lines, expected)
+            self.assertEqual(len(parser.errors), 1)
+
+    def test_streams(self):
+        # partial lines of different streams are not mixed up
+        self.parser.feed('Traceback (most ', stream='stderr')
+        self.parser.feed('writing results', stream='stdout')
+        lines, events = self.parser.feed('recent call last):\n',
+                                         stream='stderr')
+        self.assertEqual(lines, ['Traceback (most recent call last):'])
+        lines, events = self.parser.feed(' ... completed\n', stream='stdout')
+        self.assertEqual(lines, ['writing results ... completed'])
+
+    def test_carriage_returns(self):
+        lines, events = self.parser.feed(
+            'Traceback (most recent call last):\r\nline\r\n\n')
+        self.assertEqual(lines, ['Traceback (most recent call last):',
+                                 'line', ''])
+        self.assertEqual(len(events), 1)
+        self.assertFalse(self.parser.is_done)
+        self.assertFalse(self.parser.has_sentinel)
+
+
+class ModelPatternsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.models = copy.deepcopy(config.settings['trafficmodels'])
+        self.maxem = StubModel('Maxem', groups_dest_mode=['A', 'B'])
+
+    def tearDown(self):
+        config.settings['trafficmodels'] = self.models
+
+    def test_success(self):
+        parser = parse(MaxemProgress(self.maxem), MAXEM_SUCCESS)
+        self.assertEqual(parser.errors, [])
+        self.assertTrue(parser.is_done)
+        self.assertEqual(parser.progress, 100.)
+        outcome = RunOutcome()
+        # tdmks doesn't return usable exit codes
+        status = outcome.finish(parser, 1, exit_codes=False)
+        self.assertEqual(status, SUCCEEDED)
+
+    def test_traceback_after_final_message(self):
+        parser = parse(MaxemProgress(self.maxem), MAXEM_TRACEBACK)
+        self.assertTrue(parser.is_done)
+        self.assertEqual(parser.errors,
+                         ['Traceback (most recent call last):'])
+        outcome = RunOutcome()
+        self.assertEqual(outcome.finish(parser, 0, exit_codes=False), FAILED)
+        self.assertIn('Traceback', outcome.message)
+
+    def test_incomplete(self):
+        parser = parse(MaxemProgress(self.maxem), MAXEM_INCOMPLETE)
+        self.assertFalse(parser.is_done)
+        outcome = RunOutcome()
+        self.assertEqual(outcome.finish(parser, 0, exit_codes=False), FAILED)
+        self.assertEqual(outcome.message, 'Der Lauf wurde nicht abgeschlossen.')
+
+    def test_patterns_from_settings(self):
+        settings = config.settings['trafficmodels'].setdefault('Maxem', {})
+        settings['done_pattern'] = r'^writing results \.\.\. completed$'
+        settings['error_pattern'] = r'\bERROR\b'
+        parser = parse(MaxemProgress(self.maxem), MAXEM_SUCCESS)
+        self.assertTrue(parser.is_done)
+        self.assertEqual(len(parser.errors), 1)
+        settings['done_pattern'] = r'^Fertig$'
+        parser = parse(MaxemProgress(self.maxem), MAXEM_SUCCESS)
+        self.assertFalse(parser.is_done)
+
+    def test_events(self):
+        parser = MaxemProgress(self.maxem)
+        lines, events = parser.feed(MAXEM_TRACEBACK)
+        kinds = [event.kind for event in events]
+        self.assertEqual(kinds.count(DONE), 1)
+        self.assertEqual(kinds.count(ERROR), 1)
+        self.assertEqual(events[kinds.index(ERROR)].line,
+                         'Traceback (most recent call last):')
+
+
+class RunOutcomeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wiver = StubModel('Wiver', n_groups=2)
+
+    def test_exit_code(self):
+        # without final message the exit code decides
+        parser = parse(WiverProgress(self.wiver), 'Start iteration 1\n')
+        self.assertFalse(parser.has_sentinel)
+        self.assertEqual(RunOutcome().finish(parser, 0), SUCCEEDED)
+        outcome = RunOutcome()
+        self.assertEqual(outcome.finish(parser, 2), FAILED)
+        self.assertIn('2', outcome.message)
+        self.assertEqual(RunOutcome().finish(parser, 2, exit_codes=False),
+                         SUCCEEDED)
+
+    def test_crashed(self):
+        parser = parse(WiverProgress(self.wiver), '')
+        outcome = RunOutcome()
+        self.assertEqual(outcome.finish(parser, 0, crashed=True), FAILED)
+        self.assertEqual(outcome.message, 'Der Lauf wurde abgebrochen.')
+
+    def test_check_output(self):
+        parser = parse(WiverProgress(self.wiver), '')
+        outcome = RunOutcome(check_output=lambda: False)
+        self.assertEqual(outcome.finish(parser, 0), FAILED)
+        outcome = RunOutcome(check_output=lambda: True)
+        self.assertEqual(outcome.finish(parser, 0), SUCCEEDED)
+
+    def test_hung(self):
+        outcome = RunOutcome(heartbeat_timeout=10)
+        self.assertFalse(outcome.check_heartbeat())
+        outcome.last_heartbeat -= 11
+        self.assertTrue(outcome.check_heartbeat())
+        # stays hung, even if the process exits normally afterwards
+        parser = parse(ProgressParser(self.wiver), '')
+        self.assertEqual(outcome.finish(parser, 0), HUNG)
+
+
+if __name__ == '__main__':
+    unittest.main()
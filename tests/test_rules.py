@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        test_rules.py
+## Purpose:     tests of the comparison of monitored values with the targets
+##              of the rules
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+from gui_vm.model.rules import CompareRule, Rule
+
+BIG = 2 ** 53 + 1
+
+
+class Reference(object):
+    n_zones = 3
+
+
+class CompareTest(unittest.TestCase):
+
+    def compare(self, operator, left, right):
+        return CompareRule('field', operator, '').compare(left, right)[0]
+
+    def test_numbers(self):
+        self.assertTrue(self.compare('>=', 5, 5))
+        self.assertFalse(self.compare('>', 5, 5))
+        self.assertTrue(self.compare('==', '5', 5.0))
+        self.assertTrue(self.compare('<', [1, 2.5], ['2', 3]))
+        self.assertFalse(self.compare('<', [1, 4], [2, 3]))
+
+    def test_large_integers(self):
+        # exact beyond the precision of floats
+        self.assertFalse(self.compare('==', BIG, BIG - 1))
+        self.assertTrue(self.compare('>', BIG, BIG - 1))
+        self.assertTrue(self.compare('==', str(BIG), BIG))
+        self.assertTrue(self.compare('==', np.int64(2 ** 63 - 1),
+                                     2 ** 63 - 1))
+        # beyond 64 bits
+        self.assertTrue(self.compare('>', 2 ** 64 + 1, 2 ** 64))
+
+    def test_floats(self):
+        self.assertTrue(self.compare('<', 0.1, 0.10000000000000002))
+        self.assertTrue(self.compare('==', -0.0, 0.0))
+        self.assertTrue(self.compare('>=', '1e3', 1000))
+        self.assertFalse(self.compare('==', float('nan'), float('nan')))
+        self.assertTrue(self.compare('<', 1, float('inf')))
+
+    def test_wildcards(self):
+        self.assertTrue(self.compare('==', [1, 7], [1, '*']))
+        self.assertTrue(self.compare('==', ['', 2], [5, 2]))
+        self.assertFalse(self.compare('==', [1, 7], [2, '*']))
+
+    def test_other_values(self):
+        self.assertTrue(self.compare('==', 'Zonen', 'Zonen'))
+        self.assertFalse(self.compare('!=', 'Zonen', 'Zonen'))
+        # numbers in strings are compared as numbers
+        self.assertTrue(self.compare('<=', ['a', '2'], ['a', 10]))
+        self.assertFalse(self.compare('==', None, 0))
+        # different number of elements
+        self.assertFalse(self.compare('==', [1, 2], [1]))
+
+    def test_reference(self):
+        rule = CompareRule('n_rows', '==', '{n_zones}', reference=Reference())
+
+        class Resource(object):
+            n_rows = 3
+
+        Rule.new_pass()
+        self.assertTrue(rule.check(Resource())[0])
+        Resource.n_rows = 4
+        self.assertFalse(rule.check(Resource())[0])
+
+
+class MaskTest(unittest.TestCase):
+
+    def mask(self, operator, target, values):
+        Rule.new_pass()
+        return CompareRule('min', operator, target).mask(values).tolist()
+
+    def test_mask(self):
+        self.assertEqual(self.mask('>=', '0', np.array([-1, 0, 1])),
+                         [False, True, True])
+        self.assertEqual(self.mask('<', '1.5', np.array([1., 1.5, 2.])),
+                         [True, False, False])
+
+    def test_int64(self):
+        values = np.array([BIG - 1, BIG, BIG + 1], dtype=np.int64)
+        self.assertEqual(self.mask('>=', str(BIG), values),
+                         [False, True, True])
+        self.assertEqual(self.mask('<=', str(2 ** 63 - 1),
+                                   np.array([2 ** 63 - 1], dtype=np.int64)),
+                         [True])
+        values = np.array([2 ** 64 - 1], dtype=np.uint64)
+        self.assertEqual(self.mask('>', '0', values), [True])
+
+    def test_floats(self):
+        values = np.array([np.nan, -np.inf, -0.0, 0.1])
+        # NaNs never meet a minimum or a maximum
+        self.assertEqual(self.mask('>=', '0', values),
+                         [False, False, True, True])
+        self.assertEqual(self.mask('<', '0.1', values),
+                         [False, True, True, False])
+        # integral targets compared with floats
+        self.assertEqual(self.mask('<=', '1e16',
+                                   np.array([1e16, 1e16 + 2])),
+                         [True, False])
+
+    def test_not_applicable(self):
+        # wildcards, lists, strings
+        values = np.array([-1, 2])
+        self.assertEqual(self.mask('>=', '*', values), [True, True])
+        self.assertEqual(self.mask('>=', ['0', '1'], values), [True, True])
+        self.assertEqual(self.mask('>=', '0', np.array(['a', 'b'])),
+                         [True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        test_scheduler.py
+## Purpose:     tests of the queue of traffic model runs
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from gui_vm.model.scheduler import RunScheduler, RunJob
+from gui_vm.model.project_tree import Scenario
+
+PRIMARY = Scenario.PRIMARY_RUN
+
+
+class StubProject(object):
+    def __init__(self, project_folder):
+        self.project_folder = project_folder
+
+
+class RunSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='gui_vm_test_')
+        self.project = StubProject(self.folder)
+        self.executed = []
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def run_function(self, project, scenario_name, run_name, options):
+        with self._lock:
+            self.executed.append((scenario_name, run_name))
+        return self.results.get((scenario_name, run_name), (True, ''))
+
+    def scheduler(self, slots=2):
+        scheduler = RunScheduler(self.project, self.run_function,
+                                 slots=slots, min_free_memory=0)
+        scheduler.START_DELAY = 0
+        scheduler.POLL_INTERVAL = 0.05
+        return scheduler
+
+    def read_log(self, scheduler):
+        with open(scheduler.log_file, 'r') as f:
+            return [(d['scenario'], d['run'], d['status'])
+                    for d in json.load(f)]
+
+    def write_log(self, scheduler, jobs):
+        entries = []
+        for scenario_name, run_name, status in jobs:
+            job = RunJob(scenario_name, run_name=run_name)
+            job.status = status
+            job.started = '01.01.2016 12:00:00'
+            entries.append(job.to_dict())
+        with open(scheduler.log_file, 'w') as f:
+            json.dump(entries, f)
+
+    def test_add(self):
+        scheduler = self.scheduler()
+        job = scheduler.add('A')
+        self.assertIs(scheduler.add('A'), job)
+        scheduler.add('A', run_name='spezifisch')
+        self.assertEqual(self.read_log(scheduler),
+                         [('A', PRIMARY, RunJob.QUEUED),
+                          ('A', 'spezifisch', RunJob.QUEUED)])
+
+    def test_resume(self):
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.resume(), 0)
+        self.write_log(scheduler, [('A', PRIMARY, RunJob.FAILED),
+                                   ('B', PRIMARY, RunJob.SUCCEEDED),
+                                   ('X', PRIMARY, RunJob.RUNNING),
+                                   ('X', PRIMARY, RunJob.QUEUED),
+                                   ('C', PRIMARY, RunJob.HUNG),
+                                   ('D', PRIMARY, RunJob.QUEUED)])
+        # queued before resuming (without writing the log)
+        scheduler.jobs.append(RunJob('D'))
+        # the finished jobs are dropped, interrupted ones are queued again
+        # once, runs queued already are not queued twice
+        self.assertEqual(scheduler.resume(), 1)
+        self.assertEqual(
+            [(j.scenario_name, j.status, j.started) for j in scheduler.jobs],
+            [('X', RunJob.QUEUED, None), ('D', RunJob.QUEUED, None)])
+        scheduler.add('X')
+        scheduler.add('B')
+        self.assertEqual(self.read_log(scheduler),
+                         [('X', PRIMARY, RunJob.QUEUED),
+                          ('D', PRIMARY, RunJob.QUEUED),
+                          ('B', PRIMARY, RunJob.QUEUED)])
+
+    def test_is_ready(self):
+        scheduler = self.scheduler()
+        primary = scheduler.add('A')
+        special = scheduler.add('A', run_name='spezifisch')
+        other = scheduler.add('B', run_name='spezifisch')
+        # runs of the same scenario one after another
+        self.assertFalse(scheduler._is_ready(primary, [special]))
+        self.assertTrue(scheduler._is_ready(primary, [other]))
+        # special runs wait for their primary run
+        self.assertFalse(scheduler._is_ready(special, []))
+        primary.status = RunJob.RUNNING
+        self.assertFalse(scheduler._is_ready(special, []))
+        primary.status = RunJob.SUCCEEDED
+        self.assertTrue(scheduler._is_ready(special, []))
+        # no primary run of the scenario queued
+        self.assertTrue(scheduler._is_ready(other, []))
+
+    def test_is_ready_primary_failed(self):
+        scheduler = self.scheduler()
+        primary = scheduler.add('A')
+        special = scheduler.add('A', run_name='spezifisch')
+        primary.status = RunJob.HUNG
+        self.assertFalse(scheduler._is_ready(special, []))
+        self.assertEqual(special.status, RunJob.FAILED)
+        self.assertEqual(special.message, 'Gesamtlauf fehlgeschlagen')
+
+    def test_run(self):
+        scheduler = self.scheduler(slots=2)
+        scheduler.add('A')
+        scheduler.add('A', run_name='spezifisch')
+        scheduler.add('B')
+        scheduler.add('B', run_name='spezifisch')
+        scheduler.add('C')
+        self.results[('B', PRIMARY)] = (RunJob.HUNG, 'keine Ausgabe')
+        self.assertFalse(scheduler.run())
+        statuses = dict(((j.scenario_name, j.run_name), j.status)
+                        for j in scheduler.jobs)
+        self.assertEqual(statuses, {
+            ('A', PRIMARY): RunJob.SUCCEEDED,
+            ('A', 'spezifisch'): RunJob.SUCCEEDED,
+            ('B', PRIMARY): RunJob.HUNG,
+            ('B', 'spezifisch'): RunJob.FAILED,
+            ('C', PRIMARY): RunJob.SUCCEEDED})
+        # the special run of A after its primary run, the one of B never
+        self.assertLess(self.executed.index(('A', PRIMARY)),
+                        self.executed.index(('A', 'spezifisch')))
+        self.assertNotIn(('B', 'spezifisch'), self.executed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        test_summary.py
+## Purpose:     tests of the aggregates of the demand matrices of runs
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import unittest
+import numpy as np
+from h5_files import H5TestCase
+from gui_vm.model.summary import summarize_matrix
+
+# small buffers, so that the matrices are read in many blocks
+BUFFER_SIZE = 64
+
+
+class SummarizeMatrixTest(H5TestCase):
+
+    def setUp(self):
+        super(SummarizeMatrixTest, self).setUp()
+        # modes x origins x destinations
+        self.demand = (np.arange(2 * 5 * 6, dtype=np.float32)
+                       .reshape(2, 5, 6) / 10)
+        self.times = (np.arange(2 * 5 * 6, dtype=np.float64)
+                      .reshape(2, 5, 6) * 3)
+        self.times[0, 0, :3] = np.nan
+        self.nodes = []
+        for chunkshape in [None, (1, 2, 6)]:
+            self.nodes.append((
+                self.open_node(self.write_file({'demand': self.demand},
+                                               chunkshape=chunkshape),
+                               'demand'),
+                self.open_node(self.write_file({'times': self.times},
+                                               chunkshape=chunkshape),
+                               'times')))
+
+    def expected_histogram(self, bins):
+        histogram = np.zeros((2, len(bins)))
+        for mode in range(2):
+            times = self.times[mode].ravel()
+            demand = self.demand[mode].ravel().astype(np.float64)
+            for time, trips in zip(times, demand):
+                if np.isnan(time):
+                    continue
+                # the last class takes everything above its bound
+                i = max(i for i, bound in enumerate(bins) if time >= bound)
+                histogram[mode, i] += trips
+        return histogram
+
+    def test_aggregates(self):
+        demand = self.demand.astype(np.float64)
+        for demand_node, times_node in self.nodes:
+            for buffer_size in [1, BUFFER_SIZE, 10 ** 6]:
+                results = summarize_matrix(demand_node, times_node,
+                                           buffer_size=buffer_size)
+                self.assertEqual(
+                    list(results.keys()),
+                    ['totals', 'productions', 'attractions',
+                     'travel_time_histogram', 'travel_time_bins'])
+                np.testing.assert_allclose(results['totals'],
+                                           demand.sum(axis=(1, 2)))
+                np.testing.assert_allclose(results['productions'],
+                                           demand.sum(axis=2))
+                np.testing.assert_allclose(results['attractions'],
+                                           demand.sum(axis=1))
+                np.testing.assert_allclose(
+                    results['travel_time_histogram'],
+                    self.expected_histogram(results['travel_time_bins']))
+
+    def test_histogram_classes(self):
+        demand = np.ones((2, 2))
+        times = np.array([[0., 4.99], [5., 1000.]])
+        results = summarize_matrix(demand, times, bins=[0, 5, 60])
+        np.testing.assert_array_equal(results['travel_time_histogram'],
+                                      [2, 1, 1])
+
+    def test_without_travel_times(self):
+        demand_node = self.nodes[0][0]
+        results = summarize_matrix(demand_node, buffer_size=BUFFER_SIZE)
+        self.assertNotIn('travel_time_histogram', results)
+        # travel times of another shape are not used
+        results = summarize_matrix(demand_node, self.times[0])
+        self.assertNotIn('travel_time_histogram', results)
+
+    def test_selected_aggregates(self):
+        results = summarize_matrix(self.demand[0], aggregates=['totals'])
+        self.assertEqual(list(results.keys()), ['totals'])
+        self.assertAlmostEqual(float(results['totals']),
+                               self.demand[0].astype(np.float64).sum(),
+                               places=4)
+
+    def test_wrong_dimensions(self):
+        self.assertRaises(ValueError, summarize_matrix, np.ones(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
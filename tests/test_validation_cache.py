@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+##------------------------------------------------------------------------------
+## File:        test_validation_cache.py
+## Purpose:     tests of the persistent cache of the states of checked
+##              resources
+##
+## Author:      Christoph Franke
+##
+## Created:
+## Copyright:   Gertz Gutsche Rümenapp - Stadtentwicklung und Mobilität GbR
+##------------------------------------------------------------------------------
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from gui_vm.model.validation_cache import ValidationCache
+
+
+class StubResource(object):
+    '''
+    resource with a state only
+    '''
+    def __init__(self, state=None):
+        self.state = state
+
+    def get_state(self):
+        return dict(self.state)
+
+    def restore(self, state):
+        self.state = state
+
+
+class ValidationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='gui_vm_test_')
+        self.filename = os.path.join(self.folder, 'zonen.h5')
+        self.write('content')
+        self.key = ValidationCache.key('Maxem', 'Zonen', self.filename)
+        self.state = {'attributes': {'n_rows': 10}, 'flags': {}}
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write(self, content, mtime=None):
+        with open(self.filename, 'wb') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(self.filename, (mtime, mtime))
+
+    def store(self, cache):
+        fingerprint = cache.fingerprint(self.filename)
+        cache.store(self.key, fingerprint, StubResource(self.state))
+        cache.write()
+
+    def lookup(self, cache):
+        return cache.lookup(self.key, cache.fingerprint(self.filename))
+
+    def test_round_trip(self):
+        self.store(ValidationCache(self.folder))
+        cache = ValidationCache(self.folder)
+        self.assertEqual(self.lookup(cache), self.state)
+        resource = StubResource()
+        self.assertTrue(cache.restore(
+            self.key, cache.fingerprint(self.filename), resource))
+        self.assertEqual(resource.state, self.state)
+        self.assertEqual(cache.pop_warnings(), [])
+
+    def test_changed_file(self):
+        mtime = time.time() - 100
+        self.write('content', mtime=mtime)
+        self.store(ValidationCache(self.folder))
+        # same size, but modified later
+        self.write('CONTENT', mtime=mtime + 10)
+        self.assertEqual(self.lookup(ValidationCache(self.folder)), None)
+        # different size
+        self.write('more content', mtime=mtime)
+        self.assertEqual(self.lookup(ValidationCache(self.folder)), None)
+
+    def test_hashed_content(self):
+        mtime = time.time() - 100
+        self.write('content', mtime=mtime)
+        self.store(ValidationCache(self.folder, use_hash=True))
+        self.assertEqual(
+            self.lookup(ValidationCache(self.folder, use_hash=True)),
+            self.state)
+        # size and time of modification can't tell the difference
+        self.write('CONTENT', mtime=mtime)
+        self.assertEqual(
+            self.lookup(ValidationCache(self.folder, use_hash=True)), None)
+
+    def test_other_resource(self):
+        self.store(ValidationCache(self.folder))
+        cache = ValidationCache(self.folder)
+        key = ValidationCache.key('Maxem', 'Zonen_Tarif', self.filename)
+        self.assertEqual(
+            cache.lookup(key, cache.fingerprint(self.filename)), None)
+
+    def test_removed_file(self):
+        cache = ValidationCache(self.folder)
+        self.store(cache)
+        os.remove(self.filename)
+        self.assertEqual(cache.fingerprint(self.filename), None)
+        self.assertEqual(self.lookup(cache), None)
+        # the entries of removed files are dropped when written
+        cache.write()
+        self.write('content')
+        cache = ValidationCache(self.folder)
+        self.assertEqual(self.lookup(cache), None)
+
+    def test_corrupt_cache(self):
+        self.store(ValidationCache(self.folder))
+        with open(os.path.join(self.folder, ValidationCache.FILENAME),
+                  'wb') as f:
+            f.write('no pickle')
+        cache = ValidationCache(self.folder)
+        self.assertEqual(self.lookup(cache), None)
+        warnings = cache.pop_warnings()
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(cache.pop_warnings(), [])
+        # the cache is usable anyway
+        self.store(cache)
+        self.assertEqual(self.lookup(ValidationCache(self.folder)),
+                         self.state)
+
+    def test_unwritable_cache(self):
+        cache = ValidationCache(self.folder)
+        cache.filename = os.path.join(self.folder, 'missing', 'cache.pickle')
+        self.store(cache)
+        self.assertEqual(len(cache.pop_warnings()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()